@@ -0,0 +1,317 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+"""Lunch-rush load benchmark.
+
+Seeds a dataset (see :py:mod:`luncho.seed`) and replays what happens
+around noon: a crowd of users gets their tokens, casts their votes and
+keeps polling the results, from several processes with several threads
+each. The latency percentiles and throughput of each endpoint are printed
+and saved in a JSON file; the previous results in that file are used as
+the baseline, so regressions stand out.
+
+By default, the requests go straight to the Flask app (no network); with
+`--url`, they go to a running server (which must use the same database).
+
+Run it from the repository root::
+
+    python -m benchmarks.lunch_rush --scale small --processes 2 --threads 4
+"""
+
+from __future__ import print_function
+
+import argparse
+import base64
+import json
+import multiprocessing
+import os
+import random
+import tempfile
+import threading
+import time
+import urllib2
+
+from luncho.server import app
+from luncho.server import db
+from luncho.server import user_groups
+from luncho.server import group_places
+
+from luncho import seed
+
+DEFAULT_OUTPUT = os.path.join(os.path.dirname(__file__), 'results',
+                              'lunch_rush.json')
+REGRESSION = 0.10       # changes bigger than this are flagged
+
+
+# ----------------------------------------------------------------------
+#  Clients
+# ----------------------------------------------------------------------
+
+def _auth(token):
+    return {'Authorization': 'Basic ' + base64.b64encode(token + ':x')}
+
+
+class AppClient(object):
+    """Requests straight to the Flask app."""
+    def __init__(self):
+        self.client = app.test_client()
+
+    def request(self, method, path, data=None, token=None):
+        headers = _auth(token) if token else {}
+        response = self.client.open(path,
+                                    method=method,
+                                    data=json.dumps(data) if data else None,
+                                    content_type='application/json',
+                                    headers=headers)
+        return (response.status_code, response.data)
+
+
+class HttpClient(object):
+    """Requests to a running server."""
+    def __init__(self, url):
+        self.url = url.rstrip('/')
+
+    def request(self, method, path, data=None, token=None):
+        headers = _auth(token) if token else {}
+        headers['Content-Type'] = 'application/json'
+        request = urllib2.Request(self.url + path,
+                                  data=json.dumps(data) if data else None,
+                                  headers=headers)
+        request.get_method = lambda: method
+        try:
+            response = urllib2.urlopen(request)
+            return (response.getcode(), response.read())
+        except urllib2.HTTPError as error:
+            return (error.code, error.read())
+
+
+# ----------------------------------------------------------------------
+#  The rush
+# ----------------------------------------------------------------------
+
+def voters(count, seed):
+    """Pick the users that will vote today: (username, group, ballot)."""
+    rand = random.Random(seed)
+    ballots = {}
+    for (group, place) in db.session.query(group_places.c.group,
+                                           group_places.c.place):
+        ballots.setdefault(group, []).append(place)
+
+    groups = {}
+    for (username, group) in db.session.query(user_groups.c.username,
+                                              user_groups.c.group_id):
+        if group in ballots:
+            groups.setdefault(username, []).append(group)
+
+    usernames = sorted(groups)
+    chosen = rand.sample(usernames, min(count, len(usernames)))
+    result = []
+    for username in chosen:
+        group = rand.choice(groups[username])
+        result.append((username, group, ballots[group]))
+    return result
+
+
+def _lunch(client, voter, polls, rand, samples):
+    """A user at lunch time: token, vote, then check the results until
+    they get bored."""
+    (username, group, ballot) = voter
+
+    def timed(endpoint, method, path, data=None, token=None):
+        start = time.time()
+        (status, body) = client.request(method, path, data, token)
+        samples.append((endpoint, time.time() - start, status))
+        return (status, body)
+
+    (status, body) = timed('get_token', 'POST', '/token/',
+                           {'username': username,
+                            'password': seed.PASSWORD})
+    if status != 200:
+        return
+    token = json.loads(body)['token']
+
+    choices = rand.sample(ballot, min(app.config['PLACES_IN_VOTE'],
+                                      len(ballot)))
+    timed('cast_vote', 'POST', '/vote/{0}/'.format(group),
+          {'choices': choices}, token)
+
+    for _ in range(polls):
+        timed('get_vote', 'GET', '/vote/{0}/'.format(group), token=token)
+    return
+
+
+def _worker(arguments):
+    """Run the voters of a process, split in threads."""
+    (database, url, crowd, threads, polls, seed) = arguments
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + database
+
+    samples = []
+    workers = []
+    for pos in range(threads):
+        def run(chunk=crowd[pos::threads], rand=random.Random(seed + pos)):
+            client = HttpClient(url) if url else AppClient()
+            for voter in chunk:
+                _lunch(client, voter, polls, rand, samples)
+            return
+
+        worker = threading.Thread(target=run)
+        worker.start()
+        workers.append(worker)
+
+    for worker in workers:
+        worker.join()
+    return samples
+
+
+# ----------------------------------------------------------------------
+#  Results
+# ----------------------------------------------------------------------
+
+def percentile(values, percent):
+    """Nearest-rank percentile of the (sorted) values."""
+    if not values:
+        return None
+    rank = max(0, int(round(percent / 100.0 * len(values) + 0.5)) - 1)
+    return values[min(rank, len(values) - 1)]
+
+
+def summarize(samples, elapsed):
+    """Latency percentiles (in ms) and throughput per endpoint."""
+    endpoints = {}
+    for (endpoint, latency, status) in samples:
+        data = endpoints.setdefault(endpoint, {'latencies': [],
+                                               'errors': 0})
+        data['latencies'].append(latency * 1000)
+        if status != 200:
+            data['errors'] += 1
+
+    result = {}
+    for (endpoint, data) in endpoints.items():
+        latencies = sorted(data['latencies'])
+        result[endpoint] = {'requests': len(latencies),
+                            'errors': data['errors'],
+                            'p50': percentile(latencies, 50),
+                            'p95': percentile(latencies, 95),
+                            'p99': percentile(latencies, 99),
+                            'throughput': len(latencies) / elapsed}
+    return result
+
+
+def _change(current, previous):
+    if not previous:
+        return ''
+    change = (current - previous) / previous
+    return '{0:+.0%}'.format(change)
+
+
+def report(results, baseline):
+    """Print the results, compared to the baseline."""
+    baseline = baseline or {}
+    print('{0:<12} {1:>8} {2:>6} {3:>14} {4:>14} {5:>14} {6:>14}'.format(
+        'endpoint', 'requests', 'errors', 'p50 (ms)', 'p95 (ms)',
+        'p99 (ms)', 'req/s'))
+
+    regressions = []
+    for endpoint in sorted(results):
+        current = results[endpoint]
+        previous = baseline.get(endpoint, {})
+        columns = []
+        for field in ['p50', 'p95', 'p99', 'throughput']:
+            change = _change(current[field], previous.get(field))
+            columns.append('{0:8.1f} {1:>5}'.format(current[field], change))
+
+            if not previous.get(field):
+                continue
+            delta = (current[field] - previous[field]) / previous[field]
+            if field == 'throughput':
+                delta = -delta      # less throughput is worse
+            if delta > REGRESSION:
+                regressions.append('{0} {1}'.format(endpoint, field))
+
+        print('{0:<12} {1:>8} {2:>6} {3}'.format(endpoint,
+                                                 current['requests'],
+                                                 current['errors'],
+                                                 ' '.join(columns)))
+
+    if regressions:
+        print('Regressions: ' + ', '.join(regressions))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--scale', choices=sorted(seed.SCALES),
+                        default='small', help='size of the dataset')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--database',
+                        help='SQLite database to use (default: a temporary '
+                             'file)')
+    parser.add_argument('--reuse', action='store_true',
+                        help='use the database as it is, without seeding '
+                             '(only one run per day, as users vote once)')
+    parser.add_argument('--url', help='send the requests to this server')
+    parser.add_argument('--voters', type=int, default=500,
+                        help='users voting in the rush')
+    parser.add_argument('--polls', type=int, default=5,
+                        help='times each user checks the results')
+    parser.add_argument('--processes', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=4,
+                        help='threads per process')
+    parser.add_argument('--output', default=DEFAULT_OUTPUT,
+                        help='results file (and baseline)')
+    args = parser.parse_args()
+
+    database = args.database
+    if not database:
+        (handle, database) = tempfile.mkstemp(suffix='.db3')
+        os.close(handle)
+    database = os.path.abspath(database)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + database
+
+    with app.app_context():
+        if not args.reuse:
+            start = time.time()
+            counts = seed.generate(seed=args.seed, **seed.SCALES[args.scale])
+            print('Seeded {0} in {1:.1f}s'.format(
+                ', '.join('{0} {1}'.format(count, table)
+                          for (table, count) in sorted(counts.items())),
+                time.time() - start))
+        crowd = voters(args.voters, args.seed)
+        db.session.remove()
+        db.get_engine(app).dispose()    # no connections across forks
+
+    work = [(database, args.url, crowd[pos::args.processes], args.threads,
+             args.polls, args.seed + pos * 1000)
+            for pos in range(args.processes)]
+    start = time.time()
+    pool = multiprocessing.Pool(args.processes)
+    samples = sum(pool.map(_worker, work), [])
+    pool.close()
+    elapsed = time.time() - start
+
+    results = summarize(samples, elapsed)
+    baseline = None
+    if os.path.exists(args.output):
+        with open(args.output) as content:
+            baseline = json.load(content).get('results')
+    regressions = report(results, baseline)
+
+    directory = os.path.dirname(args.output)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    with open(args.output, 'w') as content:
+        json.dump({'scale': args.scale,
+                   'voters': args.voters,
+                   'processes': args.processes,
+                   'threads': args.threads,
+                   'polls': args.polls,
+                   'elapsed': elapsed,
+                   'results': results}, content, indent=2, sort_keys=True)
+
+    if not args.database:
+        os.remove(database)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+"""Micro-benchmarks of the pure-Python hot spots of voting.
+
+Each case runs over a grid of ballot sizes (number of votes or choices)
+and PLACES_IN_VOTE values, and reports the best time per call, out of a
+few repetitions. The results can be saved in a JSON file; the previous
+results in that file are shown side by side, so algorithmic changes can
+be compared on numbers.
+
+Run it from the repository root::
+
+    python -m benchmarks.micro --ballots 10,100,1000 --places 1,3,5
+"""
+
+from __future__ import print_function
+
+import argparse
+import datetime
+import json
+import os
+import random
+import timeit
+
+from luncho.server import app
+
+from luncho import serializer
+
+from luncho.blueprints import voting
+
+DEFAULT_OUTPUT = os.path.join(os.path.dirname(__file__), 'results',
+                              'micro.json')
+
+
+# ----------------------------------------------------------------------
+#  Cases
+# ----------------------------------------------------------------------
+# each case receives the number of ballots and places in the vote and
+# returns the function to be timed
+
+def tally(ballots, places):
+    """Scoring loop of `get_vote`, for `ballots` votes."""
+    rand = random.Random(ballots)
+    catalogue = range(1, max(places, 20) + 1)
+    casts = [(vote, place)
+             for vote in range(ballots)
+             for place in rand.sample(catalogue, places)]
+    decrement = round(1.0 / float(places), 1)
+    return lambda: voting._tally(casts, decrement)
+
+
+def check_duplicates(ballots, places):
+    """`_check_duplicates` with a vote of `ballots` choices (what a client
+    can send; the number of choices is checked later)."""
+    choices = range(ballots)
+    return lambda: voting._check_duplicates(choices)
+
+
+def repeated_choices(ballots, places):
+    """`_check_duplicates` with a vote of `ballots` choices where the last
+    one repeats the first, so the error is built too."""
+    choices = range(max(ballots - 1, 1)) + [0]
+
+    def run():
+        try:
+            voting._check_duplicates(choices)
+        except voting.PlacesVotedMoreThanOnceException:
+            pass
+    return run
+
+
+def check_place_count(ballots, places):
+    """`_check_place_count` in a group with `ballots` places."""
+    ballot = range(ballots)
+    choices = range(min(places, ballots))
+    return lambda: voting._check_place_count(choices, ballot)
+
+
+def encode_results(ballots, places):
+    """`serializer.dumps` of a result payload with `ballots` places."""
+    payload = _results(ballots)
+    return lambda: serializer.dumps(payload)
+
+
+def jsonify_results(ballots, places):
+    """`jsonify` (the whole response) of a result payload with `ballots`
+    places."""
+    payload = _results(ballots)
+
+    def run():
+        with app.test_request_context():
+            serializer.jsonify(**payload)
+    return run
+
+
+def _results(ballots):
+    today = datetime.date.today()
+    return {'status': 'OK',
+            'closed': False,
+            'date': today,
+            'results': [{'id': place,
+                         'name': 'Place {0}'.format(place),
+                         'points': place * 0.7,
+                         'since': today}
+                        for place in range(ballots)]}
+
+
+CASES = [tally, check_duplicates, repeated_choices, check_place_count,
+         encode_results, jsonify_results]
+
+
+# ----------------------------------------------------------------------
+#  Running
+# ----------------------------------------------------------------------
+
+def measure(func, repeat, budget=0.2):
+    """Best time, in microseconds, of a call to func."""
+    func()      # warm up
+    number = 1
+    while True:
+        elapsed = timeit.timeit(func, number=number)
+        if elapsed >= budget / repeat or number >= 1000000:
+            break
+        number *= 10
+
+    best = min(timeit.repeat(func, number=number, repeat=repeat))
+    return best / number * 1e6
+
+
+def _numbers(text):
+    return [int(value) for value in text.split(',')]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--ballots', type=_numbers, default=[10, 100, 1000],
+                        help='ballot sizes (comma separated)')
+    parser.add_argument('--places', type=_numbers, default=[1, 3, 5],
+                        help='values of PLACES_IN_VOTE (comma separated)')
+    parser.add_argument('--cases', default=None,
+                        help='run only these cases (comma separated)')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', default=DEFAULT_OUTPUT,
+                        help='results file (and baseline)')
+    args = parser.parse_args()
+
+    cases = CASES
+    if args.cases:
+        names = args.cases.split(',')
+        cases = [case for case in CASES if case.__name__ in names]
+
+    baseline = {}
+    if os.path.exists(args.output):
+        with open(args.output) as content:
+            baseline = json.load(content)
+
+    print('{0:<20} {1:>8} {2:>7} {3:>14} {4:>14}'.format(
+        'case', 'ballots', 'places', 'usec/call', 'baseline'))
+    results = {}
+    with app.app_context():     # the checks read the config
+        for case in cases:
+            for ballots in args.ballots:
+                for places in args.places:
+                    app.config['PLACES_IN_VOTE'] = places
+                    key = '{0}/{1}/{2}'.format(case.__name__, ballots,
+                                               places)
+                    func = case(ballots, places)
+                    results[key] = measure(func, args.repeat)
+
+                    previous = baseline.get(key)
+                    if previous:
+                        previous = '{0:.2f}'.format(previous)
+                    print('{0:<20} {1:>8} {2:>7} {3:>14.2f} {4:>14}'.format(
+                        case.__name__, ballots, places, results[key],
+                        previous or '-'))
+
+    directory = os.path.dirname(args.output)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    baseline.update(results)
+    with open(args.output, 'w') as content:
+        json.dump(baseline, content, indent=2, sort_keys=True)
+    return
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+"""Benchmark of the prepared lookups (:py:mod:`luncho.queries`).
+
+Each lookup is timed as the views used to run it (building the Query every
+call) and prepared, against a seeded SQLite database. The session is
+emptied before each call, so lookups by primary key always go to the
+database. Times are the best per call, in microseconds; the results are
+saved in a JSON file, and the previous results in that file are shown side
+by side.
+
+Run it from the repository root::
+
+    python -m benchmarks.queries --scale tiny
+"""
+
+from __future__ import print_function
+
+import argparse
+import datetime
+import json
+import os
+import tempfile
+
+from luncho.server import app
+from luncho.server import db
+from luncho.server import User
+from luncho.server import Group
+from luncho.server import Place
+from luncho.server import Vote
+
+from luncho import seed
+from luncho import queries
+
+from benchmarks.micro import measure
+
+DEFAULT_OUTPUT = os.path.join(os.path.dirname(__file__), 'results',
+                              'queries.json')
+
+TOKEN = 'benchmark-token'
+
+
+# ----------------------------------------------------------------------
+#  Cases
+# ----------------------------------------------------------------------
+# each case returns the (plain, prepared) functions to be timed
+
+def _fresh(func):
+    def run():
+        db.session.expunge_all()
+        func()
+    return run
+
+
+def user_by_token():
+    return (_fresh(lambda: User.query.filter_by(token=TOKEN).first()),
+            _fresh(lambda: queries.user_by_token(TOKEN)))
+
+
+def group():
+    return (_fresh(lambda: Group.query.get(1)),
+            _fresh(lambda: queries.group(1)))
+
+
+def place():
+    return (_fresh(lambda: Place.query.get(1)),
+            _fresh(lambda: queries.place(1)))
+
+
+def votes_today():
+    today = datetime.date.today()
+    return (lambda: Vote.query.filter_by(group=1, created_at=today).count(),
+            lambda: queries.votes_today(1))
+
+
+CASES = [user_by_token, group, place, votes_today]
+
+
+# ----------------------------------------------------------------------
+#  Running
+# ----------------------------------------------------------------------
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--scale', choices=sorted(seed.SCALES),
+                        default='tiny', help='size of the dataset')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', default=DEFAULT_OUTPUT,
+                        help='results file (and baseline)')
+    args = parser.parse_args()
+
+    (handle, database) = tempfile.mkstemp(suffix='.db3')
+    os.close(handle)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + database
+
+    baseline = {}
+    if os.path.exists(args.output):
+        with open(args.output) as content:
+            baseline = json.load(content)
+
+    print('{0:<16} {1:>10} {2:>10} {3:>8} {4:>10}'.format(
+        'case', 'plain', 'prepared', 'saved', 'baseline'))
+    results = {}
+    try:
+        with app.app_context():
+            seed.generate(**seed.SCALES[args.scale])
+            User.query.limit(1).one().token = TOKEN
+            db.session.commit()
+
+            for case in CASES:
+                (plain, prepared) = case()
+                key = case.__name__
+                results[key + '/plain'] = measure(plain, args.repeat)
+                results[key + '/prepared'] = measure(prepared, args.repeat)
+
+                saved = 1 - (results[key + '/prepared'] /
+                             results[key + '/plain'])
+                previous = baseline.get(key + '/prepared')
+                if previous:
+                    previous = '{0:.2f}'.format(previous)
+                print('{0:<16} {1:>10.2f} {2:>10.2f} {3:>7.0%} {4:>10}'.format(
+                    key, results[key + '/plain'], results[key + '/prepared'],
+                    saved, previous or '-'))
+            db.session.remove()
+    finally:
+        os.remove(database)
+
+    directory = os.path.dirname(args.output)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    baseline.update(results)
+    with open(args.output, 'w') as content:
+        json.dump(baseline, content, indent=2, sort_keys=True)
+    return
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+"""Serialization benchmark.
+
+Encodes typical payloads (vote results, group and place listings, an
+error) with each JSON backend installed, compact and indented, with
+MessagePack (if installed) and with what was there before (`flask.json`
+with the old `DateEncoder`, indented). Reports the best time per payload;
+the results can be saved in a JSON file, and the previous results in that
+file are shown side by side.
+
+Run it from the repository root::
+
+    python -m benchmarks.serialization --size 100
+"""
+
+from __future__ import print_function
+
+import argparse
+import datetime
+import json
+import os
+
+from flask import json as flask_json
+from flask.json import JSONEncoder
+
+from luncho import serializer
+
+from benchmarks.micro import measure
+
+DEFAULT_OUTPUT = os.path.join(os.path.dirname(__file__), 'results',
+                              'serialization.json')
+
+
+class DateEncoder(JSONEncoder):
+    """The encoder used before the serializer, for comparison."""
+    def default(self, obj):
+        if hasattr(obj, 'isoformat'):
+            return obj.isoformat()
+        else:
+            return str(obj)
+
+
+# ----------------------------------------------------------------------
+#  Payloads
+# ----------------------------------------------------------------------
+
+def results(size):
+    """GET /vote/<group>/ with `size` places."""
+    return {'status': 'OK',
+            'votes': size * 3,
+            'closed': False,
+            'results': [{'id': place,
+                         'name': u'Place {0}'.format(place),
+                         'points': place * 0.7}
+                        for place in range(size)]}
+
+
+def groups(size):
+    """GET /group/ with `size` groups."""
+    return {'status': 'OK',
+            'groups': dict((group, {'id': group,
+                                    'name': u'Group {0}'.format(group),
+                                    'admin': group % 7 == 0})
+                           for group in range(size)).values()}
+
+
+def places(size):
+    """GET /place/ with `size` places, with locations and dates."""
+    today = datetime.date.today()
+    return {'status': 'OK',
+            'next': size,
+            'places': [{'id': place,
+                        'name': u'Caf\xe9 {0}'.format(place),
+                        'maintainer': place % 3 == 0,
+                        'latitude': -30.03 + place / 1e4,
+                        'longitude': -51.21 - place / 1e4,
+                        'since': today}
+                       for place in range(size)]}
+
+
+def error(size):
+    """An error with a set of places."""
+    return {'status': 'ERROR',
+            'code': 'PlacesVotedMoreThanOnce',
+            'message': 'Places voted more than once',
+            'places': set(range(size))}
+
+
+PAYLOADS = [results, groups, places, error]
+
+
+# ----------------------------------------------------------------------
+#  Running
+# ----------------------------------------------------------------------
+
+def encoders():
+    """(name, function) of each way of encoding."""
+    result = [('before', lambda obj: flask_json.dumps(obj, cls=DateEncoder,
+                                                      indent=2))]
+    for name in serializer.available():
+        func = serializer.backend(name)
+        result.append((name, lambda obj, func=func: func(obj, None)))
+        result.append((name + '-indent',
+                       lambda obj, func=func: func(obj, 2)))
+    if serializer.msgpack is not None:
+        result.append(('msgpack', serializer.packb))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--size', type=int, default=100,
+                        help='elements in each payload')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', default=DEFAULT_OUTPUT,
+                        help='results file (and baseline)')
+    args = parser.parse_args()
+
+    baseline = {}
+    if os.path.exists(args.output):
+        with open(args.output) as content:
+            baseline = json.load(content)
+
+    print('{0:<10} {1:<20} {2:>10} {3:>12} {4:>12}'.format(
+        'payload', 'encoder', 'bytes', 'usec', 'baseline'))
+    results = {}
+    for payload in PAYLOADS:
+        data = payload(args.size)
+        for (name, func) in encoders():
+            key = '{0}/{1}/{2}'.format(payload.__name__, name, args.size)
+            results[key] = measure(lambda: func(data), args.repeat)
+
+            previous = baseline.get(key)
+            if previous:
+                previous = '{0:.2f}'.format(previous)
+            print('{0:<10} {1:<20} {2:>10} {3:>12.2f} {4:>12}'.format(
+                payload.__name__, name, len(func(data)), results[key],
+                previous or '-'))
+
+    directory = os.path.dirname(args.output)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    baseline.update(results)
+    with open(args.output, 'w') as content:
+        json.dump(baseline, content, indent=2, sort_keys=True)
+    return
+
+
+if __name__ == '__main__':
+    main()
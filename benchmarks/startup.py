@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+"""Startup benchmark.
+
+Measures, in fresh interpreters, how long a worker takes to be useful:
+importing :py:mod:`luncho.server`, creating the app, warming it up (or
+not) and the latency of the first requests, compared with the same
+requests once everything is loaded. Each step is the median of a few runs;
+the results are saved in a JSON file, and the previous results in that file
+are shown side by side.
+
+Run it from the repository root::
+
+    python -m benchmarks.startup --runs 10
+"""
+
+from __future__ import print_function
+
+import argparse
+import base64
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+DEFAULT_OUTPUT = os.path.join(os.path.dirname(__file__), 'results',
+                              'startup.json')
+
+STEPS = ['interpreter', 'import', 'create_app', 'warm_up', 'first_token',
+         'first_vote', 'next_vote']
+
+
+# ----------------------------------------------------------------------
+#  A worker starting
+# ----------------------------------------------------------------------
+
+def child(database, warm):
+    """Start an app and time each step; prints the timings as JSON."""
+    timings = {}
+    start = time.time()
+    from luncho import server
+    timings['import'] = time.time() - start
+
+    start = time.time()
+    app = server.create_app({'SQLALCHEMY_DATABASE_URI':
+                             'sqlite:///' + database})
+    timings['create_app'] = time.time() - start
+
+    timings['warm_up'] = 0.0
+    if warm:
+        start = time.time()
+        server.warm_up(app)
+        timings['warm_up'] = time.time() - start
+
+    client = app.test_client()
+    start = time.time()
+    response = client.post('/token/',
+                           data=json.dumps({'username': 'user1',
+                                            'password': 'lunch'}),
+                           content_type='application/json')
+    timings['first_token'] = time.time() - start
+    token = json.loads(response.data)['token']
+    headers = {'Authorization': 'Basic ' + base64.b64encode(token + ':x')}
+
+    for step in ['first_vote', 'next_vote']:
+        start = time.time()
+        client.get('/vote/1/', headers=headers)
+        timings[step] = time.time() - start
+
+    print(json.dumps(timings))
+    return
+
+
+# ----------------------------------------------------------------------
+#  Running
+# ----------------------------------------------------------------------
+
+def _seed(database):
+    from luncho import server
+    from luncho import seed
+
+    app = server.create_app({'SQLALCHEMY_DATABASE_URI':
+                             'sqlite:///' + database})
+    with app.app_context():
+        seed.generate(seed=42, **seed.SCALES['tiny'])
+    return
+
+
+def run(database, warm):
+    """Run a worker in a new interpreter; returns the timings."""
+    command = [sys.executable, '-m', 'benchmarks.startup', '--child',
+               database]
+    if warm:
+        command.append('--warm')
+    start = time.time()
+    output = subprocess.check_output(command)
+    total = time.time() - start
+
+    timings = json.loads(output.strip().splitlines()[-1])
+    # whatever isn't in the steps is the interpreter starting (and exiting)
+    timings['interpreter'] = total - sum(timings.values())
+    return timings
+
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--output', default=DEFAULT_OUTPUT,
+                        help='results file (and baseline)')
+    parser.add_argument('--child', metavar='DATABASE',
+                        help=argparse.SUPPRESS)
+    parser.add_argument('--warm', action='store_true',
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child, args.warm)
+        return
+
+    (handle, database) = tempfile.mkstemp(suffix='.db3')
+    os.close(handle)
+    try:
+        _seed(database)
+        results = {}
+        for warm in (False, True):
+            mode = 'warm' if warm else 'cold'
+            runs = [run(database, warm) for _ in range(args.runs)]
+            for step in STEPS:
+                key = '{0}/{1}'.format(mode, step)
+                results[key] = median([timings[step] for timings in runs])
+    finally:
+        os.remove(database)
+
+    baseline = {}
+    if os.path.exists(args.output):
+        with open(args.output) as content:
+            baseline = json.load(content)
+
+    print('{0:<20} {1:>10} {2:>10}'.format('step', 'ms', 'baseline'))
+    for mode in ('cold', 'warm'):
+        for step in STEPS:
+            key = '{0}/{1}'.format(mode, step)
+            previous = baseline.get(key)
+            if previous is not None:
+                previous = '{0:.1f}'.format(previous * 1000)
+            print('{0:<20} {1:>10.1f} {2:>10}'.format(key,
+                                                      results[key] * 1000,
+                                                      previous or '-'))
+
+    directory = os.path.dirname(args.output)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    with open(args.output, 'w') as content:
+        json.dump(results, content, indent=2, sort_keys=True)
+    return
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+"""Serve Lunch-o with gevent.
+
+Each connection gets a greenlet instead of a thread, so clients waiting for
+votes (`GET /vote/<group_id>/wait/`) and slow streamed lists cost a few
+kilobytes each, and a single process can hold tens of thousands of them
+(ASYNC_CONNECTIONS, at most). Waiting clients don't hold database
+connections, so the database pool only limits the requests actually
+running queries.
+
+The standard library is patched to cooperate with gevent before anything
+else is imported; psycopg2 is patched too, if psycogreen is installed
+(otherwise, and with SQLite, queries block the process while they run,
+which is fine for short queries)::
+
+    pip install gevent psycogreen
+    python -m luncho.asyncserve --port 5000
+"""
+
+try:
+    from gevent import monkey
+except ImportError:
+    raise SystemExit('The async server requires gevent: pip install gevent')
+monkey.patch_all()
+
+try:
+    from psycogreen.gevent import patch_psycopg
+except ImportError:
+    pass
+else:
+    patch_psycopg()
+
+import argparse
+import logging
+
+from gevent.pool import Pool
+from gevent.pywsgi import WSGIServer
+
+from luncho.server import create_app
+from luncho.server import warm_up
+
+LOG = logging.getLogger('luncho.asyncserve')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--connections', type=int,
+                        help='open connections, at most (default: '
+                             'ASYNC_CONNECTIONS)')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    app = create_app()
+    warm_up(app)
+
+    connections = args.connections or app.config['ASYNC_CONNECTIONS']
+    server = WSGIServer((args.host, args.port), app,
+                        spawn=Pool(connections),
+                        log=None)
+    LOG.info('Serving on {host}:{port}, up to {connections} '
+             'connections'.format(host=args.host,
+                                  port=args.port,
+                                  connections=connections))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+    return
+
+
+if __name__ == '__main__':
+    main()
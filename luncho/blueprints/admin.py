@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+"""Server administration."""
+
+import logging
+
+from flask import Blueprint
+from flask import request
+from flask import current_app
+
+from luncho.serializer import jsonify
+
+from luncho.helpers import auth
+
+from luncho import memory as memory_report
+
+from luncho.exceptions import LunchoException
+
+LOG = logging.getLogger('luncho.blueprints.admin')
+
+admin = Blueprint('admin', __name__)
+
+
+# ----------------------------------------------------------------------
+#  Exceptions
+# ----------------------------------------------------------------------
+
+class NotAnAdministratorException(LunchoException):
+    """The user is not one of the administrators of the server.
+
+    .. sourcecode:: http
+
+       HTTP/1.1 403 Forbidden
+       Content-Type: application/json
+
+       { "status": "ERROR", "message": "Administrators only" }
+    """
+    def __init__(self):
+        super(NotAnAdministratorException, self).__init__()
+        self.status = 403
+        self.message = 'Administrators only'
+
+
+def _check_admin():
+    if request.user.username not in current_app.config['ADMINS']:
+        LOG.warning('{user} tried to use the admin endpoints'.format(
+            user=request.user.username))
+        raise NotAnAdministratorException()
+    return
+
+
+# ----------------------------------------------------------------------
+#  Memory
+# ----------------------------------------------------------------------
+
+@admin.route('memory/', methods=['GET'])
+@auth
+def memory():
+    """Report the memory of this process, compared to the previous report.
+
+    The `top` query parameter limits the types and allocation sites
+    reported (default: MEMORY_TOP). `allocations` is null unless the server
+    is tracing allocations with `tracemalloc` (MEMORY_TRACE_FRAMES).
+
+    **Success (200)**:
+
+    .. sourcecode:: http
+
+       HTTP/1.1 200 OK
+       Content-Type: application/json
+
+       { "status": "OK",
+         "memory": {
+           "objects": <live objects>,
+           "models": { "<model>": <live instances>, ... },
+           "identity_maps": [<instances in each session>, ...],
+           "collections": <loaded relationship collections>,
+           "types": [ { "type": "<module.type>", "count": <live>,
+                        "diff": <since the last report> }, ... ],
+           "allocations": [ { "site": "<file:line>", "size": <bytes>,
+                              "size_diff": <bytes>, "count": <blocks>,
+                              "count_diff": <blocks> }, ... ] } }
+
+    :statuscode 200: Success
+    :statuscode 403: The user is not in ADMINS
+        (:py:class:`NotAnAdministratorException`)
+    """
+    _check_admin()
+    top = request.args.get('top', current_app.config['MEMORY_TOP'],
+                           type=int)
+    return jsonify(status='OK',
+                   memory=memory_report.report(top))
@@ -7,21 +7,43 @@ import logging
 
 from flask import Blueprint
 from flask import request
-from flask import jsonify
+from flask import current_app
+
+from luncho.serializer import jsonify
 
 from luncho.helpers import ForceJSON
 from luncho.helpers import auth
+from luncho.helpers import QueryBudget
+from luncho.helpers import Conditional
+from luncho.helpers import is_member
+from luncho.helpers import pagination
+from luncho.helpers import paginate
+from luncho.helpers import stream_list
+from luncho.helpers import read_location
+from luncho.helpers import read_radius
+
+from luncho.schemas import Field
 
 from luncho.server import db
 from luncho.server import User
 from luncho.server import Group
 from luncho.server import Place
+from luncho.server import user_groups as user_groups_table
+from luncho.server import group_places as group_places_table
+
+from luncho import cache
+from luncho import queries
+from luncho import reads
+from luncho import versions
+
+from luncho.purge import delete_group as purge_group
 
 from luncho.exceptions import ElementNotFoundException
 from luncho.exceptions import AccountNotVerifiedException
 from luncho.exceptions import NewMaintainerDoesNotExistException
 from luncho.exceptions import UserIsNotAdminException
 from luncho.exceptions import UserIsNotMemberException
+from luncho.exceptions import InvalidLocationException
 
 
 # ----------------------------------------------------------------------
@@ -33,8 +55,19 @@ groups = Blueprint('groups', __name__)
 LOG = logging.getLogger('luncho.blueprints.groups')
 
 
+def _user_versions():
+    return [versions.user(request.user.username)]
+
+
+def _group_versions(group_id):
+    if not is_member(group_id, request.user.username):
+        return None
+    return [versions.group(group_id)]
+
+
 @groups.route('', methods=['GET'])
 @auth
+@Conditional(_user_versions, member=True)
 def user_groups():
     """*Authenticated request*
 
@@ -60,19 +93,19 @@ def user_groups():
     :status 412: Authorization required
         (:py:class:`AuthorizationRequiredException`)
     """
-    user = request.user
+    username = request.user.username
     groups = {}
-    for group in user.groups:
+    for group in reads.user_groups(username):
         groups[group.id] = {'id': group.id,
                             'name': group.name,
-                            'admin': group.owner == user.username}
+                            'admin': group.owner == username}
 
     return jsonify(status='OK',
                    groups=groups.values())
 
 
 @groups.route('', methods=['POST'])
-@ForceJSON(required=['name'])
+@ForceJSON(Field('name', str, required=True, max_length='MAX_NAME_LENGTH'))
 @auth
 def create_group():
     """*Authenticated request*
@@ -110,7 +143,7 @@ def create_group():
     if not user.verified:
         raise AccountNotVerifiedException()
 
-    json = request.get_json(force=True)
+    json = request.as_json
     new_group = Group(name=json['name'],
                       owner=user)
 
@@ -118,14 +151,18 @@ def create_group():
     user.groups.append(new_group)
 
     db.session.add(new_group)
+    versions.bump([versions.user(user.username)])
     db.session.commit()
+    cache.delete(cache.member_key(new_group.id, user.username))
 
     return jsonify(status='OK',
                    id=new_group.id)
 
 
 @groups.route('<int:group_id>/', methods=['PUT'])
-@ForceJSON()
+@ForceJSON(Field('name', str, max_length='MAX_NAME_LENGTH'),
+           Field('admin', str),
+           Field('office'))
 @auth
 def update_group(group_id):
     """*Authenticated request*
@@ -137,17 +174,29 @@ def update_group(group_id):
     The administrator of the group can be changed by sending the
     "admin" field with the username of the new administrator.
 
+    The "office" field sets the location of the group office and the
+    maximum distance (in meters) of the places members can vote for; places
+    farther than that are left out of the ballot (up to MAX_OFFICE_RADIUS).
+    To remove the office, send it as null.
+
     **Example request**:
 
     .. sourcecode:: http
 
-       { "name": "new group name": "admin": "newAdmin"}
+       { "name": "new group name": "admin": "newAdmin",
+         "office": { "latitude": <latitude>,
+                     "longitude": <longitude>,
+                     "radius": <meters> } }
 
     :header Authorization: Access token from `/token/`.
 
     :status 200: Success
     :status 400: Request not in JSON format
         (:py:class:`RequestMustBeJSONException`)
+    :status 400: Invalid fields
+        (:py:class:`InvalidFieldsException`)
+    :status 400: Invalid office location
+        (:py:class:`InvalidLocationException`)
     :status 403: User is not the group administrator
         (:py:class:`UserIsNotAdminException`)
     :status 404: User not found (via token)
@@ -158,7 +207,7 @@ def update_group(group_id):
         (:py:class:`AuthorizationRequiredException`)
     """
     user = request.user
-    group = Group.query.get(group_id)
+    group = queries.group(group_id)
     if not group:
         raise ElementNotFoundException('Group')
 
@@ -167,7 +216,7 @@ def update_group(group_id):
 
     LOG.debug('Group = {group}'.format(group=group))
 
-    json = request.get_json(force=True)
+    json = request.as_json
     if 'name' in json:
         group.name = json['name']
 
@@ -180,6 +229,23 @@ def update_group(group_id):
         LOG.debug("new owner of {group} = {new_maintainer}".format(
             group=group, new_maintainer=new_maintainer))
 
+    if 'office' in json:
+        office = json['office']
+        if office is None:
+            group.set_office(None, None, None)
+        else:
+            if not isinstance(office, dict):
+                raise InvalidLocationException()
+
+            location = read_location(office)
+            if not location or location[0] is None:
+                raise InvalidLocationException()
+
+            radius = read_radius(office.get('radius'),
+                                 current_app.config['MAX_OFFICE_RADIUS'])
+            group.set_office(location[0], location[1], radius)
+
+    versions.bump([versions.group(group.id)])
     db.session.commit()
     return jsonify(status='OK')
 
@@ -190,6 +256,7 @@ def delete_group(group_id):
     """*Authenticated request*
 
     Delete a group. Only the administrator of the group can delete it.
+    Groups with lots of votes have their votes removed in background.
 
     :param group_id: The group Id
 
@@ -204,16 +271,14 @@ def delete_group(group_id):
         (:py:class:`AuthorizationRequiredException`)
     """
     user = request.user
-    group = Group.query.get(group_id)
+    group = queries.group(group_id)
     if not group:
         raise ElementNotFoundException('Group')
 
     if not group.owner == user.username:
         raise UserIsNotAdminException()
 
-    db.session.delete(group)
-    db.session.commit()
-
+    purge_group(group.id)
     return jsonify(status='OK')
 
 # ----------------------------------------------------------------------
@@ -224,7 +289,9 @@ group_users = Blueprint('group_users', __name__)
 
 
 @group_users.route('<int:group_id>/users/', methods=['POST'])
-@ForceJSON(required=['usernames'])
+@ForceJSON(Field('usernames', list, required=True, items=str,
+                 max_items='MAX_ADDED'))
+@QueryBudget(8)
 @auth
 def add_users_to_group(group_id):
     """*Authenticated request*
@@ -254,6 +321,8 @@ def add_users_to_group(group_id):
 
     :status 400: Request not in JSON format
         (:py:class:`RequestMustBeJSONException`)
+    :status 400: Invalid fields
+        (:py:class:`InvalidFieldsException`)
     :status 403: User is not the group administrator
         (:py:class:`UserIsNotAdminException`)
     :status 404: User not found (via token)
@@ -262,23 +331,46 @@ def add_users_to_group(group_id):
         (:py:class:`AuthorizationRequiredException`)
     """
     user = request.user
-    group = Group.query.get(group_id)
+    group = queries.group(group_id)
     if not group:
         raise ElementNotFoundException('Group')
 
     if not group.owner == user.username:
         raise UserIsNotAdminException()
 
-    json = request.get_json(force=True)
+    usernames = request.as_json['usernames']
+    known = set()
+    members = set()
+    if usernames:
+        known = set(username for (username,)
+                    in db.session.query(User.username).filter(
+                        User.username.in_(usernames)))
+        members = set(username for (username,)
+                      in db.session.query(user_groups_table.c.username)
+                      .filter(user_groups_table.c.group_id == group_id)
+                      .filter(user_groups_table.c.username.in_(usernames)))
+
     unknown = []
-    for user in json['usernames']:
-        user_obj = User.query.get(user)
-        if not user_obj:
-            unknown.append(user)
+    new_members = []
+    for username in usernames:
+        if username not in known:
+            unknown.append(username)
+            continue
+
+        if username in members:
             continue
 
-        user_obj.groups.append(group)
+        members.add(username)
+        new_members.append({'username': username, 'group_id': group_id})
+
+    if new_members:
+        db.session.execute(user_groups_table.insert(), new_members)
+        versions.bump([versions.group(group_id)] +
+                      [versions.user(member['username'])
+                       for member in new_members])
     db.session.commit()
+    cache.delete(*[cache.member_key(group_id, member['username'])
+                   for member in new_members])
 
     return jsonify(status='OK',
                    not_found=unknown)
@@ -286,14 +378,24 @@ def add_users_to_group(group_id):
 
 @group_users.route('<int:group_id>/users/', methods=['GET'])
 @auth
+@Conditional(_group_versions)
 def list_group_members(group_id):
     """*Authenticated request*
 
     Return a list of the users in the group. The user must be part of the
     group to request this list.
 
+    Big groups can be read in pages, ordered by username: send `limit` to
+    get the first page and, for the following pages, send the "next" value
+    of the previous response in `after`. With `stream`, the list is sent
+    as it is read from the database.
+
     :param group_id: The group Id
 
+    :query after: Username of the last member received
+    :query limit: Number of members in the page
+    :query stream: "true" to stream the list
+
     :header Authorization: Access token from `/token/`.
 
     :status 200: Success
@@ -305,8 +407,12 @@ def list_group_members(group_id):
 
             { "status": "OK", "users": [ { "username": "<username>",
                                             "full_name": "<full name>"},
-                                            ...] }
+                                            ...],
+              "next": "<username for the next page, only when paginating,
+                        null in the last page>" }
 
+    :status 400: Invalid pagination parameters
+        (:py:class:`InvalidPaginationException`)
     :status 403: The user is not a member of the group
         (:py:class:`UserIsNotMemberException`)
     :status 404: User not found (via token)
@@ -316,20 +422,29 @@ def list_group_members(group_id):
     :status 412: Authorization required
         (:py:class:`AuthorizationRequiredException`)
     """
-    group = Group.query.filter_by(id=group_id).first()
+    group = reads.group(group_id)
     if not group:
         raise ElementNotFoundException('Group')
 
-    if request.user not in group.users:
+    if not is_member(group_id, request.user.username):
         raise UserIsNotMemberException()
 
-    users = []
-    for user in group.users:
-        users.append({'username': user.username,
-                      'full_name': user.fullname})
-    db.session.commit()
+    page = pagination()
+    members = reads.members(group_id)
+    if page.stream:
+        return stream_list('users', members, page, User.username, _member)
+
+    (users, next_key) = paginate(members, page, User.username, _member)
+    if page.limit is None:
+        return jsonify(status='OK', users=users)
 
-    return jsonify(status='OK', users=users)
+    return jsonify(status='OK', users=users, next=next_key)
+
+
+def _member(row):
+    """Convert a member row to its JSON representation."""
+    return {'username': row.username,
+            'full_name': row.fullname}
 
 
 # ----------------------------------------------------------------------
@@ -341,14 +456,24 @@ group_places = Blueprint('group_places', __name__)
 
 @group_places.route('<int:group_id>/places/', methods=['GET'])
 @auth
+@Conditional(_group_versions)
 def get_group_places(group_id):
     """*Authenticated request*
 
     Return the list of places for the group. The user must be a member of
     the group the get the list of places.
 
+    The list can be read in pages, ordered by place id: send `limit` to
+    get the first page and, for the following pages, send the "next" value
+    of the previous response in `after`. With `stream`, the list is sent
+    as it is read from the database.
+
     :param group_id: The group Id
 
+    :query after: Id of the last place received
+    :query limit: Number of places in the page
+    :query stream: "true" to stream the list
+
     :header Authorization: Access token from `/token/`.
 
     :status 200: Success
@@ -360,8 +485,12 @@ def get_group_places(group_id):
 
             { "status": "OK", "places": [ { "id": "<place id>",
                                             "name": "<place name>"},
-                                            ...] }
+                                            ...],
+              "next": <place id for the next page, only when paginating,
+                       null in the last page> }
 
+    :status 400: Invalid pagination parameters
+        (:py:class:`InvalidPaginationException`)
     :status 403: The user is not a member of the group
         (:py:class:`UserIsNotMemberException`)
     :status 404: User not found (via token)
@@ -371,24 +500,82 @@ def get_group_places(group_id):
     :status 412: Authorization required
         (:py:class:`AuthorizationRequiredException`)
     """
-    group = Group.query.get(group_id)
+    group = reads.group(group_id)
     if not group:
         raise ElementNotFoundException('Group')
 
-    if request.user not in group.users:
+    if not is_member(group_id, request.user.username):
         raise UserIsNotMemberException()
 
-    places = []
-    for place in group.places:
-        places.append({'id': place.id,
-                       'name': place.name})
+    page = pagination(key=int)
+    places = reads.group_places(group_id)
+    if page.stream:
+        return stream_list('places', places, page, Place.id, _place)
+
+    (result, next_key) = paginate(places, page, Place.id, _place)
+    if page.limit is None:
+        return jsonify(status='OK', places=result)
+
+    return jsonify(status='OK', places=result, next=next_key)
+
+
+def _place(row):
+    """Convert a place row to its JSON representation."""
+    return {'id': row.id,
+            'name': row.name}
+
+
+@group_places.route('<int:group_id>/places/ballot/', methods=['GET'])
+@auth
+@Conditional(_group_versions)
+def get_group_ballot(group_id):
+    """*Authenticated request*
 
+    Return the places the group members can vote for: all the group places
+    or, if the group has an office, the places within the office radius
+    (places without a location are always in the ballot). The user must be a
+    member of the group.
+
+    :param group_id: The group Id
+
+    :header Authorization: Access token from `/token/`.
+
+    :status 200: Success
+
+        .. sourcecode:: http
+
+            HTTP/1.1 200 OK
+            Content-Type: application/json
+
+            { "status": "OK", "places": [ { "id": "<place id>",
+                                            "name": "<place name>"},
+                                            ...] }
+
+    :status 403: The user is not a member of the group
+        (:py:class:`UserIsNotMemberException`)
+    :status 404: User not found (via token)
+        (:py:class:`UserNotFoundException`)
+    :status 404: Group does not exist
+        (:py:class:`ElementNotFoundException`)
+    :status 412: Authorization required
+        (:py:class:`AuthorizationRequiredException`)
+    """
+    group = queries.group(group_id)
+    if not group:
+        raise ElementNotFoundException('Group')
+
+    if not is_member(group_id, request.user.username):
+        raise UserIsNotMemberException()
+
+    ballot = sorted(group.ballot(), key=lambda place: place.id)
     return jsonify(status='OK',
-                   places=places)
+                   places=[_place(place) for place in ballot])
 
 
 @group_places.route('<int:group_id>/places/', methods=['POST'])
-@ForceJSON(required=['places'])
+@ForceJSON(Field('places', list, required=True, items=int,
+                 max_items='MAX_ADDED'))
+@QueryBudget(9)
 @auth
 def group_add_places(group_id):
     """*Authenticated request*
@@ -416,6 +603,8 @@ def group_add_places(group_id):
 
     :status 400: Request not in JSON format
         (:py:class:`RequestMustBeJSONException`)
+    :status 400: Invalid fields
+        (:py:class:`InvalidFieldsException`)
     :status 403: User is not the group administrator
         (:py:class:`UserIsNotAdminException`)
     :status 404: User not found (via token)
@@ -423,7 +612,7 @@ def group_add_places(group_id):
     :status 412: Authorization required
         (:py:class:`AuthorizationRequiredException`)
     """
-    group = Group.query.get(group_id)
+    group = queries.group(group_id)
     if not group:
         LOG.debug('Cant find group with id {group_id}'.format(
             group_id=group_id))
@@ -432,24 +621,46 @@ def group_add_places(group_id):
     if not group.owner == request.user.username:
         raise UserIsNotAdminException()
 
+    place_ids = request.as_json['places']
+    owners = {}
+    in_group = set()
+    if place_ids:
+        owners = dict(db.session.query(Place.id, Place.owner).filter(
+            Place.id.in_(place_ids)))
+        in_group = set(place for (place,)
+                       in db.session.query(group_places_table.c.place)
+                       .filter(group_places_table.c.group == group_id)
+                       .filter(group_places_table.c.place.in_(place_ids)))
+
+    group_users = set(username for (username,)
+                      in db.session.query(user_groups_table.c.username)
+                      .filter(user_groups_table.c.group_id == group_id))
+    LOG.debug('Users in the group: {users}'.format(users=group_users))
+
     not_found = []
     rejected = []
-    group_users = [user.username for user in group.users]
-    LOG.debug('Users in the group: {users}'.format(users=group_users))
-    for place_id in request.as_json.get('places', []):
-        place = Place.query.get(place_id)
-        if not place:
+    new_places = []
+    for place_id in place_ids:
+        if place_id not in owners:
             not_found.append(place_id)
             continue
 
         LOG.debug('Place {place_id} owner: {owner}'.format(
             place_id=place_id,
-            owner=place.owner))
-        if place.owner not in group_users:
+            owner=owners[place_id]))
+        if owners[place_id] not in group_users:
             rejected.append(place_id)
             continue
 
-        group.places.append(place)
+        if place_id in in_group:
+            continue
+
+        in_group.add(place_id)
+        new_places.append({'group': group_id, 'place': place_id})
+
+    if new_places:
+        db.session.execute(group_places_table.insert(), new_places)
+        versions.bump([versions.group(group_id)])
     db.session.commit()
 
     return jsonify(status='OK',
@@ -481,7 +692,7 @@ def group_remove_place(group_id, place_id):
     :status 412: Authorization required
         (:py:class:`AuthorizationRequiredException`)
     """
-    group = Group.query.get(group_id)
+    group = queries.group(group_id)
     if not group:
         raise ElementNotFoundException('Group')
 
@@ -499,5 +710,6 @@ def group_remove_place(group_id, place_id):
         raise ElementNotFoundException('Place')
 
     del group.places[index]
+    versions.bump([versions.group(group.id)])
     db.session.commit()
     return jsonify(status='OK')
@@ -3,25 +3,94 @@
 
 from flask import Blueprint
 from flask import request
-from flask import jsonify
+from flask import current_app
+
+from luncho.serializer import jsonify
 
 from luncho.server import Place
 from luncho.server import User
 from luncho.server import db
 
+from luncho import geo
+from luncho import cache
+from luncho import queries
+from luncho import reads
+from luncho import versions
+
 from luncho.helpers import auth
+from luncho.helpers import QueryBudget
+from luncho.helpers import Conditional
 from luncho.helpers import ForceJSON
+from luncho.helpers import read_location
+from luncho.helpers import read_radius
+
+from luncho.schemas import Field
 
+from luncho.search import index_place
+from luncho.search import reindex_place
+from luncho.search import search_places
+from luncho.search import similar_places
+from luncho.search import visible_to
+
+from luncho.purge import delete_place as purge_place
+
+from luncho.exceptions import LunchoException
 from luncho.exceptions import AccountNotVerifiedException
+from luncho.exceptions import MissingFieldsException
+from luncho.exceptions import InvalidPaginationException
+from luncho.exceptions import InvalidLocationException
 from luncho.exceptions import ElementNotFoundException
 from luncho.exceptions import UserIsNotAdminException
 from luncho.exceptions import NewMaintainerDoesNotExistException
 
+
+# ----------------------------------------------------------------------
+#  Exceptions
+# ----------------------------------------------------------------------
+
+class PossibleDuplicatePlaceException(LunchoException):
+    """There are places with names similar to the new place. The request
+    can be repeated with "force" to create the place anyway.
+
+    .. sourcecode:: http
+
+       HTTP/1.1 409 Conflict
+       Content-Type: application/json
+
+       { "status": "ERROR",
+         "message": "Similar places already exist",
+         "places": [ { "id": <place id>, "name": "<place name>" },
+                     ...] }
+    """
+    def __init__(self, places):
+        super(PossibleDuplicatePlaceException, self).__init__()
+        self.status = 409
+        self.message = 'Similar places already exist'
+        self.places = places
+
+    def _json(self):
+        super(PossibleDuplicatePlaceException, self)._json()
+        self.json['places'] = [{'id': place.id,
+                                'name': place.name}
+                               for place in self.places]
+
+
+# ----------------------------------------------------------------------
+#  The blueprint
+# ----------------------------------------------------------------------
+
 places = Blueprint('places', __name__)
 
 
+def _user_versions():
+    return [versions.user(request.user.username)]
+
+
 @places.route('', methods=['POST'])
-@ForceJSON(required=['name'])
+@ForceJSON(Field('name', str, required=True, max_length='MAX_NAME_LENGTH'),
+           Field('latitude'),
+           Field('longitude'),
+           Field('force', bool))
 @auth
 def create_place():
     """*Authenticated request*
@@ -29,11 +98,20 @@ def create_place():
     Create a new place. The user becomes the maintainer of the place once it
     is created.
 
+    If the user can already see places with similar names, the place is not
+    created and the similar places are returned instead, so the user can
+    pick one of those; to create the place anyway, send "force" as true.
+
+    The location of the place is optional.
+
     **Example request**:
 
     .. sourcecode:: http
 
-        { "name": "<place name>" }
+        { "name": "<place name>",
+          "latitude": <optional latitude>,
+          "longitude": <optional longitude>,
+          "force": <optional, true to ignore similar places> }
 
     :reqheader Authorization: The token received in `/token/`.
 
@@ -45,6 +123,12 @@ def create_place():
             { "status": "OK", "id": <place id> }
     :statuscode 404: User not found (via token)
         (:py:class:`UserNotFoundException`)
+    :statuscode 400: Invalid fields
+        (:py:class:`InvalidFieldsException`)
+    :statuscode 400: Invalid location
+        (:py:class:`InvalidLocationException`)
+    :statuscode 409: Places with similar names exist
+        (:py:class:`PossibleDuplicatePlaceException`)
     :statuscode 412: Authorization required
         (:py:class:`AuthorizationRequiredException`)
     :statuscode 412: Account not verified
@@ -53,9 +137,24 @@ def create_place():
     if not request.user.verified:
         raise AccountNotVerifiedException()
 
-    json = request.get_json(force=True)
+    json = request.as_json
+    location = read_location(json)
+    if not json.get('force'):
+        threshold = current_app.config['DUPLICATE_PLACE_THRESHOLD']
+        similar = similar_places(json['name'],
+                                 request.user.username,
+                                 threshold)
+        if similar:
+            suggestions = current_app.config['DUPLICATE_PLACE_SUGGESTIONS']
+            raise PossibleDuplicatePlaceException(similar[:suggestions])
+
     new_place = Place(name=json['name'], owner=request.user)
+    if location:
+        new_place.set_location(*location)
     db.session.add(new_place)
+    db.session.flush()      # so the place gets an id for the index
+    index_place(new_place)
+    versions.bump([versions.user(request.user.username)])
     db.session.commit()
 
     return jsonify(status='OK',
@@ -63,7 +162,9 @@ def create_place():
 
 
 @places.route('', methods=['GET'])
+@QueryBudget(3)
 @auth
+@Conditional(_user_versions, member=True)
 def get_places():
     """*Authenticated request*
 
@@ -90,26 +191,179 @@ def get_places():
     :statuscode 412: Authorization required
         (:py:class:`AuthorizationRequiredException`)
     """
-    places = {}
-    for group in request.user.groups:
-        for place in group.places:
-            maintainer = place.owner == request.user.username
-            places[place.id] = {'id': place.id,
-                                'name': place.name,
-                                'maintainer': maintainer}
-
-    for place in Place.query.filter_by(owner=request.user.username):
-        maintainer = place.owner == request.user.username
-        places[place.id] = {'id': place.id,
-                            'name': place.name,
-                            'maintainer': maintainer}
+    username = request.user.username
+    key = 'places:{username}:{versions}'.format(
+        username=username,
+        versions=versions.digest(request.versions))
+    return jsonify(status='OK',
+                   places=cache.remember(key, lambda: _visible(username)))
+
+
+def _visible(username):
+    """The places the user can see."""
+    return [{'id': place.id,
+             'name': place.name,
+             'maintainer': place.owner == username}
+            for place in reads.visible_places(username)]
+
+
+@places.route('search', methods=['GET'])
+@auth
+def search():
+    """*Authenticated request*
+
+    Search the places the user can see (the same places returned by
+    `GET /place/`) by name. Every word in the query must appear in the
+    place name; words with less than three letters match the start of the
+    words in the name, so the partial text typed by the user can be used for
+    autocompletion. Shorter names are returned first.
+
+    :query q: The text to search
+    :query limit: Maximum number of places returned
+
+    :reqheader Authorization: Access token received from `/token/`
+
+    :statuscode 200: Success
+
+        .. sourcecode:: http
+
+            HTTP/1.1 200 OK
+            Content-Type: application/json
+
+            { "status": "OK", "places": [ { "id": "<placeId>",
+                                            "name": "<place name>",
+                                            "maintainer": <true if the user is
+                                                the place maintainer>},
+                                            ...] }
+
+    :statuscode 400: Missing the search text
+        (:py:class:`MissingFieldsException`)
+    :statuscode 400: Invalid limit
+        (:py:class:`InvalidPaginationException`)
+    :statuscode 404: User not found (via token)
+        (:py:class:`UserNotFoundException`)
+    :statuscode 412: Authorization required
+        (:py:class:`AuthorizationRequiredException`)
+    """
+    text = request.args.get('q', '').strip()
+    if not text:
+        raise MissingFieldsException(['q'])
+
+    limit = _limit()
+    username = request.user.username
+    found = []
+    for place in search_places(text, username, limit):
+        found.append({'id': place.id,
+                      'name': place.name,
+                      'maintainer': place.owner == username})
+
+    return jsonify(status='OK',
+                   places=found)
+
+
+@places.route('near', methods=['GET'])
+@auth
+def near():
+    """*Authenticated request*
+
+    Return the places the user can see (the same places returned by
+    `GET /place/`) around a location, closest first. Places without a
+    location are never returned.
+
+    :query lat: Latitude of the center of the search
+    :query lon: Longitude of the center of the search
+    :query radius: Distance, in meters, from the center (optional)
+    :query limit: Maximum number of places returned
+
+    :reqheader Authorization: Access token received from `/token/`
+
+    :statuscode 200: Success
+
+        .. sourcecode:: http
+
+            HTTP/1.1 200 OK
+            Content-Type: application/json
 
+            { "status": "OK", "places": [ { "id": "<placeId>",
+                                            "name": "<place name>",
+                                            "latitude": <latitude>,
+                                            "longitude": <longitude>,
+                                            "distance": <in meters>,
+                                            "maintainer": <true if the user is
+                                                the place maintainer>},
+                                            ...] }
+
+    :statuscode 400: Missing the location
+        (:py:class:`MissingFieldsException`)
+    :statuscode 400: Invalid location or radius
+        (:py:class:`InvalidLocationException`)
+    :statuscode 400: Invalid limit
+        (:py:class:`InvalidPaginationException`)
+    :statuscode 404: User not found (via token)
+        (:py:class:`UserNotFoundException`)
+    :statuscode 412: Authorization required
+        (:py:class:`AuthorizationRequiredException`)
+    """
+    missing = [field for field in ['lat', 'lon']
+               if field not in request.args]
+    if missing:
+        raise MissingFieldsException(missing)
+
+    try:
+        latitude = float(request.args['lat'])
+        longitude = float(request.args['lon'])
+        radius = float(request.args.get('radius',
+                                        current_app.config['NEAR_RADIUS']))
+    except ValueError:
+        raise InvalidLocationException()
+
+    if not geo.valid(latitude, longitude):
+        raise InvalidLocationException()
+
+    radius = read_radius(radius, current_app.config['MAX_NEAR_RADIUS'])
+
+    limit = _limit()
+    username = request.user.username
+    around = geo.near(Place.geohash, latitude, longitude, radius)
+    candidates = Place.query.filter(around).filter(visible_to(username))
+    found = []
+    for place in candidates:
+        away = geo.distance(latitude, longitude,
+                            place.latitude, place.longitude)
+        if away > radius:
+            continue
+
+        found.append({'id': place.id,
+                      'name': place.name,
+                      'latitude': place.latitude,
+                      'longitude': place.longitude,
+                      'distance': round(away),
+                      'maintainer': place.owner == username})
+
+    found.sort(key=lambda place: place['distance'])
     return jsonify(status='OK',
-                   places=places.values())
+                   places=found[:limit])
+
+
+def _limit():
+    """Read the maximum number of places to return from the query
+    string."""
+    limit = request.args.get('limit', current_app.config['SEARCH_RESULTS'])
+    try:
+        limit = int(limit)
+    except ValueError:
+        raise InvalidPaginationException('limit')
+
+    if limit < 1 or limit > current_app.config['MAX_PAGE_SIZE']:
+        raise InvalidPaginationException('limit')
+    return limit
 
 
 @places.route('<placeId>/', methods=['PUT'])
-@ForceJSON()
+@ForceJSON(Field('name', str, nullable=True, max_length='MAX_NAME_LENGTH'),
+           Field('admin', str, nullable=True),
+           Field('latitude'),
+           Field('longitude'))
 @auth
 def update_place(placeId):
     """*Authenticated request*
@@ -124,13 +378,21 @@ def update_place(placeId):
 
     .. sourcecode:: http
 
-       { "name": "New name", "admin": "newAdmin" }
+       { "name": "New name", "admin": "newAdmin",
+         "latitude": <latitude>, "longitude": <longitude> }
+
+    The location must be sent complete (both latitude and longitude); to
+    remove it, send both as null.
 
     :reqheader Authorization: Access token received from `/token/`.
 
     :status 200: Success
     :status 400: Request must be in JSON format
         (:py:class:`RequestMustBeJSONException`)
+    :status 400: Invalid fields
+        (:py:class:`InvalidFieldsException`)
+    :status 400: Invalid location
+        (:py:class:`InvalidLocationException`)
     :status 403: User is not administrator of the group
         (:py:class:`UserIsNotAdminException`)
     :status 404: User not found (via token)
@@ -141,16 +403,18 @@ def update_place(placeId):
     :status 412: Authorization required
         (:py:class:`AuthorizationRequiredException`)
     """
-    place = Place.query.get(placeId)
+    place = queries.place(placeId)
     if not place:
         raise ElementNotFoundException('Place')
 
     if not place.owner == request.user.username:
         raise UserIsNotAdminException()
 
+    changed = [versions.user(place.owner)]
     name = request.as_json.get('name')
     if name:
         place.name = name
+        reindex_place(place)
 
     admin = request.as_json.get('admin')
     if admin:
@@ -159,7 +423,13 @@ def update_place(placeId):
             raise NewMaintainerDoesNotExistException()
 
         place.owner = new_maintainer.username
+        changed.append(versions.user(place.owner))
+
+    location = read_location(request.as_json)
+    if location:
+        place.set_location(*location)
 
+    versions.bump(changed + versions.showing_place(place.id))
     db.session.commit()
     return jsonify(status='OK')
 
@@ -170,7 +440,8 @@ def delete_place(placeId):
     """*Authenticated request*
 
     Delete the place. The user must be the maintainer of the place to delete
-    it.
+    it. The place is removed from the groups and from the votes it received
+    (in background, if there are lots of them).
 
     :param placeId: The place Id, as returned by GET or POST
 
@@ -186,14 +457,12 @@ def delete_place(placeId):
     :status 412: Authorization required
         (:py:class:`AuthorizationRequiredException`)
     """
-    place = Place.query.get(placeId)
+    place = queries.place(placeId)
     if not place:
         raise ElementNotFoundException('Place')
 
     if not place.owner == request.user.username:
         raise UserIsNotAdminException()
 
-    db.session.delete(place)
-    db.session.commit()
-
+    purge_place(place.id)
     return jsonify(status='OK')
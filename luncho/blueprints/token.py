@@ -4,11 +4,14 @@
 """User management."""
 
 from flask import Blueprint
-from flask import jsonify
 from flask import request
 
+from luncho.serializer import jsonify
+
 from luncho.helpers import ForceJSON
 
+from luncho.schemas import Field
+
 from luncho.server import User
 
 from luncho.exceptions import LunchoException
@@ -57,7 +60,8 @@ token = Blueprint('token', __name__)
 
 
 @token.route('', methods=['POST'])
-@ForceJSON(required=['username', 'password'])
+@ForceJSON(Field('username', str, required=True),
+           Field('password', str, required=True))
 def get_token():
     """Return the access token. Most of the other requests require a valid
     token; a token will be valid for a whole day and you should only request a
@@ -83,7 +87,7 @@ def get_token():
     :statuscode 404: User does not exist
         (:py:class:`UserDoesNotExistException`)
     """
-    json = request.get_json(force=True)
+    json = request.as_json
 
     user = User.query.filter_by(username=json['username']).first()
     if user is None:
@@ -7,16 +7,24 @@ import logging
 
 from flask import Blueprint
 from flask import request
-from flask import jsonify
 
 from sqlalchemy.exc import IntegrityError
 
+from luncho.serializer import jsonify
+
 from luncho.helpers import ForceJSON
 from luncho.helpers import auth
 
+from luncho.schemas import Field
+
 from luncho.server import User
 from luncho.server import db
 
+from luncho import cache
+from luncho import versions
+
+from luncho.purge import delete_user as purge_user
+
 from luncho.exceptions import LunchoException
 
 LOG = logging.getLogger('luncho.blueprints.users')
@@ -57,7 +65,10 @@ class InvalidUsernameException(LunchoException):
 
 
 @users.route('', methods=['POST'])
-@ForceJSON(required=['username', 'full_name', 'password'])
+@ForceJSON(Field('username', str, required=True, max_length='MAX_NAME_LENGTH'),
+           Field('full_name', str, required=True,
+                 max_length='MAX_NAME_LENGTH'),
+           Field('password', str, required=True))
 def create_user():
     """Create a new user.
 
@@ -84,7 +95,7 @@ def create_user():
     :statuscode 409: Username already exists
         (:py:class:`UsernameAlreadyExistsException`)
     """
-    json = request.get_json(force=True)
+    json = request.as_json
     invalid_characters = ' !@#$%^&*()|[]{}/\\\'"`~"'
     for char in invalid_characters:
         if char in json['username']:
@@ -105,7 +116,8 @@ def create_user():
 
 
 @users.route('', methods=['PUT'])
-@ForceJSON()
+@ForceJSON(Field('full_name', str, max_length='MAX_NAME_LENGTH'),
+           Field('password', str))
 @auth
 def update_user():
     """*Authenticated request*
@@ -140,30 +152,36 @@ def update_user():
     :statuscode 200: Success
     :statuscode 400: Request not in JSON format
         (:py:class:`RequestMustBeJSONException`)
+    :statuscode 400: Invalid fields
+        (:py:class:`InvalidFieldsException`)
     :statuscode 404: User not found (via token)
         (:py:class:`UserNotFoundException`)
     :statuscode 412: Authorization required
         (:py:class:`AuthorizationRequiredException`)
     """
-    json = request.get_json(force=True)
+    json = request.as_json
     user = request.user
 
     if 'full_name' in json:
         LOG.debug('Fullname = {fullname}'.format(fullname=json['full_name']))
         user.fullname = json['full_name']
+        # the name shows in the list of members of the user groups
+        versions.bump([versions.group(group.id) for group in user.groups])
 
     if 'password' in json:
         LOG.debug('Passhash = {password}'.format(password=json['password']))
         user.passhash = json['password']
 
     db.session.commit()
+    cache.delete(cache.auth_key(user.token))
     return jsonify(status='OK')
 
 
 @users.route('', methods=['DELETE'])
 @auth
 def delete_user():
-    """*Authenticated request* Delete a user.
+    """*Authenticated request* Delete a user. The user memberships, votes
+    and groups are deleted too.
 
     **Success (200)**:
 
@@ -180,6 +198,7 @@ def delete_user():
     :statuscode 412: Authorization required
         (:py:class:`AuthorizationRequiredException`)
     """
-    db.session.delete(request.user)
-    db.session.commit()
+    token = request.user.token
+    purge_user(request.user.username)
+    cache.delete(cache.auth_key(token))
     return jsonify(status='OK')
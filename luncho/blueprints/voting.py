@@ -5,21 +5,37 @@
 
 import datetime
 import logging
+import math
 import operator
 
 from flask import Blueprint
-from flask import jsonify
 from flask import request
 from flask import current_app
 
+from luncho.serializer import jsonify
+
 from luncho.helpers import ForceJSON
 from luncho.helpers import auth
+from luncho.helpers import QueryBudget
+from luncho.helpers import Conditional
+from luncho.helpers import is_member
+
+from luncho.schemas import Field
+
+from luncho import cache
+from luncho import queries
+from luncho import versions
+
+from luncho.tracing import span
+from luncho.compression import shared
+from luncho.subscriptions import subscriptions
+from luncho.singleflight import flights
 
 from luncho.server import db
-from luncho.server import Group
 from luncho.server import Vote
 from luncho.server import CastedVote
 from luncho.server import Place
+from luncho.server import user_groups
 
 from luncho.exceptions import LunchoException
 from luncho.exceptions import UserIsNotMemberException
@@ -112,12 +128,35 @@ class PlacesVotedMoreThanOnceException(LunchoException):
         self.json['places'] = list(self.places)
 
 
+class InvalidTimeoutException(LunchoException):
+    """The timeout of a long poll is not a finite number of seconds.
+
+    .. sourcecode:: http
+       HTTP/1.1 400 Bad Request
+       Content-Type: application/json
+
+       { "status": "ERROR", "message": "Invalid timeout" }
+    """
+    def __init__(self):
+        super(InvalidTimeoutException, self).__init__()
+        self.status = 400
+        self.message = 'Invalid timeout'
+
+
 # ----------------------------------------------------------------------
 #  Voting
 # ----------------------------------------------------------------------
 
+def _results_versions(group_id):
+    if not is_member(group_id, request.user.username):
+        return None
+    return [versions.group(group_id), versions.tally(group_id)]
+
+
 @voting.route('<int:group_id>/', methods=['POST'])
-@ForceJSON(required=['choices'])
+@ForceJSON(Field('choices', list, required=True, items=int,
+                 max_items='PLACES_IN_VOTE'))
+@QueryBudget(10)
 @auth
 def cast_vote(group_id):
     """*Authenticated request*
@@ -132,6 +171,8 @@ def cast_vote(group_id):
         (:py:class:`RequestMustBeJSONException`)
     :status 400: Missing fields
         (:py:class:`MissingFieldsException`)
+    :status 400: Invalid fields
+        (:py:class:`InvalidFieldsException`)
     :status 403: User is not member of this group
         (:py:class:`UserIsNotMemberException`)
     :status 404: User not found (via token)
@@ -152,50 +193,58 @@ def cast_vote(group_id):
         (:py:class:`AuthorizationRequiredException`)
     """
     # check if the group exists
-    group = Group.query.get(group_id)
+    group = queries.group(group_id)
     if not group:
         raise ElementNotFoundException('Group')
 
     # check if the user belongs to the group
-    if request.user not in group.users:
+    if not is_member(group.id, request.user.username):
         LOG.debug('User is not member')
         raise UserIsNotMemberException()
 
-    choices = request.as_json.get('choices')
+    choices = request.as_json['choices']
 
-    # check if the user voted today already, for any group
-    _already_voted(request.user.username)
+    with span('validation'):
+        # check if the user voted today already, for any group
+        _already_voted(request.user.username)
 
-    # check if the user is trying to vote in the same place twice
-    _check_duplicates(choices)
+        # check if the user is trying to vote in the same place twice
+        _check_duplicates(choices)
 
-    # check the number of votes the user casted
-    _check_place_count(choices, group.places)
+        # check the number of votes the user casted
+        ballot = group.ballot()
+        _check_place_count(choices, ballot)
 
-    # check if the places exist and are part of the group
-    # (don't vote yet, so we can stop the whole thing if there is anything
-    #  wrong)
-    _check_places(choices, group.places)
+        # check if the places exist and are part of the group ballot
+        # (don't vote yet, so we can stop the whole thing if there is anything
+        #  wrong)
+        _check_places(choices, ballot)
 
     # finally, cast the vote
     vote = Vote(request.user, group_id)
     LOG.debug('User {user} casted vote {vote}'.format(user=request.user,
                                                       vote=vote))
     db.session.add(vote)
-    db.session.commit()     # so vote gets an id
-    for (pos, place_id) in enumerate(request.as_json.get('choices')):
+    db.session.flush()      # so vote gets an id
+    for (pos, place_id) in enumerate(choices):
         place = CastedVote(vote, pos, place_id)
         LOG.debug('\tVoted {place} in {pos} position'.format(place=place,
                                                              pos=pos))
         db.session.add(place)
 
+    versions.bump([versions.tally(group_id)])
     db.session.commit()
+    subscriptions.notify(group_id)
 
-    return jsonify(status='OK')
+    with span('serialize'):
+        response = jsonify(status='OK')
+    return response
 
 
 @voting.route('<int:group_id>/', methods=['GET'])
+@QueryBudget(9)
 @auth
+@Conditional(_results_versions, daily=True)
 def get_vote(group_id):
     """*Authenticated request*
 
@@ -211,6 +260,7 @@ def get_vote(group_id):
            Content-type: application/json
 
            { "status": "OK",
+             "votes": <votes cast today>,
              "closed": <True if all members voted>,
              "results": [ {"id": <place id>,
                            "name": "<place name>",
@@ -229,24 +279,116 @@ def get_vote(group_id):
         (:py:class:`AuthorizationRequiredException`)
     """
     # check if the group exists
-    group = Group.query.get(group_id)
+    group = queries.group(group_id)
     if not group:
         raise ElementNotFoundException('Group')
 
     # check if the user belongs to the group
-    if request.user not in group.users:
+    if not is_member(group.id, request.user.username):
         LOG.debug('User is not member')
         raise UserIsNotMemberException()
 
+    # every member polls the same results
+    return shared(jsonify(status='OK',
+                          **_shared_results(group, request.versions)))
+
+
+@voting.route('<int:group_id>/wait/', methods=['GET'])
+@QueryBudget(11)
+@auth
+def wait_vote(group_id):
+    """*Authenticated request*
+
+    Wait for new votes in the group (long polling) and return the voting
+    status, like `GET /vote/<group_id>/`. If there are more votes today than
+    `votes`, the status is returned right away; otherwise, the request
+    waits till someone votes in the group or the timeout expires, whatever
+    comes first.
+
+    :header Authorization: Access token from '/token/'.
+
+    :query votes: number of votes the client already knows about (the
+        `votes` field of the last status)
+    :query timeout: seconds to wait, at most LONG_POLL_TIMEOUT
+
+    :status 200: Success, with the same fields of `GET /vote/<group_id>/`
+    :status 400: Invalid timeout
+        (:py:class:`InvalidTimeoutException`)
+    :status 403: User is not member of this group
+        (:py:class:`UserIsNotMemberException`)
+    :status 404: User not found (via token)
+        (:py:class:`UserNotFoundException`)
+    :status 404: Group not found
+        (:py:class:`ElementNotFoundException`)
+    :status 412: Authorization required
+        (:py:class:`AuthorizationRequiredException`)
+    """
+    group = queries.group(group_id)
+    if not group:
+        raise ElementNotFoundException('Group')
+
+    if not is_member(group.id, request.user.username):
+        LOG.debug('User is not member')
+        raise UserIsNotMemberException()
+
+    known = request.args.get('votes', 0, type=int)
+    limit = current_app.config['LONG_POLL_TIMEOUT']
+    timeout = request.args.get('timeout', limit, type=float)
+    if math.isnan(timeout) or math.isinf(timeout):
+        raise InvalidTimeoutException()
+    timeout = min(max(timeout, 0), limit)
+
+    waiters = subscriptions.subscribe(group_id)
+    try:
+        waiting = queries.votes_today(group_id) <= known
+        if waiting:
+            # don't hold a database connection while waiting
+            db.session.remove()
+            with span('wait'):
+                subscriptions.wait(group_id, waiters, timeout)
+    finally:
+        subscriptions.unsubscribe(group_id, waiters)
+
+    if waiting:
+        group = queries.group(group_id)
+        if not group:
+            raise ElementNotFoundException('Group')
+
+    # every member polls the same results, and they all wake together
+    counters = versions.current([versions.group(group.id),
+                                 versions.tally(group.id)])
+    return shared(jsonify(status='OK',
+                          **_shared_results(group, counters)))
+
+
+# ----------------------------------------------------------------------
+#  Results
+# ----------------------------------------------------------------------
+
+def _shared_results(group, counters):
+    """The results of the group, cached and computed once for all the
+    members asking for them at the same time (see
+    :py:mod:`luncho.singleflight`)."""
+    key = 'results:{group}:{day}:{versions}'.format(
+        group=group.id,
+        day=datetime.date.today().isoformat(),
+        versions=versions.digest(counters))
+    return flights.do('results', key,
+                      lambda: cache.remember(key, lambda: _results(group)))
+
+
+def _results(group):
+    """The voting status of the group: the number of votes today, if the
+    voting is closed and the points of each place."""
     # calculate the decrementating value, based on the number of places
     max_places = min(current_app.config['PLACES_IN_VOTE'],
-                     len(group.places))
+                     len(group.ballot()))
     if max_places == 0:
         # this means the group have no places at all, so the result will
         # *always* be an empty list, closed.
-        return jsonify(status='OK',
-                       results=[],
-                       closed=True)
+        return {'votes': 0,
+                'results': [],
+                'closed': True}
 
     decrement = round(1.0 / float(max_places), 1)
     LOG.debug('For {places}, the decrement factor is {decrement}'.format(
@@ -254,48 +396,64 @@ def get_vote(group_id):
 
     # get the votes for today
     today = datetime.date.today()
-    group_votes = Vote.query.filter_by(group=group.id,
-                                       created_at=today)
-    points = {}
-    votes = 0
-    for vote in group_votes:
-        votes += 1
-        # get the casted votes
-        vote_value = 1.0
-        for cast in CastedVote.query.filter_by(vote=vote.cast):
-            if cast.place not in points:
-                points[cast.place] = 0.0
-            points[cast.place] += vote_value
-            vote_value -= decrement
+    votes = queries.votes_today(group.id)
+    casts = (db.session.query(CastedVote.vote, CastedVote.place)
+             .join(Vote, Vote.cast == CastedVote.vote)
+             .filter(Vote.group == group.id)
+             .filter(Vote.created_at == today)
+             .order_by(CastedVote.vote, CastedVote.order))
+    points = _tally(casts, decrement)
 
     LOG.debug('Unsorted results: {results}'.format(results=points))
 
     # check if the voting is closed. for that, the number of votes must be
     # equal to the number of users in the group
+    members = db.session.query(user_groups).filter(
+        user_groups.c.group_id == group.id).count()
     closed = False
-    if votes == len(group.users):
+    if votes == members:
         closed = True
 
     # sort the results from most voted to least voted
     # (turn the dictionary into a list with place,points values, then sort
     #  them by points)
+    names = {}
+    if points:
+        names = dict(db.session.query(Place.id, Place.name).filter(
+            Place.id.in_(points.keys())))
     result = []
     for (place_id, points) in sorted(points.items(),
                                      key=operator.itemgetter(1)):
-        place = Place.query.get(place_id)
-        result.append({'id': place.id,
-                       'name': place.name,
+        result.append({'id': place_id,
+                       'name': names[place_id],
                        'points': points})
 
-    return jsonify(status='OK',
-                   closed=closed,
-                   results=result)
+    return {'votes': votes,
+            'closed': closed,
+            'results': result}
 
 
 # ----------------------------------------------------------------------
 #  Helpers
 # ----------------------------------------------------------------------
 
+def _tally(casts, decrement):
+    """Return the points of each place, from the (vote, place) casts,
+    ordered by vote and position: the first place of each vote gets 1
+    point, the next gets `decrement` less and so on."""
+    points = {}
+    current_vote = None
+    for (vote, place) in casts:
+        if vote != current_vote:
+            current_vote = vote
+            vote_value = 1.0
+        if place not in points:
+            points[place] = 0.0
+        points[place] += vote_value
+        vote_value -= decrement
+    return points
+
+
 def _already_voted(username):
     """Check if the user already voted today."""
     today = datetime.date.today()
@@ -320,9 +478,10 @@ def _check_place_count(choices, group_places):
 
 
 def _check_places(choices, group_places):
-    """Check if the places the user voted exist and belong to the group."""
+    """Check if the places the user voted exist and belong to the group
+    ballot."""
     for place_id in choices:
-        place = Place.query.get(place_id)
+        place = queries.place(place_id)
         if not place:
             raise ElementNotFoundException('Place')
 
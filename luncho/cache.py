@@ -0,0 +1,442 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+"""Cache shared by the workers.
+
+CACHE_BACKEND picks where the cached values live:
+
+* `local`: an LRU in each process (CACHE_SIZE entries), for the keys that
+  are versioned only (see below);
+* `file`: a dbm file (CACHE_FILE), shared by the workers of a host, with
+  about CACHE_SIZE entries;
+* `redis`: a Redis server (CACHE_REDIS_URL), shared by every host --
+  `memory://` uses :py:class:`MemoryRedis`, an in-memory stand-in;
+* None: nothing is cached.
+
+Entries expire after CACHE_TTL seconds. Keys that depend on data changed by
+the API either include the version counters of that data (see
+:py:mod:`luncho.versions`), so a change makes them unreachable, or are
+deleted by the handlers that change it:
+
+* `auth:<token>`: the user of a token (deleted when the user changes);
+* `member:<group>:<username>`: membership, only if the user is a member
+  (deleted when it changes, and when a group is created);
+* `places:<username>:<versions>`: the places the user can see;
+* `results:<group>:<day>:<versions>`: the voting results of a group.
+
+A delete only reaches the cache of the process that runs it, so the keys
+that are deleted (`auth` and `member`) are never kept in a `local` cache:
+with more than one worker, the other workers would keep the old values
+till they expire. They are cached by the shared backends only."""
+
+import collections
+import fnmatch
+import logging
+import os
+import threading
+import time
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+try:
+    import anydbm as dbm
+except ImportError:
+    import dbm
+
+try:
+    import fcntl
+except ImportError:     # not on Windows
+    fcntl = None
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+from flask import current_app
+
+from luncho import metrics
+
+LOG = logging.getLogger('luncho.cache')
+
+EXTENSION = 'luncho.cache'
+
+DELETED = frozenset(['auth', 'member'])     # kinds of keys deleted on change
+
+
+# ----------------------------------------------------------------------
+#  Backends
+# ----------------------------------------------------------------------
+# each one has get(key) (None if missing), set(key, value), delete(*keys)
+# and clear()
+
+class NullCache(object):
+    """Caches nothing."""
+    shared = False
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value):
+        return
+
+    def delete(self, *keys):
+        return
+
+    def clear(self):
+        return
+
+
+class LocalCache(object):
+    """LRU in the memory of the process. Values are kept as they are, so
+    they must not be changed after set or get."""
+    shared = False      # the other workers have their own
+
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = collections.OrderedDict()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None:
+                return None
+            if entry[0] < time.time():
+                return None
+            self.entries[key] = entry       # most recently used
+            return entry[1]
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = (time.time() + self.ttl, value)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+        return
+
+    def delete(self, *keys):
+        with self.lock:
+            for key in keys:
+                self.entries.pop(key, None)
+        return
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+        return
+
+
+class FileCache(object):
+    """dbm file, shared by the processes of the host; every access locks
+    the file (with a lock file beside it).
+
+    Versioned keys are never read again once the version changes, so
+    expired entries are removed when read and, every `size / 10` writes of
+    the process, swept from the whole file; if there are still more than
+    `size` entries, the ones closer to expire go too."""
+    shared = True
+
+    def __init__(self, path, size, ttl):
+        self.path = path
+        self.size = size
+        self.ttl = ttl
+        self.lock = threading.Lock()    # flock is per process
+        self.sweep_every = max(size // 10, 1)
+        self.writes = 0     # since the last sweep
+
+    def _open(self, exclusive):
+        return _Locked(self, exclusive)
+
+    def get(self, key):
+        key = _bytes(key)
+        with self._open(False) as db:
+            if db is None or key not in db:
+                return None
+            (expires, value) = pickle.loads(db[key])
+        if expires < time.time():
+            self._expire(key)
+            return None
+        return value
+
+    def _expire(self, key):
+        """Remove the entry, if it is (still) expired."""
+        with self._open(True) as db:
+            if key in db and pickle.loads(db[key])[0] < time.time():
+                del db[key]
+        return
+
+    def set(self, key, value):
+        entry = pickle.dumps((time.time() + self.ttl, value), 2)
+        with self._open(True) as db:
+            db[_bytes(key)] = entry
+            self.writes += 1
+            if self.writes >= self.sweep_every:
+                self.writes = 0
+                self._sweep(db)
+        return
+
+    def _sweep(self, db):
+        """Remove the expired entries and the extra ones."""
+        now = time.time()
+        entries = []
+        for key in db.keys():
+            expires = pickle.loads(db[key])[0]
+            if expires < now:
+                del db[key]
+            else:
+                entries.append((expires, key))
+
+        entries.sort()
+        for (expires, key) in entries[:max(len(entries) - self.size, 0)]:
+            del db[key]
+        return
+
+    def delete(self, *keys):
+        with self._open(True) as db:
+            for key in map(_bytes, keys):
+                if key in db:
+                    del db[key]
+        return
+
+    def clear(self):
+        with self._open(True) as db:
+            for key in db.keys():
+                del db[key]
+        return
+
+
+def _bytes(key):
+    # dbm keys are bytes
+    if not isinstance(key, bytes):
+        key = key.encode('utf-8')
+    return key
+
+
+class _Locked(object):
+    """The dbm file of a :py:class:`FileCache`, open and locked (shared or
+    exclusive) inside the `with` block; None if it doesn't exist yet and
+    the lock is shared."""
+    def __init__(self, cache, exclusive):
+        self.cache = cache
+        self.exclusive = exclusive
+        self.lockfile = None
+        self.db = None
+
+    def __enter__(self):
+        self.cache.lock.acquire()
+        self.lockfile = open(self.cache.path + '.lock', 'a')
+        if fcntl is not None:
+            fcntl.flock(self.lockfile,
+                        fcntl.LOCK_EX if self.exclusive else fcntl.LOCK_SH)
+        try:
+            self.db = dbm.open(self.cache.path,
+                               'c' if self.exclusive else 'r')
+        except dbm.error:
+            self.db = None      # never written
+        return self.db
+
+    def __exit__(self, *exc_info):
+        if self.db is not None:
+            self.db.close()
+        if fcntl is not None:
+            fcntl.flock(self.lockfile, fcntl.LOCK_UN)
+        self.lockfile.close()
+        self.cache.lock.release()
+        return False
+
+
+class RedisCache(object):
+    """Redis, shared by every host. Keys get CACHE_PREFIX, so clearing the
+    cache doesn't touch anything else in the server."""
+    shared = True
+
+    def __init__(self, client, prefix, ttl):
+        self.client = client
+        self.prefix = prefix
+        self.ttl = ttl
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        if value is None:
+            return None
+        return pickle.loads(value)
+
+    def set(self, key, value):
+        self.client.setex(self.prefix + key, self.ttl,
+                          pickle.dumps(value, 2))
+        return
+
+    def delete(self, *keys):
+        if keys:
+            self.client.delete(*[self.prefix + key for key in keys])
+        return
+
+    def clear(self):
+        keys = list(self.client.scan_iter(self.prefix + '*'))
+        if keys:
+            self.client.delete(*keys)
+        return
+
+
+class MemoryRedis(object):
+    """Pure Python, in-memory stand-in for the parts of the Redis client
+    the cache uses (for tests and development)."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.data = {}
+
+    def _alive(self, key):
+        entry = self.data.get(key)
+        if entry is not None and entry[0] is not None and \
+                entry[0] < time.time():
+            del self.data[key]
+            entry = None
+        return entry
+
+    def get(self, key):
+        with self.lock:
+            entry = self._alive(key)
+        if entry is None:
+            return None
+        return entry[1]
+
+    def set(self, key, value):
+        with self.lock:
+            self.data[key] = (None, value)
+        return True
+
+    def setex(self, key, seconds, value):
+        with self.lock:
+            self.data[key] = (time.time() + seconds, value)
+        return True
+
+    def delete(self, *keys):
+        with self.lock:
+            return len([self.data.pop(key) for key in keys
+                        if self._alive(key) is not None])
+
+    def scan_iter(self, match='*'):
+        with self.lock:
+            keys = [key for key in list(self.data)
+                    if self._alive(key) is not None]
+        return iter([key for key in keys if fnmatch.fnmatchcase(key, match)])
+
+    def flushdb(self):
+        with self.lock:
+            self.data.clear()
+        return True
+
+
+def backend(config):
+    """The cache backend of the configuration."""
+    name = config['CACHE_BACKEND']
+    ttl = config['CACHE_TTL']
+    if name is None:
+        return NullCache()
+    if name == 'local':
+        return LocalCache(config['CACHE_SIZE'], ttl)
+    if name == 'file':
+        return FileCache(config['CACHE_FILE'], config['CACHE_SIZE'], ttl)
+    if name == 'redis':
+        url = config['CACHE_REDIS_URL']
+        if url.startswith('memory://'):
+            client = MemoryRedis()
+        elif redis is None:
+            raise ValueError('The redis cache needs the redis package')
+        else:
+            client = redis.StrictRedis.from_url(url)
+        return RedisCache(client, config['CACHE_PREFIX'], ttl)
+    raise ValueError('Unknown cache backend {name}'.format(name=name))
+
+
+# ----------------------------------------------------------------------
+#  Using the cache of the current app
+# ----------------------------------------------------------------------
+
+def current():
+    """The cache of the current app."""
+    return current_app.extensions[EXTENSION]
+
+
+def _kind(key):
+    return key.split(':', 1)[0]
+
+
+def _backend(key):
+    """The cache for the key; None if the key can't be cached in it."""
+    backend = current()
+    if _kind(key) in DELETED and not backend.shared:
+        return None
+    return backend
+
+
+def get(key):
+    """The value of the key; None if it isn't cached (or failed)."""
+    backend = _backend(key)
+    if backend is None:
+        return None
+
+    try:
+        value = backend.get(key)
+    except Exception:
+        LOG.exception('Cache get {key} failed'.format(key=key))
+        value = None
+    metrics.CACHE.inc((_kind(key), 'miss' if value is None else 'hit'))
+    return value
+
+
+def put(key, value):
+    """Cache the value (failures are just logged)."""
+    backend = _backend(key)
+    if backend is None:
+        return
+
+    try:
+        backend.set(key, value)
+    except Exception:
+        LOG.exception('Cache set {key} failed'.format(key=key))
+    return
+
+
+def delete(*keys):
+    """Remove the keys from the cache (failures are logged; the entries
+    expire anyway)."""
+    try:
+        current().delete(*keys)
+    except Exception:
+        LOG.exception('Cache delete {keys} failed'.format(keys=keys))
+    return
+
+
+def remember(key, func):
+    """The cached value of the key or, if it isn't cached, the result of
+    `func()`, which is cached."""
+    value = get(key)
+    if value is None:
+        value = func()
+        put(key, value)
+    return value
+
+
+def auth_key(token):
+    return 'auth:{token}'.format(token=token)
+
+
+def member_key(group_id, username):
+    return 'member:{group}:{username}'.format(group=group_id,
+                                              username=username)
+
+
+def init_app(app):
+    """Create the cache of the app."""
+    directory = os.path.dirname(app.config['CACHE_FILE'])
+    if app.config['CACHE_BACKEND'] == 'file' and directory and \
+            not os.path.isdir(directory):
+        os.makedirs(directory)
+    app.extensions[EXTENSION] = backend(app.config)
+    return
@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+"""Response compression.
+
+Responses (JSON, MessagePack, text) of COMPRESS_MIN_SIZE bytes or more are
+compressed with brotli, if it is installed and the client accepts it, or
+gzip, as negotiated with `Accept-Encoding`. Streamed responses are
+compressed as they go, with gzip.
+
+Views can mark a response as shared (:py:func:`shared`), when lots of
+clients get the very same body -- like the results of a group, polled by
+all its members. Their compressed bodies are kept in a small LRU cache,
+keyed by the hash of the body, so the same bytes are compressed only
+once."""
+
+import collections
+import hashlib
+import threading
+import zlib
+
+from flask import current_app
+from flask import request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE = set(['application/json', 'application/msgpack',
+                    'application/javascript', 'image/svg+xml'])
+
+GZIP_HEADER = 16 + zlib.MAX_WBITS     # gzip container, not raw zlib
+
+ENCODINGS = ['br', 'gzip']
+
+
+# ----------------------------------------------------------------------
+#  Compressing
+# ----------------------------------------------------------------------
+
+def gzip(data, level):
+    """Compress the data with gzip."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, GZIP_HEADER)
+    return compressor.compress(data) + compressor.flush()
+
+
+def br(data, quality):
+    """Compress the data with brotli."""
+    return brotli.compress(data, quality=quality)
+
+
+def _gzip_stream(chunks, level):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, GZIP_HEADER)
+    for chunk in chunks:
+        if isinstance(chunk, unicode):
+            chunk = chunk.encode('utf-8')
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def _compress(data, encoding):
+    config = current_app.config
+    if encoding == 'br':
+        return br(data, config['COMPRESS_BROTLI_QUALITY'])
+    return gzip(data, config['COMPRESS_LEVEL'])
+
+
+def choose(accept_encodings, streamed=False):
+    """The encoding to use, given the client's `Accept-Encoding`; None if
+    the client doesn't accept any we know."""
+    gzip_quality = accept_encodings.quality('gzip')
+    if brotli is not None and not streamed:
+        br_quality = accept_encodings.quality('br')
+        if br_quality > 0 and br_quality >= gzip_quality:
+            return 'br'
+    if gzip_quality > 0:
+        return 'gzip'
+    return None
+
+
+# ----------------------------------------------------------------------
+#  Shared responses
+# ----------------------------------------------------------------------
+
+class CompressedCache(object):
+    """LRU cache of compressed bodies, by encoding and hash of the body."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, data, encoding, size):
+        """The compressed data, compressing it if it isn't in the cache."""
+        key = (encoding, hashlib.sha1(data).digest())
+        with self.lock:
+            compressed = self.entries.pop(key, None)
+            if compressed is not None:
+                self.entries[key] = compressed      # most recently used
+                self.hits += 1
+                return compressed
+            self.misses += 1
+
+        compressed = _compress(data, encoding)
+        with self.lock:
+            self.entries[key] = compressed
+            while len(self.entries) > size:
+                self.entries.popitem(last=False)
+        return compressed
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.hits = 0
+            self.misses = 0
+        return
+
+
+cache = CompressedCache()
+
+
+def shared(response):
+    """Mark the response as one that many clients get, so its compressed
+    body is cached."""
+    response.luncho_shared = True
+    return response
+
+
+# ----------------------------------------------------------------------
+#  Responses
+# ----------------------------------------------------------------------
+
+def _compressible(response):
+    if response.status_code < 200 or response.status_code in (204, 304):
+        return False
+    if 'Content-Encoding' in response.headers or response.direct_passthrough:
+        return False
+    mimetype = response.mimetype or ''
+    return mimetype in COMPRESSIBLE or mimetype.startswith('text/')
+
+
+def _encoded(response, encoding):
+    response.headers['Content-Encoding'] = encoding
+    # a strong ETag identifies the bytes, so the compressed response needs
+    # its own
+    (tag, weak) = response.get_etag()
+    if tag and not weak:
+        response.set_etag(tag + '-' + encoding)
+    return
+
+
+def _compress_response(response):
+    if request.method == 'HEAD' or not _compressible(response):
+        return response
+
+    config = current_app.config
+    response.vary.add('Accept-Encoding')
+    if response.is_streamed:
+        if choose(request.accept_encodings, streamed=True) != 'gzip':
+            return response
+        response.response = _gzip_stream(response.response,
+                                         config['COMPRESS_LEVEL'])
+        response.headers.pop('Content-Length', None)
+        _encoded(response, 'gzip')
+        return response
+
+    data = response.get_data()
+    if len(data) < config['COMPRESS_MIN_SIZE']:
+        return response
+    encoding = choose(request.accept_encodings)
+    if encoding is None:
+        return response
+
+    if getattr(response, 'luncho_shared', False):
+        compressed = cache.get(data, encoding, config['COMPRESS_CACHE_SIZE'])
+    else:
+        compressed = _compress(data, encoding)
+    response.set_data(compressed)
+    _encoded(response, encoding)
+    return response
+
+
+def init_app(app):
+    """Compress the responses of the app."""
+    app.after_request(_compress_response)
+    return
@@ -1,7 +1,7 @@
 #!/usr/bin/env python
 # -*- encoding: utf-8 -*-
 
-from flask import jsonify
+from luncho.serializer import jsonify
 
 
 class LunchoException(Exception):
@@ -65,6 +65,25 @@ class MissingFieldsException(LunchoException):
         self.extra_fields = {'fields': fields}
 
 
+class InvalidFieldsException(LunchoException):
+    """There are fields with the wrong type (or too long) in the request.
+
+    ..sourcecode:: http
+
+       HTTP/1.1 400 Bad Request
+       Content-Type: application/json
+
+       { "status": "ERROR",
+         "message": "Invalid fields",
+         "fields": [<list of invalid fields>] }
+    """
+    def __init__(self, fields):
+        super(InvalidFieldsException, self).__init__()
+        self.status = 400
+        self.message = 'Invalid fields'
+        self.extra_fields = {'fields': fields}
+
+
 class InvalidTokenException(LunchoException):
     """The passed token is invalid.
 
@@ -194,3 +213,40 @@ class UserIsNotMemberException(LunchoException):
         super(UserIsNotMemberException, self).__init__()
         self.status = 403
         self.message = 'User is not member of this group'
+
+
+class InvalidPaginationException(LunchoException):
+    """The pagination parameters in the query string are invalid.
+
+    .. sourcecode:: http
+
+       HTTP/1.1 400 Bad Request
+       Content-Type: application/json
+
+       { "status": "ERROR",
+         "message": "Invalid pagination parameter",
+         "fields": [<parameter>] }
+    """
+    def __init__(self, field):
+        super(InvalidPaginationException, self).__init__()
+        self.status = 400
+        self.message = 'Invalid pagination parameter'
+        self.extra_fields = {'fields': [field]}
+
+
+class InvalidLocationException(LunchoException):
+    """The location is invalid: latitude and longitude must be sent together,
+    as numbers in the valid ranges, and the radius must be positive (and
+    not larger than the limit of the request).
+
+    .. sourcecode:: http
+
+       HTTP/1.1 400 Bad Request
+       Content-Type: application/json
+
+       { "status": "ERROR", "message": "Invalid location" }
+    """
+    def __init__(self):
+        super(InvalidLocationException, self).__init__()
+        self.status = 400
+        self.message = 'Invalid location'
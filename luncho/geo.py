@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+"""Locations.
+
+Places with a location have a geohash, which is indexed. All the places in
+a geohash cell have geohashes starting with the cell geohash, so a "near"
+search looks for the cell around the point (and its neighbours) using
+ranges on the index and only then calculates the actual distances."""
+
+import math
+
+from sqlalchemy import and_
+from sqlalchemy import or_
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+PRECISION = 9           # geohash size stored for places (about 5 meters)
+EARTH_RADIUS = 6371000.0    # in meters
+METERS_PER_DEGREE = 2 * math.pi * EARTH_RADIUS / 360
+
+
+def valid(latitude, longitude):
+    """Check if the values are a valid location."""
+    for value in (latitude, longitude):
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            return False
+    return -90 <= latitude <= 90 and -180 <= longitude <= 180
+
+
+def encode(latitude, longitude, precision=PRECISION):
+    """Return the geohash of the location."""
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    geohash = []
+    bits = 0
+    bit_count = 0
+    even = True     # geohashes start with a longitude bit
+    while len(geohash) < precision:
+        if even:
+            (value, limits) = (longitude, lon_range)
+        else:
+            (value, limits) = (latitude, lat_range)
+
+        middle = (limits[0] + limits[1]) / 2
+        bits <<= 1
+        if value >= middle:
+            bits |= 1
+            limits[0] = middle
+        else:
+            limits[1] = middle
+
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            geohash.append(BASE32[bits])
+            bits = 0
+            bit_count = 0
+    return ''.join(geohash)
+
+
+def cell_size(precision):
+    """Height and width, in degrees, of the geohash cells of the
+    precision."""
+    bits = 5 * precision
+    lon_bits = (bits + 1) // 2
+    lat_bits = bits // 2
+    return (180.0 / 2 ** lat_bits, 360.0 / 2 ** lon_bits)
+
+
+def distance(lat1, lon1, lat2, lon2):
+    """Distance, in meters, between two locations (haversine)."""
+    (lat1, lon1, lat2, lon2) = [math.radians(value)
+                                for value in (lat1, lon1, lat2, lon2)]
+    half_chord = (math.sin((lat2 - lat1) / 2) ** 2 +
+                  math.cos(lat1) * math.cos(lat2) *
+                  math.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS * math.asin(min(1.0, math.sqrt(half_chord)))
+
+
+def covering_cells(latitude, longitude, radius):
+    """Return the geohash cells that cover the circle around the location:
+    the cell of the location and its neighbours, in a precision where the
+    cells are bigger than the radius."""
+    precision = 1
+    for candidate in range(PRECISION, 0, -1):
+        (height, width) = cell_size(candidate)
+        width_meters = (width * METERS_PER_DEGREE *
+                        math.cos(math.radians(latitude)))
+        if height * METERS_PER_DEGREE >= radius and width_meters >= radius:
+            precision = candidate
+            break
+
+    (height, width) = cell_size(precision)
+    cells = set()
+    for lat_step in (-1, 0, 1):
+        lat = latitude + lat_step * height
+        if lat < -90 or lat > 90:
+            continue
+
+        for lon_step in (-1, 0, 1):
+            lon = longitude + lon_step * width
+            lon = (lon + 180) % 360 - 180   # wrap around the date line
+            cells.add(encode(lat, lon, precision))
+    return sorted(cells)
+
+
+def near(column, latitude, longitude, radius):
+    """Condition for geohashes in `column` in the cells around the location
+    (which still need their distances checked)."""
+    ranges = []
+    for cell in covering_cells(latitude, longitude, radius):
+        # '~' comes after every geohash character
+        ranges.append(and_(column >= cell, column < cell + '~'))
+    return or_(*ranges)
@@ -4,44 +4,67 @@
 """Helper functions."""
 
 import logging
+import math
 
+from collections import namedtuple
 from functools import wraps
 
+from flask import g
 from flask import request
+from flask import current_app
+from flask import Response
+from flask import stream_with_context
 
+from sqlalchemy.orm import make_transient_to_detached
+
+from luncho import geo
+from luncho import cache
+from luncho import queries
+from luncho import versions
+from luncho import compression
+
+from luncho.serializer import dumps
+from luncho.serializer import read_body
+from luncho.serializer import wants_msgpack
+from luncho.serializer import jsonify
+
+from luncho.schemas import Schema
+
+from luncho.tracing import span
+
+from luncho.server import db
 from luncho.server import User
+from luncho.server import user_groups
 
 from luncho.exceptions import RequestMustBeJSONException
 from luncho.exceptions import InvalidTokenException
-from luncho.exceptions import MissingFieldsException
 from luncho.exceptions import UserNotFoundException
 from luncho.exceptions import AuthorizationRequiredException
+from luncho.exceptions import InvalidPaginationException
+from luncho.exceptions import InvalidLocationException
 
 LOG = logging.getLogger('luncho.helpers')
 
 
 class ForceJSON(object):
-    """Decorator to check if the request is in JSON format."""
-    def __init__(self, required=None):
-        self.required = required or []
+    """Decorator to check if the request is in JSON (or MessagePack)
+    format, with the fields (:py:class:`luncho.schemas.Field`) the view
+    reads. The body is parsed and validated once; the view reads the valid
+    fields from `request.as_json`."""
+    def __init__(self, *fields):
+        self.schema = Schema(*fields)
 
     def __call__(self, func):
         @wraps(func)
         def check_json(*args, **kwargs):
-            json = request.get_json(force=True, silent=True)
+            with span('parse_json'):
+                json = read_body()
             if not json:
                 raise RequestMustBeJSONException()
 
-            # now we have the JSON, let's check if all the fields are here.
-            missing = []
-            for field in self.required or []:
-                if not field in json:
-                    missing.append(field)
-
-            if missing:
-                raise MissingFieldsException(missing)
-
-            request.as_json = json     # replace with a forced json
+            with span('validate_json'):
+                request.as_json = self.schema.validate(json,
+                                                       current_app.config)
             return func(*args, **kwargs)
         return check_json
 
@@ -59,15 +82,291 @@ def auth(func):
             raise AuthorizationRequiredException
 
         token = request.authorization.username
-        user = User.query.filter_by(token=token).first()
-        if not user:
-            LOG.debug('No user with token {token}'.format(token=token))
-            raise UserNotFoundException()
+        with span('auth'):
+            user = _user_by_token(token)
+            if not user:
+                LOG.debug('No user with token {token}'.format(token=token))
+                raise UserNotFoundException()
 
-        if not user.valid_token(token):
-            raise InvalidTokenException()
+            if not user.valid_token(token):
+                raise InvalidTokenException()
 
         request.user = user
 
         return func(*args, **kwargs)
     return check_auth
+
+
+# columns of the cached users: what `auth` needs (anything else, like the
+# passhash, is loaded when used)
+AUTH_COLUMNS = ['username', 'token', 'created_at', 'validated']
+
+
+def _user_by_token(token):
+    """The user with the token, from the cache if it is there."""
+    key = cache.auth_key(token)
+    row = cache.get(key)
+    if row is None:
+        user = queries.user_by_token(token)
+        if user:
+            cache.put(key, dict((name, getattr(user, name))
+                                for name in AUTH_COLUMNS))
+        return user
+
+    # rebuild the user as if it was loaded from the database, without
+    # going there (the other columns are loaded if the view uses them)
+    user = User.__mapper__.class_manager.new_instance()
+    for (name, value) in row.items():
+        setattr(user, name, value)
+    make_transient_to_detached(user)
+    return db.session.merge(user, load=False)
+
+
+class QueryBudgetExceeded(AssertionError):
+    """A view ran more SQL queries than its budget."""
+    pass
+
+
+class QueryBudget(object):
+    """Decorator with the maximum number of SQL queries the view (and the
+    decorators below it) can run. In tests, going over the budget raises
+    :py:class:`QueryBudgetExceeded`; otherwise, a warning with the
+    statements is logged."""
+    def __init__(self, queries):
+        self.queries = queries
+
+    def __call__(self, func):
+        @wraps(func)
+        def check_budget(*args, **kwargs):
+            g.sql_statements = []   # filled by the metrics SQL events
+            response = func(*args, **kwargs)
+            statements = g.sql_statements
+            del g.sql_statements
+
+            if len(statements) <= self.queries:
+                return response
+
+            message = ('{view} ran {count} queries, budget is '
+                       '{budget}').format(view=func.__name__,
+                                          count=len(statements),
+                                          budget=self.queries)
+            if current_app.testing:
+                raise QueryBudgetExceeded(
+                    message + ':\n' + '\n'.join(statements))
+
+            LOG.warning(message)
+            for statement in statements:
+                LOG.warning('\t' + statement)
+            return response
+        return check_budget
+
+
+class Conditional(object):
+    """Decorator for views whose response depends only on version counters
+    (see :py:mod:`luncho.versions`). `keys` receives the arguments of the
+    view and returns the keys the response depends on, or None to skip the
+    check (e.g., when the user can't see the response anyway, so the view
+    raises the proper error). Responses get a strong ETag and requests with
+    a matching `If-None-Match` get a `304 Not Modified` without running the
+    view. The counters are left in `request.versions`.
+
+    `member` adds the groups of the user to the keys; `daily` is for
+    responses that change every day."""
+    def __init__(self, keys, member=False, daily=False):
+        self.keys = keys
+        self.member = member
+        self.daily = daily
+
+    def __call__(self, func):
+        @wraps(func)
+        def check_version(*args, **kwargs):
+            keys = self.keys(*args, **kwargs)
+            if keys is None:
+                return func(*args, **kwargs)
+
+            member = None
+            if self.member:
+                member = request.user.username
+            with span('etag'):
+                request.versions = versions.current(keys, member)
+                tag = versions.etag(request.versions, self.daily)
+
+            # compressed responses have the encoding in their ETags
+            for known in [tag] + [tag + '-' + encoding
+                                  for encoding in compression.ENCODINGS]:
+                if request.if_none_match.contains(known):
+                    response = current_app.response_class(status=304)
+                    response.set_etag(known)
+                    return response
+
+            response = func(*args, **kwargs)
+            response.set_etag(tag)
+            return response
+        return check_version
+
+
+def is_member(group_id, username):
+    """Check if the user is a member of the group without loading the whole
+    list of members. The answer is kept till the end of the request, so
+    checking again (e.g., in :py:class:`Conditional` and in the view)
+    doesn't run the query again. Memberships are cached too (see
+    :py:mod:`luncho.cache`), but not their absence: a group id can come
+    back (SQLite reuses them) with members that no delete knew about."""
+    checked = getattr(request, 'memberships', None)
+    if checked is None:
+        checked = request.memberships = {}
+
+    key = (group_id, username)
+    if key not in checked:
+        cache_key = cache.member_key(group_id, username)
+        member = cache.get(cache_key)
+        if member is None:
+            member = _is_member(group_id, username)
+            if member:
+                cache.put(cache_key, member)
+        checked[key] = member
+    return checked[key]
+
+
+def _is_member(group_id, username):
+    membership = db.session.query(user_groups).filter_by(group_id=group_id,
+                                                         username=username)
+    return db.session.query(membership.exists()).scalar()
+
+
+# ----------------------------------------------------------------------
+#  Pagination and streaming
+# ----------------------------------------------------------------------
+
+Page = namedtuple('Page', ['after', 'limit', 'stream'])
+
+
+def pagination(key=None):
+    """Read the pagination parameters from the query string.
+
+    `after` is the key of the last element the client received (converted
+    with `key`, if any), `limit` is the number of elements in the page and
+    `stream` requests the list as a streamed response. If the client sends
+    neither `after` nor `limit`, the limit is None and the whole list is
+    returned, as before pagination existed."""
+    after = request.args.get('after')
+    if after is not None and key is not None:
+        try:
+            after = key(after)
+        except ValueError:
+            raise InvalidPaginationException('after')
+
+    limit = request.args.get('limit')
+    if limit is not None:
+        try:
+            limit = int(limit)
+        except ValueError:
+            raise InvalidPaginationException('limit')
+
+        if limit < 1 or limit > current_app.config['MAX_PAGE_SIZE']:
+            raise InvalidPaginationException('limit')
+    elif after is not None:
+        limit = current_app.config['PAGE_SIZE']
+
+    stream = request.args.get('stream', '').lower() in ['1', 'true', 'yes']
+    return Page(after=after, limit=limit, stream=stream)
+
+
+def _keyset(query, page, column):
+    """Position the query after the last key the client received."""
+    if page.after is not None:
+        query = query.filter(column > page.after)
+    return query.order_by(column)
+
+
+def paginate(query, page, column, convert):
+    """Apply the page to a query ordered by `column` (which must be unique)
+    and return the converted elements and the key for the next page (None
+    if this is the last page)."""
+    query = _keyset(query, page, column)
+    if page.limit is None:
+        return ([convert(row) for row in query], None)
+
+    # request one extra row, so we know if there is a next page without
+    # running a count
+    rows = query.limit(page.limit + 1).all()
+    next_key = None
+    if len(rows) > page.limit:
+        rows = rows[:page.limit]
+        next_key = getattr(rows[-1], column.key)
+    return ([convert(row) for row in rows], next_key)
+
+
+def stream_list(field, query, page, column, convert):
+    """Return a response that streams `{"status": "OK", field: [...]}`,
+    fetching the rows of the query in batches, so the whole list is never in
+    memory. With a limit, the key for the next page goes in the end of the
+    stream, as "next" (see :py:func:`paginate`)."""
+    query = _keyset(query, page, column)
+    if page.limit is not None:
+        query = query.limit(page.limit + 1)     # one extra, for "next"
+    batch = current_app.config['STREAM_BATCH_SIZE']
+    state = {'next': None}
+
+    def rows():
+        """The rows of the page; the extra row sets the next key."""
+        last = None
+        for (pos, row) in enumerate(query.yield_per(batch)):
+            if pos == page.limit:
+                state['next'] = getattr(last, column.key)
+                break
+            last = row
+            yield row
+        return
+
+    if wants_msgpack():
+        # MessagePack needs the size of the list before the elements, so
+        # there is no streaming
+        elements = [convert(row) for row in rows()]
+        if page.limit is None:
+            return jsonify(status='OK', **{field: elements})
+        return jsonify(status='OK', next=state['next'], **{field: elements})
+
+    def generate():
+        yield '{{"status": "OK", "{field}": ['.format(field=field)
+        separator = ''
+        for row in rows():
+            yield separator + dumps(convert(row))
+            separator = ','
+        if page.limit is None:
+            yield ']}'
+        else:
+            yield '], "next": {key}}}'.format(key=dumps(state['next']))
+
+    return Response(stream_with_context(generate()),
+                    mimetype='application/json')
+
+
+# ----------------------------------------------------------------------
+#  Locations
+# ----------------------------------------------------------------------
+
+def read_location(json):
+    """Read the "latitude" and "longitude" fields of the request. Returns
+    None if the request has no location, a pair of Nones if the location
+    must be removed (both sent as null) or the location."""
+    if 'latitude' not in json and 'longitude' not in json:
+        return None
+
+    latitude = json.get('latitude')
+    longitude = json.get('longitude')
+    if latitude is None and longitude is None:
+        return (None, None)
+
+    if not geo.valid(latitude, longitude):
+        raise InvalidLocationException()
+    return (latitude, longitude)
+
+
+def read_radius(value, maximum):
+    """Check the radius of a location; it can't be larger than `maximum`
+    meters."""
+    if (isinstance(value, bool) or not isinstance(value, (int, float)) or
+            math.isnan(value) or value <= 0 or value > maximum):
+        raise InvalidLocationException()
+    return value
@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+"""Memory introspection of a running worker.
+
+A report has the live ORM instances per model, the size of the identity
+map of each session, the relationship collections (`group.users`,
+`group.places`...) still loaded and the object types that grew the most
+since the previous report. If `tracemalloc` is available (Python 3.4+, or
+the pytracemalloc backport) and MEMORY_TRACE_FRAMES is set, the allocation
+sites that grew the most are reported too.
+
+Reports are available to the ADMINS in `/admin/memory/` and, if
+MEMORY_SIGNAL is set (e.g. 'SIGUSR2'), logged when the process receives
+that signal. Each report is compared with the previous one, no matter
+where it came from."""
+
+import gc
+import json
+import logging
+import signal
+import threading
+
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.instrumentation import manager_of_class
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+LOG = logging.getLogger('luncho.memory')
+
+# one report at a time (they share the previous one); the signal handler
+# runs in the main thread, possibly in the middle of a report of that same
+# thread, so it never waits for the lock (see _handle_signal)
+_lock = threading.Lock()
+_previous = {'types': None, 'snapshot': None}
+
+
+def _type_name(kind):
+    return '{module}.{name}'.format(module=kind.__module__,
+                                    name=kind.__name__)
+
+
+def _is_model(kind):
+    try:
+        return manager_of_class(kind) is not None
+    except Exception:
+        return False
+
+
+def live_objects():
+    """Count the objects tracked by the garbage collector.
+
+    :return: counts per type, per model and the sizes of the identity maps
+        of the sessions.
+    :rtype: tuple(dict, dict, list)"""
+    types = {}
+    identity_maps = []
+    for obj in gc.get_objects():
+        kind = type(obj)
+        types[kind] = types.get(kind, 0) + 1
+        if isinstance(obj, Session):
+            identity_maps.append(len(obj.identity_map))
+
+    models = dict((kind.__name__, count) for (kind, count) in types.items()
+                  if _is_model(kind))
+    types = dict((_type_name(kind), count)
+                 for (kind, count) in types.items())
+    return (types, models, identity_maps)
+
+
+def _growth(current, previous, top):
+    """The `top` types that grew the most (or the largest, the first
+    time)."""
+    previous = previous or {}
+    rows = [{'type': name,
+             'count': count,
+             'diff': count - previous.get(name, 0)}
+            for (name, count) in current.items()]
+    rows.sort(key=lambda row: (row['diff'], row['count']), reverse=True)
+    return rows[:top]
+
+
+def _allocations(top):
+    """The `top` allocation sites that grew the most since the last
+    snapshot, or None if tracemalloc isn't tracing."""
+    if tracemalloc is None or not tracemalloc.is_tracing():
+        return None
+
+    snapshot = tracemalloc.take_snapshot().filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, __file__)])
+    previous = _previous['snapshot']
+    _previous['snapshot'] = snapshot
+    if previous is None:
+        stats = snapshot.statistics('lineno')
+    else:
+        stats = snapshot.compare_to(previous, 'lineno')
+
+    return [{'site': str(stat.traceback[0]),
+             'size': stat.size,
+             'size_diff': getattr(stat, 'size_diff', stat.size),
+             'count': stat.count,
+             'count_diff': getattr(stat, 'count_diff', stat.count)}
+            for stat in stats[:top]]
+
+
+def report(top=20):
+    """Build a memory report, compared to the previous one."""
+    with _lock:
+        return _report(top)
+
+
+def _report(top):
+    """Build the report; the caller holds the lock."""
+    gc.collect()    # only what is really alive
+    (types, models, identity_maps) = live_objects()
+    collections = sum(count for (name, count) in types.items()
+                      if name.startswith('sqlalchemy.orm.collections.'))
+
+    result = {'objects': sum(types.values()),
+              'models': models,
+              'identity_maps': sorted(identity_maps, reverse=True),
+              'collections': collections,
+              'types': _growth(types, _previous['types'], top),
+              'allocations': _allocations(top)}
+    _previous['types'] = types
+    return result
+
+
+def _handle_signal(signum, frame):
+    if not _lock.acquire(False):
+        LOG.warning('Memory report skipped: another report is running')
+        return
+
+    try:
+        result = _report(20)
+    finally:
+        _lock.release()
+    LOG.warning('Memory report:\n{report}'.format(
+        report=json.dumps(result, indent=2, sort_keys=True)))
+    return
+
+
+def init_app(app):
+    """Start tracing allocations and install the signal handler, as
+    configured."""
+    frames = app.config['MEMORY_TRACE_FRAMES']
+    if frames:
+        if tracemalloc is None:
+            LOG.warning('tracemalloc is not available; memory reports will '
+                        'have only object counts')
+        elif not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+
+    name = app.config['MEMORY_SIGNAL']
+    if name:
+        try:
+            signal.signal(getattr(signal, name), _handle_signal)
+        except ValueError:
+            # only the main thread can handle signals
+            LOG.warning('Could not handle {name} in this thread'.format(
+                name=name))
+    return
@@ -0,0 +1,259 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+"""Request metrics, exposed in the Prometheus text format.
+
+Each request gets its latency, number of SQL queries and time spent in SQL
+recorded in histograms, labeled by endpoint; responses are counted by
+status code and errors by their code. All the values are kept in memory,
+per process, and updating them is just a few additions under a lock."""
+
+import bisect
+import threading
+import time
+
+from flask import Response
+from flask import g
+from flask import request
+from flask import has_request_context
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5,
+                   5.0, 10.0)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200)
+
+
+# ----------------------------------------------------------------------
+#  Metric types
+# ----------------------------------------------------------------------
+
+def _labels(names, values):
+    """Format the labels of a sample."""
+    if not names:
+        return ''
+    pairs = []
+    for (name, value) in zip(names, values):
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"')
+        pairs.append('{name}="{value}"'.format(name=name, value=value))
+    return '{' + ','.join(pairs) + '}'
+
+
+class Counter(object):
+    """A value that only goes up."""
+    kind = 'counter'
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, labels=(), amount=1):
+        """Increment the counter with the labels."""
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+        return
+
+    def samples(self):
+        """Return the (suffix, labels, value) samples of the metric."""
+        with self.lock:
+            values = sorted(self.values.items())
+        return [('', _labels(self.labels, labels), value)
+                for (labels, value) in values]
+
+
+class Histogram(object):
+    """Distribution of values, in cumulative buckets."""
+    kind = 'histogram'
+
+    def __init__(self, name, description, buckets, labels=()):
+        self.name = name
+        self.description = description
+        self.buckets = buckets
+        self.labels = labels
+        self.values = {}    # labels: [count per bucket (+Inf last), sum]
+        self.lock = threading.Lock()
+
+    def observe(self, value, labels=()):
+        """Record the value with the labels."""
+        position = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            data = self.values.get(labels)
+            if data is None:
+                data = [[0] * (len(self.buckets) + 1), 0]
+                self.values[labels] = data
+            data[0][position] += 1
+            data[1] += value
+        return
+
+    def samples(self):
+        """Return the (suffix, labels, value) samples of the metric."""
+        with self.lock:
+            values = sorted((labels, (list(data[0]), data[1]))
+                            for (labels, data) in self.values.items())
+
+        names = self.labels + ('le',)
+        result = []
+        for (labels, (counts, total)) in values:
+            cumulative = 0
+            bounds = [repr(float(bound)) for bound in self.buckets]
+            for (bound, count) in zip(bounds + ['+Inf'], counts):
+                cumulative += count
+                result.append(('_bucket',
+                               _labels(names, labels + (bound,)),
+                               cumulative))
+            result.append(('_sum', _labels(self.labels, labels), total))
+            result.append(('_count', _labels(self.labels, labels),
+                           cumulative))
+        return result
+
+
+# ----------------------------------------------------------------------
+#  The metrics
+# ----------------------------------------------------------------------
+
+REQUEST_LATENCY = Histogram('luncho_request_duration_seconds',
+                            'Time spent processing requests',
+                            LATENCY_BUCKETS,
+                            ('endpoint', 'method'))
+SQL_QUERIES = Histogram('luncho_request_sql_queries',
+                        'SQL queries executed per request',
+                        QUERY_BUCKETS,
+                        ('endpoint', 'method'))
+SQL_TIME = Histogram('luncho_request_sql_duration_seconds',
+                     'Time spent in SQL per request',
+                     LATENCY_BUCKETS,
+                     ('endpoint', 'method'))
+RESPONSES = Counter('luncho_responses_total',
+                    'Responses, by status code',
+                    ('endpoint', 'method', 'status'))
+ERRORS = Counter('luncho_errors_total',
+                 'Errors returned, by error code',
+                 ('endpoint', 'code', 'status'))
+SINGLE_FLIGHT = Counter('luncho_single_flight_total',
+                        'Coalesced computations, by who did the work',
+                        ('name', 'source'))
+CACHE = Counter('luncho_cache_total',
+                'Cache lookups, by kind of key and result',
+                ('key', 'result'))
+
+METRICS = [REQUEST_LATENCY, SQL_QUERIES, SQL_TIME, RESPONSES, ERRORS,
+           SINGLE_FLIGHT, CACHE]
+
+
+def render():
+    """Return all the metrics in the Prometheus text format."""
+    lines = []
+    for metric in METRICS:
+        lines.append('# HELP {name} {description}'.format(
+            name=metric.name, description=metric.description))
+        lines.append('# TYPE {name} {kind}'.format(name=metric.name,
+                                                   kind=metric.kind))
+        for (suffix, labels, value) in metric.samples():
+            lines.append('{name}{suffix}{labels} {value}'.format(
+                name=metric.name,
+                suffix=suffix,
+                labels=labels,
+                value=repr(value)))
+    return '\n'.join(lines) + '\n'
+
+
+def _endpoint():
+    """Name of the endpoint of the current request."""
+    return request.endpoint or 'unknown'
+
+
+def count_error(error):
+    """Count an error (a :py:class:`LunchoException`) returned to the
+    client."""
+    if not has_request_context():
+        return
+    code = error.__class__.__name__[:-9]
+    ERRORS.inc((_endpoint(), code, str(error.status)))
+    return
+
+
+# ----------------------------------------------------------------------
+#  SQL
+# ----------------------------------------------------------------------
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    if context is not None:
+        context.luncho_query_start = time.time()
+    return
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    start = getattr(context, 'luncho_query_start', None)
+    if start is None:
+        return
+
+    elapsed = time.time() - start
+    if has_request_context() and hasattr(g, 'sql_queries'):
+        g.sql_queries += 1
+        g.sql_time += elapsed
+
+        # views with a query budget keep their statements
+        statements = getattr(g, 'sql_statements', None)
+        if statements is not None:
+            statements.append(statement)
+    return
+
+
+# ----------------------------------------------------------------------
+#  Requests
+# ----------------------------------------------------------------------
+
+def _start_request():
+    g.request_start = time.time()
+    g.sql_queries = 0
+    g.sql_time = 0.0
+    return
+
+
+def _finish_request(response):
+    if not hasattr(g, 'request_start'):
+        return response
+
+    elapsed = time.time() - g.request_start
+    labels = (_endpoint(), request.method)
+    REQUEST_LATENCY.observe(elapsed, labels)
+    SQL_QUERIES.observe(g.sql_queries, labels)
+    SQL_TIME.observe(g.sql_time, labels)
+    RESPONSES.inc(labels + (str(response.status_code),))
+    return response
+
+
+def metrics():
+    """Request metrics, in the Prometheus text format.
+
+    .. sourcecode:: http
+
+       HTTP/1.1 200 OK
+       Content-Type: text/plain; version=0.0.4; charset=utf-8
+
+       # HELP luncho_request_duration_seconds Time spent processing requests
+       # TYPE luncho_request_duration_seconds histogram
+       luncho_request_duration_seconds_bucket{endpoint="places.get_places",
+           method="GET",le="0.005"} 12
+
+    :status 200: Success
+    """
+    return Response(render(), content_type=CONTENT_TYPE)
+
+
+def init_app(app):
+    """Measure the requests of the app and add the `/metrics` route."""
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    app.add_url_rule('/metrics', 'metrics', metrics, methods=['GET'])
+    return
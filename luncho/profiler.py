@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+"""Request profiler.
+
+When PROFILE is on, requests with the PROFILE_HEADER header, plus a sample
+of the others (PROFILE_SAMPLE_RATE), run under `cProfile`. The whole WSGI
+call is profiled -- Flask, SQLAlchemy and the database driver included,
+not just the views -- and the result is saved in PROFILE_DIR as collapsed
+stacks (one `frame;frame;frame microseconds` line per stack), the format
+read by `flamegraph.pl`, speedscope and friends. The name of the file is
+returned in the PROFILE_HEADER header of the response.
+
+`cProfile` only records who called whom, not full stacks, so the stacks
+are rebuilt from the call graph, splitting the time of each function among
+its callers in proportion to the time spent in each call."""
+
+import cProfile
+import logging
+import os
+import pstats
+import random
+import re
+import sys
+import threading
+import time
+
+LOG = logging.getLogger('luncho.profiler')
+
+MAX_DEPTH = 200         # frames in a stack, at most
+MIN_TIME = 1            # microseconds; smaller stacks are dropped
+
+_unsafe = re.compile(r'[^A-Za-z0-9_.-]+')
+
+# cProfile can't have two profilers running in the same process
+_lock = threading.Lock()
+
+
+# ----------------------------------------------------------------------
+#  Collapsed stacks
+# ----------------------------------------------------------------------
+
+def _short(filename):
+    """Path of the file, relative to where it was imported from (so
+    `sqlalchemy/orm/query.py`, no matter where SQLAlchemy is installed)."""
+    best = ''
+    for path in sys.path:
+        path = os.path.join(os.path.abspath(path or '.'), '')
+        if filename.startswith(path) and len(path) > len(best):
+            best = path
+    return filename[len(best):]
+
+
+def label(func):
+    """Frame name for a pstats function key."""
+    (filename, line, name) = func
+    if filename == '~':         # built-in
+        return name
+    return '{name} ({filename}:{line})'.format(name=name,
+                                               filename=_short(filename),
+                                               line=line)
+
+
+def collapse(stats):
+    """Rebuild the stacks of a profile, as a dictionary of semicolon
+    separated frames to microseconds spent in the last one.
+
+    :param stats: a :py:class:`pstats.Stats`"""
+    raw = stats.stats   # func: (calls, primitive, own, total, callers)
+    callees = {}
+    for (func, data) in raw.items():
+        for (caller, edge) in data[4].items():
+            # edge: calls, primitive calls, own and total time
+            callees.setdefault(caller, []).append((func, edge[3]))
+
+    stacks = {}
+
+    def walk(func, path, share):
+        # `share` is the fraction of the total time of func spent in this
+        # stack
+        frames = path + (label(func),)
+        own = int(raw[func][2] * share * 1e6)
+        if own >= MIN_TIME:
+            key = ';'.join(frames)
+            stacks[key] = stacks.get(key, 0) + own
+
+        if len(frames) >= MAX_DEPTH:
+            return
+        for (callee, total) in callees.get(func, []):
+            callee_total = raw[callee][3]
+            if callee_total <= 0 or label(callee) in frames:
+                continue    # no time or recursion
+            callee_share = total * share / callee_total
+            if callee_total * callee_share * 1e6 < MIN_TIME:
+                continue
+            walk(callee, frames, callee_share)
+        return
+
+    for (func, data) in raw.items():
+        if not data[4]:     # nobody called it, so it's the top of a stack
+            walk(func, (), 1.0)
+    return stacks
+
+
+def write_collapsed(stacks, path):
+    """Write the collapsed stacks in the file."""
+    with open(path, 'w') as content:
+        for (stack, micro) in sorted(stacks.items()):
+            content.write('{0} {1}\n'.format(stack, micro))
+    return
+
+
+# ----------------------------------------------------------------------
+#  Profiling
+# ----------------------------------------------------------------------
+
+def run(func, *args, **kwargs):
+    """Call func under the profiler; returns the result and the
+    :py:class:`pstats.Stats`."""
+    profile = cProfile.Profile()
+    with _lock:
+        profile.enable()
+        try:
+            result = func(*args, **kwargs)
+        finally:
+            profile.disable()
+    return (result, pstats.Stats(profile))
+
+
+def hottest(stats, count=20, sort='tottime'):
+    """The `count` functions where most of the time went, as tuples of
+    frame name, calls, own time and total time."""
+    rows = []
+    for (func, data) in stats.stats.items():
+        rows.append((label(func), data[1], data[2], data[3]))
+    column = 3 if sort == 'cumulative' else 2
+    rows.sort(key=lambda row: row[column], reverse=True)
+    return rows[:count]
+
+
+def by_package(stats):
+    """Own time spent in each top level package (`luncho`, `sqlalchemy`,
+    `flask`...); built-in functions are counted apart."""
+    packages = {}
+    for (func, data) in stats.stats.items():
+        filename = func[0]
+        if filename == '~':
+            package = '(built-in)'
+        else:
+            package = _short(filename).split(os.sep)[0]
+            if package.endswith('.py'):
+                package = package[:-3]
+        packages[package] = packages.get(package, 0) + data[2]
+    return packages
+
+
+class ProfilerMiddleware(object):
+    """WSGI middleware that profiles the selected requests of the app."""
+    def __init__(self, app, wsgi_app):
+        self.app = app
+        self.wsgi_app = wsgi_app
+
+    def _selected(self, environ):
+        config = self.app.config
+        if not config['PROFILE']:
+            return False
+        header = 'HTTP_' + config['PROFILE_HEADER'].upper().replace('-', '_')
+        if environ.get(header):
+            return True
+        rate = config['PROFILE_SAMPLE_RATE']
+        return rate > 0 and random.random() < rate
+
+    def _filename(self, environ):
+        path = _unsafe.sub('_', environ.get('PATH_INFO', '').strip('/'))
+        return '{stamp}-{unique:04x}-{method}-{path}.collapsed'.format(
+            stamp=time.strftime('%Y%m%d%H%M%S'),
+            unique=random.getrandbits(16),
+            method=environ.get('REQUEST_METHOD', 'GET'),
+            path=path or 'index')
+
+    def __call__(self, environ, start_response):
+        if not self._selected(environ):
+            return self.wsgi_app(environ, start_response)
+
+        filename = self._filename(environ)
+        header = self.app.config['PROFILE_HEADER']
+
+        def profiled_start_response(status, headers, exc_info=None):
+            headers = list(headers) + [(header, filename)]
+            return start_response(status, headers, exc_info)
+
+        def call():
+            # streamed responses are consumed here, so their queries count
+            response = self.wsgi_app(environ, profiled_start_response)
+            try:
+                return list(response)
+            finally:
+                if hasattr(response, 'close'):
+                    response.close()
+
+        (body, stats) = run(call)
+        try:
+            directory = self.app.config['PROFILE_DIR']
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            write_collapsed(collapse(stats), os.path.join(directory,
+                                                          filename))
+        except Exception:
+            LOG.exception('Could not write the profile')
+        return body
+
+
+def init_app(app):
+    """Profile the requests of the app, when PROFILE is on."""
+    app.wsgi_app = ProfilerMiddleware(app, app.wsgi_app)
+    return
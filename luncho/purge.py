@@ -0,0 +1,307 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+"""Removal of groups, places and users, with everything that depends on
+them.
+
+Everything is removed with set-based DELETEs. Groups and places with a lot
+of votes are detached first (they lose their members, places, groups and
+owner, so nobody can reach them anymore) and the votes, followed by the
+element itself, are removed in batches by a background thread, so the
+request doesn't have to wait for it."""
+
+import datetime
+import logging
+import threading
+import Queue
+
+from flask import current_app
+
+from sqlalchemy import func
+from sqlalchemy import select
+
+from luncho.server import db
+from luncho.server import User
+from luncho.server import Group
+from luncho.server import Place
+from luncho.server import Vote
+from luncho.server import CastedVote
+from luncho.server import user_groups
+from luncho.server import group_places
+
+from luncho.search import unindex_place
+
+from luncho import cache
+from luncho import versions
+
+LOG = logging.getLogger('luncho.purge')
+
+votes = Vote.__table__
+casted_votes = CastedVote.__table__
+
+
+# ----------------------------------------------------------------------
+#  Background purging
+# ----------------------------------------------------------------------
+
+class Purger(object):
+    """Run the purge jobs, one at a time, in a background thread."""
+    def __init__(self):
+        self.jobs = Queue.Queue()
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def submit(self, func, *args):
+        """Queue the job; it will run inside the current application
+        context."""
+        app = current_app._get_current_object()
+        with self.lock:
+            if not self.thread or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run,
+                                               name='luncho-purge')
+                self.thread.daemon = True
+                self.thread.start()
+        self.jobs.put((app, func, args))
+        return
+
+    def join(self):
+        """Wait for all the queued jobs to finish."""
+        self.jobs.join()
+        return
+
+    def _run(self):
+        while True:
+            (app, func, args) = self.jobs.get()
+            with app.app_context():
+                try:
+                    func(*args)
+                except Exception:
+                    LOG.exception('Purge {func}{args} failed'.format(
+                        func=func.__name__, args=args))
+                    db.session.rollback()
+                finally:
+                    db.session.remove()
+            self.jobs.task_done()
+
+purger = Purger()
+
+
+# ----------------------------------------------------------------------
+#  Helpers
+# ----------------------------------------------------------------------
+
+def _execute(statement):
+    """Run the statement in the current session."""
+    return db.session.execute(statement)
+
+
+def _is_large(condition):
+    """Check if there are at least PURGE_ASYNC_THRESHOLD votes in the
+    condition (without counting all of them)."""
+    threshold = current_app.config['PURGE_ASYNC_THRESHOLD']
+    rows = select([votes.c.cast]).where(condition).limit(threshold).alias()
+    count = _execute(select([func.count()]).select_from(rows)).scalar()
+    return count >= threshold
+
+
+def _delete_votes(condition):
+    """Delete the votes in the condition, with their casted places."""
+    casts = select([votes.c.cast]).where(condition)
+    _execute(casted_votes.delete().where(casted_votes.c.vote.in_(casts)))
+    _execute(votes.delete().where(condition))
+    return
+
+
+def _delete_votes_in_batches(condition):
+    """Delete the votes in the condition PURGE_BATCH_SIZE at a time,
+    committing after each batch, so the tables are never locked for
+    long."""
+    batch = current_app.config['PURGE_BATCH_SIZE']
+    while True:
+        casts = [row[0] for row
+                 in _execute(select([votes.c.cast])
+                             .where(condition)
+                             .limit(batch))]
+        if not casts:
+            break
+
+        _execute(casted_votes.delete().where(
+            casted_votes.c.vote.in_(casts)))
+        _execute(votes.delete().where(votes.c.cast.in_(casts)))
+        db.session.commit()
+    return
+
+
+# ----------------------------------------------------------------------
+#  Groups
+# ----------------------------------------------------------------------
+
+def delete_group(group_id):
+    """Delete the group, its memberships, its places list and its votes."""
+    (keys, jobs) = _delete_group_rows(group_id)
+    db.session.commit()
+    _after_commit(keys, jobs)
+    return
+
+
+def _delete_group_rows(group_id):
+    """Remove the group in the current transaction, without committing.
+    Returns the cache keys to delete and the background jobs to submit once
+    it is committed (see :py:func:`_after_commit`)."""
+    members = [username for (username,)
+               in _execute(select([user_groups.c.username])
+                           .where(user_groups.c.group_id == group_id))]
+    versions.bump([versions.group(group_id)] +
+                  [versions.user(username) for username in members])
+    memberships = [cache.member_key(group_id, username)
+                   for username in members]
+
+    _execute(user_groups.delete().where(user_groups.c.group_id == group_id))
+    _execute(group_places.delete().where(group_places.c.group == group_id))
+
+    condition = votes.c.group == group_id
+    if _is_large(condition):
+        LOG.debug('Group {group_id} will be purged in background'.format(
+            group_id=group_id))
+        _execute(Group.__table__.update()
+                 .where(Group.id == group_id)
+                 .values(owner=None))
+        return (memberships, [(_purge_group, group_id)])
+
+    _delete_votes(condition)
+    _execute(Group.__table__.delete().where(Group.id == group_id))
+    return (memberships, [])
+
+
+def _after_commit(keys, jobs):
+    """Drop the cache keys and start the background jobs of a committed
+    removal."""
+    cache.delete(*keys)
+    for (job, arg) in jobs:
+        purger.submit(job, arg)
+    return
+
+
+def _purge_group(group_id):
+    """Background part of removing a big group."""
+    _delete_votes_in_batches(votes.c.group == group_id)
+    _execute(Group.__table__.delete().where(Group.id == group_id))
+    db.session.commit()
+    LOG.debug('Group {group_id} purged'.format(group_id=group_id))
+    return
+
+
+# ----------------------------------------------------------------------
+#  Places
+# ----------------------------------------------------------------------
+
+def delete_place(place_id):
+    """Delete the place, removing it from the groups, from the search index
+    and from the votes it received."""
+    owner = _execute(select([Place.owner])
+                     .where(Place.id == place_id)).scalar()
+    versions.bump([versions.user(owner)] +
+                  versions.showing_place(place_id))
+
+    _execute(group_places.delete().where(group_places.c.place == place_id))
+    unindex_place(place_id)
+
+    condition = votes.c.cast.in_(
+        select([casted_votes.c.vote]).where(casted_votes.c.place == place_id))
+    if _is_large(condition):
+        LOG.debug('Place {place_id} will be purged in background'.format(
+            place_id=place_id))
+        _execute(Place.__table__.update()
+                 .where(Place.id == place_id)
+                 .values(owner=None))
+        db.session.commit()
+        purger.submit(_purge_place, place_id)
+        return
+
+    _execute(casted_votes.delete().where(casted_votes.c.place == place_id))
+    _execute(Place.__table__.delete().where(Place.id == place_id))
+    db.session.commit()
+    return
+
+
+def _purge_place(place_id):
+    """Background part of removing a place with lots of votes."""
+    voted = versions.showing_place(place_id)
+    batch = current_app.config['PURGE_BATCH_SIZE']
+    while True:
+        casts = [row[0] for row
+                 in _execute(select([casted_votes.c.vote])
+                             .where(casted_votes.c.place == place_id)
+                             .limit(batch))]
+        if not casts:
+            break
+
+        _execute(casted_votes.delete()
+                 .where(casted_votes.c.place == place_id)
+                 .where(casted_votes.c.vote.in_(casts)))
+        db.session.commit()
+
+    _execute(Place.__table__.delete().where(Place.id == place_id))
+    versions.bump(voted)
+    db.session.commit()
+    LOG.debug('Place {place_id} purged'.format(place_id=place_id))
+    return
+
+
+# ----------------------------------------------------------------------
+#  Users
+# ----------------------------------------------------------------------
+
+def delete_user(username):
+    """Delete the user, the user memberships, votes and groups, all in one
+    transaction. Places maintained by the user are kept (other groups may
+    still use them), but without a maintainer.
+
+    A user votes once a day, which adds up over the years: if the user has
+    more than PURGE_ASYNC_THRESHOLD votes, today's vote is removed right
+    away and the others are detached from the user (left without a user,
+    so they don't count anywhere) and removed in background, like the
+    votes of big groups."""
+    groups = [group_id for (group_id,)
+              in _execute(select([user_groups.c.group_id])
+                          .where(user_groups.c.username == username))]
+    versions.bump([versions.user(username)] +
+                  [versions.group(group_id) for group_id in groups])
+    keys = [cache.member_key(group_id, username) for group_id in groups]
+    jobs = []
+
+    owned = [row[0] for row
+             in _execute(select([Group.id]).where(Group.owner == username))]
+    for group_id in owned:
+        (group_keys, group_jobs) = _delete_group_rows(group_id)
+        keys.extend(group_keys)
+        jobs.extend(group_jobs)
+
+    _execute(Place.__table__.update()
+             .where(Place.owner == username)
+             .values(owner=None))
+    _execute(user_groups.delete().where(user_groups.c.username == username))
+
+    condition = votes.c.user == username
+    if _is_large(condition):
+        LOG.debug('Votes of {username} will be purged in background'.format(
+            username=username))
+        _delete_votes(condition &
+                      (votes.c.created_at == datetime.date.today()))
+        _execute(votes.update().where(condition).values(user=None))
+        jobs.append((_purge_detached_votes, None))
+    else:
+        _delete_votes(condition)
+
+    _execute(User.__table__.delete().where(User.username == username))
+    db.session.commit()
+    _after_commit(keys, jobs)
+    return
+
+
+def _purge_detached_votes(arg):
+    """Background part of removing a user with lots of votes: remove the
+    votes without a user."""
+    _delete_votes_in_batches(votes.c.user == None)  # noqa (IS NULL)
+    LOG.debug('Detached votes purged')
+    return
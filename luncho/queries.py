@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+"""Prepared queries for the lookups every request does.
+
+Building a Query and compiling its SQL takes longer than running it on the
+indexed lookups below, and those run on (almost) every request. Each one
+is built once, with bind parameters, and its compiled form is reused:
+
+* with `sqlalchemy.ext.baked` (SQLAlchemy 1.0+), as a baked query;
+* before that, by running the same (labeled) select through
+  `Query.from_statement`, with a `compiled_cache` execution option.
+
+Lookups by primary key still go to the identity map first, like
+`Query.get`."""
+
+import datetime
+import logging
+
+from sqlalchemy import bindparam
+from sqlalchemy import func
+from sqlalchemy import select
+from sqlalchemy.orm import Query
+from sqlalchemy.orm.util import identity_key
+
+try:
+    from sqlalchemy.ext import baked
+except ImportError:     # SQLAlchemy < 1.0
+    baked = None
+
+from luncho.server import db
+from luncho.server import User
+from luncho.server import Group
+from luncho.server import Place
+from luncho.server import Vote
+
+LOG = logging.getLogger('luncho.queries')
+
+BAKERY = baked.bakery() if baked is not None else None
+
+
+class Lookup(object):
+    """Objects of `model` matching `criterion()` (an expression with bind
+    parameters); prepared on the first use."""
+    def __init__(self, name, model, criterion):
+        self.name = name
+        self.model = model
+        self.criterion = criterion
+        self.prepared = None
+        self.compiled = {}      # compiled_cache, without baked queries
+
+    def _prepare(self):
+        if BAKERY is not None:
+            query = BAKERY(lambda session: session.query(self.model),
+                           self.name)
+            query += lambda query: query.filter(self.criterion())
+            return query
+
+        # already labeled, or the ORM labels it (into a new select) on
+        # every execution
+        return Query(self.model).with_labels().filter(
+            self.criterion()).statement
+
+    def query(self, **params):
+        """The query, in the current session, with the parameters."""
+        if self.prepared is None:
+            LOG.debug('Preparing {name}'.format(name=self.name))
+            self.prepared = self._prepare()
+
+        if BAKERY is not None:
+            return self.prepared(db.session()).params(**params)
+        query = db.session.query(self.model).from_statement(self.prepared)
+        return query.params(**params).execution_options(
+            compiled_cache=self.compiled)
+
+    def first(self, **params):
+        return self.query(**params).first()
+
+    def get(self, ident):
+        """Like `Query.get`, for lookups by the primary key (`id`)."""
+        if identity_key(self.model, ident) in db.session.identity_map:
+            return db.session.query(self.model).get(ident)
+        return self.first(id=ident)
+
+
+class Scalar(object):
+    """A single value (`column`, with `criterion()`); Core only, so it
+    works the same with or without baked queries."""
+    def __init__(self, name, column, criterion):
+        self.name = name
+        self.column = column
+        self.criterion = criterion
+        self.prepared = None
+        self.compiled = {}
+
+    def value(self, mapper, **params):
+        if self.prepared is None:
+            LOG.debug('Preparing {name}'.format(name=self.name))
+            self.prepared = select([self.column()]).where(self.criterion())
+        connection = db.session.connection(mapper=mapper).execution_options(
+            compiled_cache=self.compiled)
+        return connection.execute(self.prepared, **params).scalar()
+
+
+# ----------------------------------------------------------------------
+#  The lookups
+# ----------------------------------------------------------------------
+
+USER_BY_TOKEN = Lookup('user_by_token', User,
+                       lambda: User.token == bindparam('token'))
+GROUP = Lookup('group', Group, lambda: Group.id == bindparam('id'))
+PLACE = Lookup('place', Place, lambda: Place.id == bindparam('id'))
+VOTES_TODAY = Scalar('votes_today',
+                     lambda: func.count(Vote.cast),
+                     lambda: (Vote.group == bindparam('group')) &
+                             (Vote.created_at == bindparam('day')))
+
+
+def user_by_token(token):
+    """The user with the token; None if there is none."""
+    return USER_BY_TOKEN.first(token=token)
+
+
+def group(group_id):
+    """The group (`Group.query.get`); None if it doesn't exist."""
+    return GROUP.get(group_id)
+
+
+def place(place_id):
+    """The place (`Place.query.get`); None if it doesn't exist."""
+    return PLACE.get(place_id)
+
+
+def votes_today(group_id):
+    """Number of members of the group that voted today."""
+    return VOTES_TODAY.value(Vote.__mapper__, group=group_id,
+                             day=datetime.date.today())
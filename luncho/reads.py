@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+"""Read-only data access for the listing endpoints.
+
+The lists the API returns only need a couple of columns of each row, so
+there is no reason to load ORM objects (with their identity map entries and
+change tracking) to copy those columns into a dict. The functions here run
+Core selects and return the rows as namedtuples. The selects run in the
+connection of the session, so they see the current transaction, but
+nothing is added to the session."""
+
+from collections import namedtuple
+
+from sqlalchemy import select
+
+from luncho.server import db
+from luncho.server import User
+from luncho.server import Group
+from luncho.server import Place
+from luncho.server import user_groups as user_groups_table
+from luncho.server import group_places as group_places_table
+
+from luncho.search import visible_to
+
+GroupRow = namedtuple('GroupRow', ['id', 'name', 'owner'])
+MemberRow = namedtuple('MemberRow', ['username', 'fullname'])
+PlaceRow = namedtuple('PlaceRow', ['id', 'name'])
+OwnedPlaceRow = namedtuple('OwnedPlaceRow', ['id', 'name', 'owner'])
+
+
+class Rows(object):
+    """The rows of a select, as `row` tuples. Has the parts of the Query
+    interface the pagination helpers use (`filter`, `order_by`, `limit`,
+    `all`, `yield_per` and iteration)."""
+    def __init__(self, statement, row):
+        self.statement = statement
+        self.row = row
+
+    def _execute(self, statement):
+        return db.session.connection().execute(statement)
+
+    def filter(self, *criterion):
+        return Rows(self.statement.where(*criterion), self.row)
+
+    def order_by(self, *columns):
+        return Rows(self.statement.order_by(*columns), self.row)
+
+    def limit(self, limit):
+        return Rows(self.statement.limit(limit), self.row)
+
+    def all(self):
+        row = self.row
+        return [row(*values) for values in self._execute(self.statement)]
+
+    def __iter__(self):
+        return iter(self.all())
+
+    def yield_per(self, count):
+        """Iterate over the rows, fetching `count` at a time."""
+        row = self.row
+        result = self._execute(self.statement)
+        try:
+            while True:
+                batch = result.fetchmany(count)
+                if not batch:
+                    break
+                for values in batch:
+                    yield row(*values)
+        finally:
+            result.close()
+        return
+
+    def first(self):
+        rows = self.limit(1).all()
+        if not rows:
+            return None
+        return rows[0]
+
+
+def group(group_id):
+    """The group; None if it doesn't exist."""
+    return Rows(select([Group.id, Group.name, Group.owner])
+                .where(Group.id == group_id),
+                GroupRow).first()
+
+
+def user_groups(username):
+    """The groups of the user."""
+    return Rows(select([Group.id, Group.name, Group.owner])
+                .select_from(Group.__table__.join(
+                    user_groups_table,
+                    user_groups_table.c.group_id == Group.id))
+                .where(user_groups_table.c.username == username)
+                .distinct(),
+                GroupRow)
+
+
+def members(group_id):
+    """The members of the group."""
+    return Rows(select([User.username, User.fullname])
+                .select_from(User.__table__.join(
+                    user_groups_table,
+                    user_groups_table.c.username == User.username))
+                .where(user_groups_table.c.group_id == group_id)
+                .distinct(),
+                MemberRow)
+
+
+def group_places(group_id):
+    """The places of the group."""
+    return Rows(select([Place.id, Place.name])
+                .select_from(Place.__table__.join(
+                    group_places_table,
+                    group_places_table.c.place == Place.id))
+                .where(group_places_table.c.group == group_id)
+                .distinct(),
+                PlaceRow)
+
+
+def visible_places(username):
+    """The places the user can see (see
+    :py:func:`luncho.search.visible_to`)."""
+    return Rows(select([Place.id, Place.name, Place.owner])
+                .where(visible_to(username)),
+                OwnedPlaceRow)
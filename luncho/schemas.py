@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+"""Schemas of the request bodies.
+
+Each endpoint that receives a body declares its fields (see
+:py:class:`luncho.helpers.ForceJSON`); the schema is compiled into a list
+of checks once, when the module of the endpoint is imported, so validating
+a request only runs the checks each field needs. Limits can be numbers or
+the name of the setting with the number, read when the request is
+validated.
+
+Fields with the wrong type (or too long) are reported all at once with
+:py:class:`InvalidFieldsException`; the validated body has only the fields
+in the schema."""
+
+import numbers
+
+from luncho.exceptions import RequestMustBeJSONException
+from luncho.exceptions import MissingFieldsException
+from luncho.exceptions import InvalidFieldsException
+
+try:
+    string_types = basestring
+except NameError:   # Python 3
+    string_types = str
+
+
+def _is_string(value):
+    return isinstance(value, string_types)
+
+
+def _is_integer(value):
+    return (isinstance(value, numbers.Integral) and
+            not isinstance(value, bool))
+
+
+def _is_bool(value):
+    return isinstance(value, bool)
+
+
+def _is_list(value):
+    return isinstance(value, list)
+
+
+def _is_dict(value):
+    return isinstance(value, dict)
+
+
+def _is_anything(value):
+    return True
+
+
+KINDS = {str: _is_string,
+         int: _is_integer,
+         bool: _is_bool,
+         list: _is_list,
+         dict: _is_dict,
+         None: _is_anything}
+
+
+def _limit(limit):
+    """Function of the config returning the limit."""
+    if isinstance(limit, string_types):
+        return lambda config: config[limit]
+    return lambda config: limit
+
+
+class Field(object):
+    """A field of a request body.
+
+    :param name: name of the field
+    :param kind: `str`, `int`, `bool`, `list`, `dict` or None (anything,
+        checked by the view)
+    :param required: the request must have the field
+    :param nullable: the field can be null
+    :param items: kind of the elements, for lists
+    :param max_length: longest string (or setting with it)
+    :param max_items: longest list (or setting with it)"""
+    def __init__(self, name, kind=None, required=False, nullable=False,
+                 items=None, max_length=None, max_items=None):
+        self.name = name
+        self.kind = kind
+        self.required = required
+        self.nullable = nullable
+        self.items = items
+        self.max_length = max_length
+        self.max_items = max_items
+
+    def compile(self):
+        """The check of the field: a function of the value and the config
+        returning if the value is valid."""
+        if self.kind is None:
+            return lambda value, config: True
+
+        checks = []
+        is_kind = KINDS[self.kind]
+        checks.append(lambda value, config: is_kind(value))
+
+        if self.max_length is not None:
+            max_length = _limit(self.max_length)
+            checks.append(lambda value, config:
+                          len(value) <= max_length(config))
+
+        if self.max_items is not None:
+            max_items = _limit(self.max_items)
+            checks.append(lambda value, config:
+                          len(value) <= max_items(config))
+
+        if self.items is not None:
+            is_item = KINDS[self.items]
+            checks.append(lambda value, config:
+                          all(is_item(item) for item in value))
+
+        nullable = self.nullable
+
+        def check(value, config):
+            if value is None:
+                return nullable
+            for step in checks:
+                if not step(value, config):
+                    return False
+            return True
+        return check
+
+
+class Schema(object):
+    """The fields of a request body."""
+    def __init__(self, *fields):
+        self.required = [field.name for field in fields if field.required]
+        self.checks = [(field.name, field.compile()) for field in fields]
+
+    def validate(self, body, config):
+        """Return the fields of the schema in the body, if they are all
+        valid."""
+        if not isinstance(body, dict):
+            raise RequestMustBeJSONException()
+
+        missing = [name for name in self.required if name not in body]
+        if missing:
+            raise MissingFieldsException(missing)
+
+        valid = {}
+        invalid = []
+        for (name, check) in self.checks:
+            if name not in body:
+                continue
+            value = body[name]
+            if check(value, config):
+                valid[name] = value
+            else:
+                invalid.append(name)
+
+        if invalid:
+            raise InvalidFieldsException(invalid)
+        return valid
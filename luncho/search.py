@@ -0,0 +1,258 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+"""Place name search, backed by a trigram index.
+
+Every word of a place name is broken in trigrams (padded with two spaces in
+the front and one in the end, so the start of the word gets its own
+trigrams) and stored in the `place_trigrams` table. A search looks for the
+places that have all the trigrams of the query and then checks the names
+of those candidates only. The same index finds places with similar names,
+to catch duplicates."""
+
+import logging
+import math
+import re
+
+from flask import current_app
+
+from sqlalchemy import func
+from sqlalchemy import or_
+from sqlalchemy import select
+
+from luncho.server import db
+from luncho.server import Place
+from luncho.server import place_trigrams
+from luncho.server import group_places
+from luncho.server import user_groups
+
+LOG = logging.getLogger('luncho.search')
+
+WORDS = re.compile(r'\w+', re.UNICODE)
+
+
+def words(text):
+    """Split the text in lowercase words, ignoring punctuation."""
+    return WORDS.findall(text.lower())
+
+
+def trigrams(text):
+    """Return the set of trigrams of all the words in the text."""
+    grams = set()
+    for word in words(text):
+        padded = '  ' + word + ' '
+        for pos in range(len(padded) - 2):
+            grams.add(padded[pos:pos + 3])
+    return grams
+
+
+def _query_trigrams(word):
+    """Trigrams that a name must have to contain the word. Words with less
+    than three characters only match the start of words in the name (see
+    :py:func:`_word_start`)."""
+    if len(word) < 3:
+        padded = '  ' + word
+        return set(padded[pos:pos + 3] for pos in range(len(word)))
+
+    return set(word[pos:pos + 3] for pos in range(len(word) - 2))
+
+
+def _word_start(word):
+    """The trigram that only names with a word starting with the (short)
+    word have: the padding comes before the first letter of a word only."""
+    return ('  ' + word)[-3:]
+
+
+# ----------------------------------------------------------------------
+#  Index maintenance
+# ----------------------------------------------------------------------
+
+def index_place(place):
+    """Add the place name to the index. The place must have an id already
+    (flush the session before calling this)."""
+    grams = trigrams(place.name)
+    if not grams:
+        return
+
+    db.session.execute(place_trigrams.insert(),
+                       [{'trigram': gram, 'place': place.id}
+                        for gram in grams])
+    return
+
+
+def unindex_place(place_id):
+    """Remove the place from the index."""
+    db.session.execute(place_trigrams.delete().where(
+        place_trigrams.c.place == place_id))
+    return
+
+
+def reindex_place(place):
+    """Replace the indexed name of the place."""
+    unindex_place(place.id)
+    index_place(place)
+    return
+
+
+def rebuild_index():
+    """Drop the whole index and index every place again."""
+    db.session.execute(place_trigrams.delete())
+    for place in Place.query.yield_per(1000):
+        index_place(place)
+    db.session.commit()
+    return
+
+
+# ----------------------------------------------------------------------
+#  Searching
+# ----------------------------------------------------------------------
+
+def visible_to(username):
+    """Condition for places the user can see: the ones the user maintains
+    and the ones in the user's groups."""
+    user_group_ids = db.session.query(user_groups.c.group_id).filter(
+        user_groups.c.username == username)
+    group_place_ids = db.session.query(group_places.c.place).filter(
+        group_places.c.group.in_(user_group_ids.subquery()))
+    return or_(Place.owner == username,
+               Place.id.in_(group_place_ids.subquery()))
+
+
+def _escape_like(word):
+    """Escape the LIKE wildcards in the word."""
+    return (word.replace('\\', '\\\\')
+                .replace('%', '\\%')
+                .replace('_', '\\_'))
+
+
+def _bounded_count(query):
+    """Scalar query counting the rows of the query, stopping at
+    SEARCH_COUNT_LIMIT."""
+    cap = current_app.config['SEARCH_COUNT_LIMIT']
+    rows = query.limit(cap).subquery()
+    return select([func.count()]).select_from(rows).as_scalar()
+
+
+def _postings(gram):
+    """Query for the places with the trigram."""
+    return db.session.query(place_trigrams.c.place).filter(
+        place_trigrams.c.trigram == gram)
+
+
+def search_places(text, username, limit):
+    """Return the places the user can see with names containing all the
+    words in the text, shortest names first (unless there are too many
+    candidates to sort)."""
+    query_words = words(text)
+    if not query_words:
+        return []
+
+    # the search starts from the smallest set: the places with the rarest
+    # trigram or, if smaller, all the places the user can see. the names of
+    # those places are then checked against the words.
+    visible = visible_to(username)
+    sets = [None]
+    counts = [_bounded_count(db.session.query(Place.id).filter(visible))]
+    for word in query_words:
+        for gram in _query_trigrams(word):
+            postings = _postings(gram)
+            sets.append(postings)
+            counts.append(_bounded_count(postings))
+
+    # all the counts in a single statement
+    counts = db.session.execute(select(counts)).fetchone()
+    (smallest, candidates) = min(zip(counts, sets), key=lambda pair: pair[0])
+    LOG.debug('Searching {text}: {count} candidates'.format(text=text,
+                                                            count=smallest))
+    if smallest == 0:
+        return []
+
+    query = Place.query.filter(visible)
+    if candidates is not None:
+        query = query.filter(Place.id.in_(candidates.subquery()))
+
+    for word in query_words:
+        if len(word) < 3:
+            # LIKE can't tell the start of a word; the index can
+            postings = _postings(_word_start(word))
+            query = query.filter(Place.id.in_(postings.subquery()))
+        else:
+            pattern = '%' + _escape_like(word) + '%'
+            query = query.filter(Place.name.ilike(pattern, escape='\\'))
+
+    if smallest >= current_app.config['SEARCH_COUNT_LIMIT']:
+        # too many candidates to sort them all; any match will do (the user
+        # will type more letters anyway)
+        return query.limit(limit).all()
+
+    return (query.order_by(func.length(Place.name), Place.name)
+                 .limit(limit)
+                 .all())
+
+
+# ----------------------------------------------------------------------
+#  Similar names
+# ----------------------------------------------------------------------
+
+def similarity(grams, other_grams):
+    """Jaccard similarity between two sets of trigrams."""
+    if not grams or not other_grams:
+        return 0.0
+    shared = len(grams & other_grams)
+    return float(shared) / (len(grams) + len(other_grams) - shared)
+
+
+def similar_places(name, username, threshold):
+    """Return the places (id and name) the user can see with names similar
+    to `name` (trigram similarity of at least `threshold`), most similar
+    first.
+
+    To avoid comparing the name against every place, only the places that
+    have one of the rarest trigrams of the name are candidates: a name that
+    shares none of the `n - ceil(threshold * n) + 1` rarest trigrams (out of
+    `n`) can't reach the threshold. And a candidate must share at least
+    `ceil(threshold * n)` trigrams to be compared. If the user can see less
+    places than there are candidates, the places the user can see are
+    compared instead."""
+    grams = trigrams(name)
+    if not grams:
+        return []
+
+    grams = list(grams)
+    visible = visible_to(username)
+    counts = [_bounded_count(db.session.query(Place.id).filter(visible))]
+    counts.extend(_bounded_count(_postings(gram)) for gram in grams)
+    counts = db.session.execute(select(counts)).fetchone()
+
+    shared = int(math.ceil(threshold * len(grams)))
+    prefix = len(grams) - shared + 1
+    by_frequency = sorted(zip(counts[1:], grams))[:prefix]
+    LOG.debug('Similar to {name}: {visible} visible, candidates with '
+              '{grams}'.format(name=name, visible=counts[0],
+                               grams=by_frequency))
+
+    # (the count of visible places stops at the limit, so reaching it means
+    # "too many to compare one by one")
+    cap = current_app.config['SEARCH_COUNT_LIMIT']
+    in_prefix = sum(count for (count, _) in by_frequency)
+    places = db.session.query(Place.id, Place.name).filter(visible)
+    if counts[0] >= cap or counts[0] > in_prefix:
+        rarest = [gram for (_, gram) in by_frequency]
+        candidates = (db.session.query(place_trigrams.c.place)
+                      .filter(place_trigrams.c.trigram.in_(rarest)))
+        matches = (db.session.query(place_trigrams.c.place)
+                   .filter(place_trigrams.c.place.in_(candidates.subquery()))
+                   .filter(place_trigrams.c.trigram.in_(grams))
+                   .group_by(place_trigrams.c.place)
+                   .having(func.count() >= shared))
+        places = places.filter(Place.id.in_(matches.subquery()))
+
+    grams = set(grams)
+    similar = []
+    for place in places:
+        score = similarity(grams, trigrams(place.name))
+        if score >= threshold:
+            similar.append((score, place))
+
+    similar.sort(key=lambda pair: (-pair[0], pair[1].id))
+    return [place for (_, place) in similar]
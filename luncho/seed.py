@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+"""Synthetic dataset generator.
+
+Creates users, groups (a few big ones and lots of small ones, as in any
+company), a catalogue of places (most of them with a location) and `days`
+days of votes before today. The same scale and seed always produce the
+same dataset.
+
+Rows go straight to the database driver with `executemany`, in batches,
+skipping the ORM and SQLAlchemy parameter processing, so millions of votes
+load in seconds."""
+
+import datetime
+import logging
+import random
+
+from luncho import geo
+
+from luncho.server import db
+from luncho.server import User
+from luncho.server import Group
+from luncho.server import Place
+from luncho.server import Vote
+from luncho.server import CastedVote
+from luncho.server import user_groups
+from luncho.server import group_places
+from luncho.server import place_trigrams
+
+from luncho.search import trigrams
+
+LOG = logging.getLogger('luncho.seed')
+
+PASSWORD = 'lunch'      # every generated user has the same password
+
+SCALES = {
+    'tiny': {'users': 200, 'groups': 20, 'places': 500, 'days': 10},
+    'small': {'users': 2000, 'groups': 100, 'places': 5000, 'days': 30},
+    'default': {'users': 5000, 'groups': 300, 'places': 20000, 'days': 90},
+    'large': {'users': 20000, 'groups': 1000, 'places': 100000,
+              'days': 180},
+}
+
+BATCH = 50000       # rows sent to the driver at once
+
+VOTING = 0.7        # chance of a member voting in a day
+
+CUISINES = ['Pizza', 'Sushi', 'Burger', 'Taco', 'Noodle', 'Curry', 'Salad',
+            'Steak', 'Falafel', 'Kebab', 'Ramen', 'Pho', 'Barbecue',
+            'Sandwich', 'Dumpling', 'Bistro', 'Grill', 'Deli', 'Bakery',
+            'Vegan']
+KINDS = ['House', 'Place', 'Corner', 'Kitchen', 'Express', 'Bar', 'Garden',
+         'Palace', 'Spot', 'Station', 'Shack', 'Factory']
+OWNERS = ['Joe', 'Maria', 'Luigi', 'Sakura', 'Ahmed', 'Chen', 'Olga',
+          'Pedro', 'Anna', 'Raj', 'Kim', 'Fatima', 'Tom', 'Lucia']
+
+CENTER = (-30.0346, -51.2177)   # places spread around this point
+SPREAD = 0.1                    # degrees
+
+
+# ----------------------------------------------------------------------
+#  Bulk inserts
+# ----------------------------------------------------------------------
+
+class BulkInsert(object):
+    """Insert tuples with the values of `columns` in the table, using the
+    driver directly."""
+    def __init__(self, cursor, dialect, table, columns):
+        quote = dialect.identifier_preparer.quote
+        if dialect.paramstyle == 'qmark':
+            marker = '?'
+        else:
+            marker = '%s'
+        self.statement = 'INSERT INTO {table} ({columns}) VALUES ({values})'
+        self.statement = self.statement.format(
+            table=quote(table.name),
+            columns=', '.join(quote(column) for column in columns),
+            values=', '.join([marker] * len(columns)))
+        self.cursor = cursor
+        self.rows = []
+        self.count = 0
+
+    def add(self, row):
+        self.rows.append(row)
+        if len(self.rows) >= BATCH:
+            self.flush()
+        return
+
+    def extend(self, rows):
+        for row in rows:
+            self.add(row)
+        return
+
+    def flush(self):
+        if self.rows:
+            self.cursor.executemany(self.statement, self.rows)
+            self.count += len(self.rows)
+            self.rows = []
+        return
+
+
+# ----------------------------------------------------------------------
+#  The data
+# ----------------------------------------------------------------------
+
+def _place_name(rand):
+    return u'{owner}\'s {cuisine} {kind}'.format(
+        owner=rand.choice(OWNERS),
+        cuisine=rand.choice(CUISINES),
+        kind=rand.choice(KINDS))
+
+
+def generate(users, groups, places, days, seed=42):
+    """Replace everything in the database with a generated dataset.
+    Returns the number of rows in each table."""
+    rand = random.Random(seed)
+
+    db.drop_all()
+    db.create_all()
+
+    connection = db.session.connection()
+    dialect = connection.dialect
+    if dialect.name == 'sqlite':
+        # it's all or nothing anyway
+        connection.execute('PRAGMA synchronous = OFF')
+    cursor = connection.connection.cursor()
+
+    # building the indexes once, in the end, is a lot faster than updating
+    # them for every row
+    indexes = [index
+               for table in db.metadata.sorted_tables
+               for index in table.indexes]
+    for index in indexes:
+        index.drop(connection)
+
+    def bulk(table, columns):
+        return BulkInsert(cursor, dialect, table, columns)
+
+    # users
+    user_rows = bulk(User.__table__,
+                     ['username', 'fullname', 'passhash', 'validated',
+                      'created_at'])
+    created = datetime.datetime(2015, 1, 1)
+    usernames = ['user{0}'.format(pos) for pos in range(users)]
+    for (pos, username) in enumerate(usernames):
+        user_rows.add((username,
+                       'User {0}'.format(pos),
+                       PASSWORD,
+                       True,
+                       created + datetime.timedelta(seconds=pos)))
+    user_rows.flush()
+    LOG.info('{0} users'.format(user_rows.count))
+
+    # places
+    place_rows = bulk(Place.__table__,
+                      ['id', 'name', 'owner', 'latitude', 'longitude',
+                       'geohash'])
+    gram_rows = bulk(place_trigrams, ['trigram', 'place'])
+    for place_id in range(1, places + 1):
+        name = _place_name(rand)
+        owner = rand.choice(usernames)
+        if rand.random() < 0.8:
+            latitude = CENTER[0] + rand.uniform(-SPREAD, SPREAD)
+            longitude = CENTER[1] + rand.uniform(-SPREAD, SPREAD)
+            place_rows.add((place_id, name, owner, latitude, longitude,
+                            geo.encode(latitude, longitude)))
+        else:
+            place_rows.add((place_id, name, owner, None, None, None))
+        gram_rows.extend((gram, place_id) for gram in sorted(trigrams(name)))
+    place_rows.flush()
+    gram_rows.flush()
+    LOG.info('{0} places'.format(place_rows.count))
+
+    # groups, with skewed sizes (pareto) and a few places each
+    group_rows = bulk(Group.__table__, ['id', 'name', 'owner'])
+    member_rows = bulk(user_groups, ['username', 'group_id'])
+    ballot_rows = bulk(group_places, ['group', 'place'])
+    members = {}
+    ballots = {}
+    for group_id in range(1, groups + 1):
+        size = min(users, int(rand.paretovariate(1.2) * 5) + 1)
+        members[group_id] = rand.sample(usernames, size)
+        ballots[group_id] = rand.sample(xrange(1, places + 1),
+                                        min(places, rand.randint(3, 30)))
+
+        group_rows.add((group_id, 'Group {0}'.format(group_id),
+                        members[group_id][0]))
+        member_rows.extend((username, group_id)
+                           for username in members[group_id])
+        ballot_rows.extend((group_id, place_id)
+                           for place_id in ballots[group_id])
+    group_rows.flush()
+    member_rows.flush()
+    ballot_rows.flush()
+    LOG.info('{0} groups, {1} memberships'.format(group_rows.count,
+                                                  member_rows.count))
+
+    # votes; users vote once a day, in a single group
+    vote_rows = bulk(Vote.__table__, ['cast', 'user', 'created_at', 'group'])
+    cast_rows = bulk(CastedVote.__table__, ['vote', 'order', 'place'])
+    in_vote = db.get_app().config['PLACES_IN_VOTE']
+    today = datetime.date.today()
+    cast = 0
+    for day in range(days, 0, -1):
+        date = today - datetime.timedelta(days=day)
+        voted = set()
+        for group_id in range(1, groups + 1):
+            ballot = ballots[group_id]
+            choices = min(in_vote, len(ballot))
+            for username in members[group_id]:
+                if username in voted or rand.random() > VOTING:
+                    continue
+                voted.add(username)
+
+                cast += 1
+                vote_rows.add((cast, username, date, group_id))
+                for (order, place) in enumerate(rand.sample(ballot,
+                                                            choices)):
+                    cast_rows.add((cast, order, place))
+    vote_rows.flush()
+    cast_rows.flush()
+    LOG.info('{0} votes in {1} days'.format(vote_rows.count, days))
+
+    for index in indexes:
+        index.create(connection)
+    db.session.commit()
+    return {'users': user_rows.count,
+            'places': place_rows.count,
+            'groups': group_rows.count,
+            'memberships': member_rows.count,
+            'votes': vote_rows.count,
+            'casted_votes': cast_rows.count}
@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+"""JSON (and MessagePack) serialization.
+
+Responses are encoded with the fastest JSON library installed (orjson,
+python-rapidjson, simplejson with its C speedups or, if none of those, the
+standard library), or the one in JSON_BACKEND. The output is compact,
+unless JSONIFY_PRETTYPRINT_REGULAR is on.
+
+Types JSON doesn't know about are converted by the function registered for
+their type in ENCODERS (see :py:func:`register`): dates become ISO 8601
+strings, sets and dict views become lists. Anything else becomes its
+`isoformat()`, if it has one, or its `str()`.
+
+If msgpack is installed, clients can send `Accept: application/msgpack` to
+get any response, errors included, in MessagePack, and send request bodies
+in MessagePack with `Content-Type: application/msgpack`."""
+
+import datetime
+import decimal
+import json
+import logging
+import uuid
+
+from flask import current_app
+from flask import request
+from flask import has_request_context
+
+from flask.json import JSONEncoder as FlaskJSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import rapidjson
+except ImportError:
+    rapidjson = None
+
+try:
+    import simplejson
+except ImportError:
+    simplejson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+LOG = logging.getLogger('luncho.serializer')
+
+JSON = 'application/json'
+MSGPACK = 'application/msgpack'
+
+
+# ----------------------------------------------------------------------
+#  Types
+# ----------------------------------------------------------------------
+
+def _isoformat(obj):
+    return obj.isoformat()
+
+ENCODERS = {
+    datetime.datetime: _isoformat,
+    datetime.date: _isoformat,
+    datetime.time: _isoformat,
+    set: list,
+    frozenset: list,
+    decimal.Decimal: float,
+    uuid.UUID: str,
+}
+
+# dict views (Python 2 has them with the `view` prefix)
+for _name in ['keys', 'values', 'items',
+              'viewkeys', 'viewvalues', 'viewitems']:
+    if hasattr(dict, _name):
+        _kind = type(getattr({}, _name)())
+        if _kind is not list:
+            ENCODERS[_kind] = list
+
+
+def register(kind, encoder):
+    """Encode objects of `kind` (and its subclasses) with `encoder`, which
+    must return something JSON can represent."""
+    ENCODERS[kind] = encoder
+    return
+
+
+def _encoder_for(kind):
+    """Find the encoder of a type not in ENCODERS and remember it."""
+    for base in kind.__mro__[1:]:
+        if base in ENCODERS:
+            encoder = ENCODERS[base]
+            break
+    else:
+        if hasattr(kind, 'isoformat'):
+            encoder = _isoformat
+        else:
+            encoder = str
+    ENCODERS[kind] = encoder
+    return encoder
+
+
+def default(obj):
+    """Convert an object the JSON libraries don't know about."""
+    encoder = ENCODERS.get(type(obj))
+    if encoder is None:
+        encoder = _encoder_for(type(obj))
+    return encoder(obj)
+
+
+class JSONEncoder(FlaskJSONEncoder):
+    """Encoder for whatever still goes through `flask.json`."""
+    def default(self, obj):
+        return default(obj)
+
+
+# ----------------------------------------------------------------------
+#  Backends
+# ----------------------------------------------------------------------
+# each one receives the object and the indentation (None for compact) and
+# returns the encoded JSON
+
+def _orjson(obj, indent):
+    option = orjson.OPT_NON_STR_KEYS
+    if indent:
+        option |= orjson.OPT_INDENT_2
+    return orjson.dumps(obj, default=default, option=option)
+
+
+def _rapidjson(obj, indent):
+    if indent:
+        return rapidjson.dumps(obj, default=default, indent=indent)
+    return rapidjson.dumps(obj, default=default)
+
+
+def _simplejson(obj, indent):
+    if indent:
+        return simplejson.dumps(obj, default=default, indent=indent)
+    return simplejson.dumps(obj, default=default, separators=(',', ':'))
+
+
+def _stdlib(obj, indent):
+    if indent:
+        return json.dumps(obj, default=default, indent=indent)
+    return json.dumps(obj, default=default, separators=(',', ':'))
+
+BACKENDS = [('orjson', orjson, _orjson),
+            ('rapidjson', rapidjson, _rapidjson),
+            ('simplejson', simplejson, _simplejson),
+            ('json', json, _stdlib)]
+
+
+def available():
+    """Names of the installed backends, fastest first."""
+    return [name for (name, module, _) in BACKENDS if module is not None]
+
+
+def backend(name=None):
+    """The encoding function of the backend (the fastest one, if None)."""
+    for (backend_name, module, func) in BACKENDS:
+        if module is None:
+            continue
+        if name is None or name == backend_name:
+            return func
+    raise ValueError('JSON backend {name} is not installed'.format(
+        name=name))
+
+
+# ----------------------------------------------------------------------
+#  Encoding
+# ----------------------------------------------------------------------
+
+def dumps(obj, indent=None):
+    """Encode the object with the backend of the current app."""
+    return backend(current_app.config['JSON_BACKEND'])(obj, indent)
+
+
+def wants_msgpack():
+    """Check if the client of the current request prefers MessagePack."""
+    if msgpack is None or not has_request_context():
+        return False
+    best = request.accept_mimetypes.best_match([JSON, MSGPACK], default=JSON)
+    return best == MSGPACK
+
+
+def packb(obj):
+    """Encode the object in MessagePack."""
+    # in Python 2, `str` is (mostly) text, so it can't go as binary
+    return msgpack.packb(obj, default=default,
+                         use_bin_type=bytes is not str)
+
+
+def unpackb(data):
+    """Decode MessagePack data."""
+    try:
+        return msgpack.unpackb(data, raw=False)
+    except TypeError:
+        # msgpack before 0.5.2 only knows about `encoding`
+        return msgpack.unpackb(data, encoding='utf-8')
+
+
+def read_body():
+    """The body of the current request, decoded from JSON or, if that is
+    its content type, MessagePack; None if it can't be decoded."""
+    if msgpack is not None and request.mimetype == MSGPACK:
+        try:
+            body = unpackb(request.get_data())
+        except Exception:
+            LOG.debug('Invalid MessagePack body')
+            return None
+        if not isinstance(body, dict):
+            return None
+        return body
+    return request.get_json(force=True, silent=True)
+
+
+def jsonify(*args, **kwargs):
+    """Like `flask.jsonify`, compact unless JSONIFY_PRETTYPRINT_REGULAR is
+    on (and the request isn't an XMLHttpRequest), or in MessagePack, if
+    that is what the client prefers."""
+    obj = dict(*args, **kwargs)
+    if wants_msgpack():
+        response = current_app.response_class(packb(obj), mimetype=MSGPACK)
+    else:
+        indent = None
+        if current_app.config['JSONIFY_PRETTYPRINT_REGULAR'] \
+                and not request.is_xhr:
+            indent = 2
+        response = current_app.response_class(dumps(obj, indent),
+                                              mimetype=JSON)
+    if msgpack is not None:
+        response.vary.add('Accept')
+    return response
@@ -3,52 +3,112 @@
 
 import logging
 import json
+import math
 import hmac
 import datetime
+import importlib
+import threading
 
 from flask import Flask
-from flask import jsonify
+from flask import current_app
+from flask import has_app_context
+from flask import _app_ctx_stack
 
-from flask.json import JSONEncoder
+from sqlalchemy.orm import configure_mappers
 
-from luncho.exceptions import LunchoException
+from werkzeug.local import LocalProxy
 
+from luncho import geo
+from luncho import serializer
+from luncho import metrics
+from luncho import tracing
+from luncho import profiler
+from luncho import memory
+from luncho import compression
+from luncho import cache
+from luncho import slowqueries     # (logs slow queries of every engine)
 
-# ----------------------------------------------------------------------
-#  JSON encoding with date support
-# ----------------------------------------------------------------------
-class DateEncoder(JSONEncoder):
-    def default(self, obj):
-        if hasattr(obj, 'isoformat'):
-            return obj.isoformat()
-        else:
-            return str(obj)
-        return json.JSONEncoder.default(self, obj)
+from luncho.exceptions import LunchoException
 
 
 # ----------------------------------------------------------------------
 #  Config
 # ----------------------------------------------------------------------
 class Settings(object):
-    SQLALCHEMY_DATABASE_URI = 'sqlite://./luncho.db3'
+    SQLALCHEMY_DATABASE_URI = 'sqlite:///luncho.db3'
     DEBUG = True
     PLACES_IN_VOTE = 3  # number of places the user can vote
+    PAGE_SIZE = 100     # elements in a page, when the client doesn't say
+    MAX_PAGE_SIZE = 1000    # largest page a client can request
+    STREAM_BATCH_SIZE = 500     # rows fetched at once when streaming lists
+    MAX_NAME_LENGTH = 200   # longest name of a user, group or place
+    MAX_ADDED = 100     # usernames or places added to a group at once
+    SEARCH_RESULTS = 10     # places returned by a search, by default
+    SEARCH_COUNT_LIMIT = 5000   # stop counting places with a trigram here
+    DUPLICATE_PLACE_THRESHOLD = 0.7     # names this similar are duplicates
+    DUPLICATE_PLACE_SUGGESTIONS = 5     # existing places suggested, at most
+    NEAR_RADIUS = 1000      # meters around the user, by default, for places
+    MAX_NEAR_RADIUS = 50000     # largest radius for "near" searches
+    MAX_OFFICE_RADIUS = 50000   # largest radius around a group office
+    PURGE_ASYNC_THRESHOLD = 1000    # votes that send a delete to background
+    PURGE_BATCH_SIZE = 500      # votes deleted at once in background
+    SLOW_QUERY_THRESHOLD = 0.5  # seconds; slower queries are logged
+    TRACE_SAMPLE_RATE = 0.0     # fraction of the requests traced
+    TRACE_FILE = 'luncho-traces.json'   # where the traced spans go
+    TRACE_FILE_SIZE = 10 * 1024 * 1024  # rotate the trace file at this size
+    TRACE_FILE_COUNT = 5        # old trace files kept
+    PROFILE = False     # allow profiling requests
+    PROFILE_HEADER = 'X-Luncho-Profile'     # requests with it are profiled
+    PROFILE_SAMPLE_RATE = 0.0   # fraction of the other requests profiled
+    PROFILE_DIR = 'profiles'    # where the collapsed stacks go
+    ADMINS = []         # usernames allowed in the admin endpoints
+    MEMORY_TOP = 20     # types and allocation sites in a memory report
+    MEMORY_TRACE_FRAMES = 0     # frames kept by tracemalloc; 0 disables it
+    MEMORY_SIGNAL = None    # signal that logs a memory report, e.g. 'SIGUSR2'
+    LONG_POLL_TIMEOUT = 25      # seconds a client can wait for new votes
+    ASYNC_CONNECTIONS = 20000   # open connections in the gevent server
+    JSON_BACKEND = None     # JSON library; None picks the fastest installed
+    JSONIFY_PRETTYPRINT_REGULAR = False     # indent the JSON responses
+    COMPRESS_MIN_SIZE = 500     # smaller responses aren't compressed
+    COMPRESS_LEVEL = 6          # gzip level, 1 (fastest) to 9 (smallest)
+    COMPRESS_BROTLI_QUALITY = 5     # brotli quality, 0 to 11
+    COMPRESS_CACHE_SIZE = 512   # compressed shared responses kept
+    SINGLE_FLIGHT_DIR = None    # lock files to coalesce across processes
+    SINGLE_FLIGHT_TTL = 10      # seconds a result can be read by others
+    CACHE_BACKEND = None    # 'local', 'file', 'redis' or None (no cache)
+    CACHE_TTL = 300         # seconds an entry lives
+    CACHE_SIZE = 10000      # entries in the 'local' and 'file' caches
+    CACHE_FILE = 'cache/luncho'     # dbm file of the 'file' cache
+    CACHE_REDIS_URL = 'redis://localhost:6379/0'    # or 'memory://'
+    CACHE_PREFIX = 'luncho:'    # of the keys in Redis
 
 log = logging.getLogger('luncho.server')
 
-# ----------------------------------------------------------------------
-#  Load the config
-# ----------------------------------------------------------------------
-app = Flask(__name__)
-app.config.from_object(Settings)
-app.config.from_envvar('LUNCHO_CONFIG', True)
-app.json_encoder = DateEncoder
-
 # ----------------------------------------------------------------------
 #  Database
 # ----------------------------------------------------------------------
 from flask.ext.sqlalchemy import SQLAlchemy
-db = SQLAlchemy(app)
+
+
+class LunchoSQLAlchemy(SQLAlchemy):
+    """Flask-SQLAlchemy that works with any number of apps: the app of the
+    current context is used and, outside any context, the default app.
+    Each app gets its own session in each thread."""
+    def __init__(self):
+        super(LunchoSQLAlchemy, self).__init__(
+            session_options={'scopefunc': self._session_scope})
+
+    def _session_scope(self):
+        return (_app_ctx_stack.__ident_func__(), id(self.get_app()))
+
+    def get_app(self, reference_app=None):
+        if reference_app is not None:
+            return reference_app
+        if has_app_context():
+            return current_app._get_current_object()
+        return default_app()
+
+db = LunchoSQLAlchemy()
 
 user_groups = db.Table('user_groups',
                        db.Column('username',
@@ -68,13 +128,30 @@ group_places = db.Table('group_places',
                                   db.ForeignKey('place.id')))
 
 
+place_trigrams = db.Table('place_trigrams',
+                          db.Column('trigram',
+                                    db.String,
+                                    nullable=False),
+                          db.Column('place',
+                                    db.Integer,
+                                    db.ForeignKey('place.id'),
+                                    nullable=False),
+                          db.Index('ix_place_trigrams_trigram',
+                                   'trigram',
+                                   'place'),
+                          db.Index('ix_place_trigrams_place',
+                                   'place',
+                                   'trigram'))
+
+
 class User(db.Model):
     username = db.Column(db.String, primary_key=True)
     fullname = db.Column(db.String, nullable=False)
     passhash = db.Column(db.String, nullable=False)
-    token = db.Column(db.String)
+    token = db.Column(db.String, index=True)
     issued_date = db.Column(db.Date)
     validated = db.Column(db.Boolean, default=False)
+    verified = db.synonym('validated')
     created_at = db.Column(db.DateTime, nullable=False)
     groups = db.relationship('Group',
                              secondary=user_groups,
@@ -116,6 +193,9 @@ class Group(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String, nullable=False)
     owner = db.Column(db.String, db.ForeignKey('user.username'))
+    latitude = db.Column(db.Float)      # office location
+    longitude = db.Column(db.Float)
+    radius = db.Column(db.Integer)      # max distance, in meters, of places
     places = db.relationship('Place',
                              secondary=group_places,
                              backref=db.backref('groups', lazy='select'))
@@ -124,6 +204,35 @@ class Group(db.Model):
         self.name = name
         self.owner = owner.username
 
+    def set_office(self, latitude, longitude, radius):
+        """Set (or, with Nones, remove) the office location, used to filter
+        the places in the ballot. The radius is stored in whole meters,
+        rounded up."""
+        self.latitude = latitude
+        self.longitude = longitude
+        if radius is not None:
+            radius = int(math.ceil(radius))
+        self.radius = radius
+        return
+
+    def ballot(self):
+        """Return the places the members can vote for: all the group places
+        or, if the group has an office location, the places within the
+        radius of the office. Places without a location are always in the
+        ballot."""
+        if self.radius is None:
+            return list(self.places)
+
+        ballot = []
+        for place in self.places:
+            if place.latitude is not None:
+                away = geo.distance(self.latitude, self.longitude,
+                                    place.latitude, place.longitude)
+                if away > self.radius:
+                    continue
+            ballot.append(place)
+        return ballot
+
     def __repr__(self):
         return 'Group {id}-{name}-{owner}'.format(id=self.id,
                                                   name=self.name,
@@ -133,12 +242,24 @@ class Group(db.Model):
 class Place(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String, nullable=False)
-    owner = db.Column(db.String, db.ForeignKey('user.username'))
+    owner = db.Column(db.String, db.ForeignKey('user.username'), index=True)
+    latitude = db.Column(db.Float)
+    longitude = db.Column(db.Float)
+    geohash = db.Column(db.String, index=True)
 
     def __init__(self, name, owner=None):
         self.name = name
         self.owner = owner.username
 
+    def set_location(self, latitude, longitude):
+        """Set (or, with Nones, remove) the place location."""
+        self.latitude = latitude
+        self.longitude = longitude
+        self.geohash = None
+        if latitude is not None:
+            self.geohash = geo.encode(latitude, longitude)
+        return
+
     def __repr__(self):
         return 'Place {id}-{name}-{owner}'.format(id=self.id,
                                                   name=self.name,
@@ -146,6 +267,13 @@ class Place(db.Model):
 
 
 class Vote(db.Model):
+    __table_args__ = (db.Index('ix_vote_group_created_at',
+                               'group',
+                               'created_at'),
+                      db.Index('ix_vote_user_created_at',
+                               'user',
+                               'created_at'))
+
     cast = db.Column(db.Integer, primary_key=True)
     user = db.Column(db.String, db.ForeignKey('user.username'))
     created_at = db.Column(db.Date, nullable=False)
@@ -182,35 +310,53 @@ class CastedVote(db.Model):
                                                     place=self.place)
 
 
+class Version(db.Model):
+    """Counter bumped every time the data behind a key changes (see
+    :py:mod:`luncho.versions`)."""
+    key = db.Column(db.String, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+    def __init__(self, key, version=0):
+        self.key = key
+        self.version = version
+        return
+
+    def __repr__(self):
+        return 'Version {key}-{version}'.format(key=self.key,
+                                                version=self.version)
+
+
 # ----------------------------------------------------------------------
 #  Blueprints
 # ----------------------------------------------------------------------
-from blueprints.users import users
-from blueprints.token import token
-from blueprints.groups import groups
-from blueprints.groups import group_users
-from blueprints.groups import group_places
-from blueprints.places import places
-from blueprints.voting import voting
-
-app.register_blueprint(token, url_prefix='/token/')
-app.register_blueprint(users, url_prefix='/user/')
-app.register_blueprint(groups, url_prefix='/group/')
-app.register_blueprint(group_users, url_prefix='/group/')
-app.register_blueprint(group_places, url_prefix='/group/')
-app.register_blueprint(places, url_prefix='/place/')
-app.register_blueprint(voting, url_prefix='/vote/')
+# (module, blueprint, prefix); imported only when an app is created
+BLUEPRINTS = [
+    ('luncho.blueprints.token', 'token', '/token/'),
+    ('luncho.blueprints.users', 'users', '/user/'),
+    ('luncho.blueprints.groups', 'groups', '/group/'),
+    ('luncho.blueprints.groups', 'group_users', '/group/'),
+    ('luncho.blueprints.groups', 'group_places', '/group/'),
+    ('luncho.blueprints.places', 'places', '/place/'),
+    ('luncho.blueprints.voting', 'voting', '/vote/'),
+    ('luncho.blueprints.admin', 'admin', '/admin/'),
+]
+
+
+def _register_blueprints(app):
+    for (module, name, prefix) in BLUEPRINTS:
+        blueprint = getattr(importlib.import_module(module), name)
+        app.register_blueprint(blueprint, url_prefix=prefix)
+    return
 
 
 # ----------------------------------------------------------------------
 #  The index is a special case
 # ----------------------------------------------------------------------
-@app.route('/', methods=['GET'])
 def show_api():
     """Return the list of APIs."""
     routes = []
 
-    for rule in app.url_map.iter_rules():
+    for rule in current_app.url_map.iter_rules():
         endpoint = rule.endpoint
         if endpoint == 'static':
             # the server does not have a static path, but  Flask automatically
@@ -218,7 +364,7 @@ def show_api():
             continue
 
         path = str(rule)
-        doc = app.view_functions[endpoint].__doc__
+        doc = current_app.view_functions[endpoint].__doc__
 
         # make the doc a little more... pretty
         summary = doc.split('\n\n')[0]
@@ -235,14 +381,81 @@ def show_api():
             ])
 
     routes.sort(key=lambda url: url[0].split()[1])
-    return jsonify(status='OK',
-                   api=routes)
+    return serializer.jsonify(status='OK',
+                              api=routes)
 
 
 # ----------------------------------------------------------------------
 #  Error management
 # ----------------------------------------------------------------------
-@app.errorhandler(LunchoException)
 def handle_luncho_exception(error):
     """Normal luncho error."""
+    metrics.count_error(error)
     return error.response()
+
+
+# ----------------------------------------------------------------------
+#  The app
+# ----------------------------------------------------------------------
+def create_app(config=None):
+    """Create a Lunch-o app.
+
+    :param config: settings that replace the defaults and the ones in the
+        file pointed by LUNCHO_CONFIG
+    :type config: dict"""
+    app = Flask(__name__)
+    app.config.from_object(Settings)
+    app.config.from_envvar('LUNCHO_CONFIG', True)
+    if config:
+        app.config.update(config)
+    app.json_encoder = serializer.JSONEncoder
+
+    db.init_app(app)
+    _register_blueprints(app)
+    app.add_url_rule('/', 'show_api', show_api, methods=['GET'])
+    app.register_error_handler(LunchoException, handle_luncho_exception)
+
+    metrics.init_app(app)
+    tracing.init_app(app)
+    profiler.init_app(app)
+    memory.init_app(app)
+    compression.init_app(app)
+    cache.init_app(app)
+
+    # all the models are imported by now, so there is no reason to leave
+    # this to the first query
+    configure_mappers()
+    return app
+
+
+def warm_up(app):
+    """Do what would otherwise be done in the first request: open a
+    database connection and run a request through the whole stack."""
+    with app.app_context():
+        try:
+            db.session.execute('SELECT 1')
+        except Exception:
+            log.exception('Could not connect to the database')
+        finally:
+            db.session.remove()
+
+    client = app.test_client()
+    client.get('/')
+    return
+
+
+_default = []
+_default_lock = threading.Lock()
+
+
+def default_app():
+    """The default app, created the first time it is needed."""
+    if not _default:
+        with _default_lock:
+            if not _default:
+                _default.append(create_app())
+    return _default[0]
+
+# the default app, for the tests, manage.py and everything else that
+# doesn't create its own
+app = LocalProxy(default_app)
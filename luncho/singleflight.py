@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+"""Single-flight: concurrent identical computations share one.
+
+The first request to compute something with a key (the leader) does the
+work; requests asking for the same key while the leader is at it wait and
+get the leader's result (or exception). Nothing is kept after the
+computation ends, so the key must identify everything the result depends
+on -- e.g., the group, the day and the version counters (see
+:py:mod:`luncho.versions`).
+
+With SINGLE_FLIGHT_DIR, the leaders of each process also coordinate among
+themselves, with a lock file per key in that directory: the first process
+to get the lock computes the result and writes it (in JSON) beside the
+lock; the others, once they get the lock, read it. Results older than
+SINGLE_FLIGHT_TTL seconds are ignored and, from time to time, removed with
+their lock files. (Removing the lock file of a key that is being computed
+only means it may be computed twice.)"""
+
+import hashlib
+import json
+import logging
+import os
+import random
+import threading
+import time
+
+from flask import current_app
+
+try:
+    import fcntl
+except ImportError:     # not on Windows
+    fcntl = None
+
+from luncho import metrics
+from luncho import serializer
+
+LOG = logging.getLogger('luncho.singleflight')
+
+CLEANUP_CHANCE = 0.01       # of sweeping the directory after a write
+
+
+class _Call(object):
+    """A computation in progress."""
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """The computations in progress in this process."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+
+    def do(self, name, key, func):
+        """Return the result of `func()`, unless another thread is already
+        computing `key`; in that case, wait for it and return its result.
+        `name` is the kind of computation (for the metrics)."""
+        with self.lock:
+            call = self.calls.get((name, key))
+            leader = call is None
+            if leader:
+                call = self.calls[(name, key)] = _Call()
+
+        if not leader:
+            call.event.wait()
+            metrics.SINGLE_FLIGHT.inc((name, 'thread'))
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = _lead(name, key, func)
+        except Exception as error:
+            call.error = error
+            raise
+        finally:
+            with self.lock:
+                del self.calls[(name, key)]
+            call.event.set()
+        return call.result
+
+    def in_flight(self):
+        """Number of computations in progress."""
+        with self.lock:
+            return len(self.calls)
+
+
+flights = SingleFlight()
+
+
+# ----------------------------------------------------------------------
+#  Across processes
+# ----------------------------------------------------------------------
+
+def _lead(name, key, func):
+    directory = current_app.config['SINGLE_FLIGHT_DIR']
+    if directory is None or fcntl is None:
+        metrics.SINGLE_FLIGHT.inc((name, 'computed'))
+        return func()
+
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    path = os.path.join(directory, hashlib.sha1(
+        repr((name, key))).hexdigest())
+    ttl = current_app.config['SINGLE_FLIGHT_TTL']
+
+    with open(path + '.lock', 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            found = _read(path + '.json', ttl)
+            if found is not None:
+                metrics.SINGLE_FLIGHT.inc((name, 'process'))
+                return found[0]
+
+            metrics.SINGLE_FLIGHT.inc((name, 'computed'))
+            result = func()
+            _write(path + '.json', result)
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+    if random.random() < CLEANUP_CHANCE:
+        cleanup(directory, ttl)
+    return result
+
+
+def _read(path, ttl):
+    """The (result,) in the file, if it is recent; None if it isn't."""
+    try:
+        if time.time() - os.path.getmtime(path) > ttl:
+            return None
+        with open(path) as content:
+            return (json.load(content),)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def _write(path, result):
+    # written beside and renamed, so nobody reads half a result
+    partial = path + '.{pid}'.format(pid=os.getpid())
+    with open(partial, 'w') as content:
+        content.write(serializer.dumps(result))
+    os.rename(partial, path)
+    return
+
+
+def cleanup(directory, ttl):
+    """Remove the results (and locks) older than `ttl` seconds."""
+    limit = time.time() - ttl
+    for filename in os.listdir(directory):
+        path = os.path.join(directory, filename)
+        try:
+            if os.path.getmtime(path) < limit:
+                os.remove(path)
+        except OSError:
+            pass    # removed by another process
+    LOG.debug('Cleaned up {directory}'.format(directory=directory))
+    return
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+"""Slow query log.
+
+SQL statements that take more than SLOW_QUERY_THRESHOLD seconds are logged,
+with their parameters and the endpoint that ran them. The first time a
+statement (ignoring the number of items in IN lists) is slow, its query
+plan is logged too: `EXPLAIN QUERY PLAN` on SQLite, `EXPLAIN` on
+PostgreSQL. The plan comes from the connection of the statement, in its
+transaction; on PostgreSQL, a failed statement aborts the transaction, so
+EXPLAIN runs in a savepoint there and a failure is only logged."""
+
+import logging
+import re
+import threading
+import time
+
+from flask import current_app
+from flask import request
+from flask import has_app_context
+from flask import has_request_context
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+LOG = logging.getLogger('luncho.slowqueries')
+
+EXPLAIN = {'sqlite': 'EXPLAIN QUERY PLAN ',
+           'postgresql': 'EXPLAIN '}
+
+EXPLAINABLE = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH')
+
+# databases where EXPLAIN runs in a savepoint (pysqlite can't release
+# savepoints, and a failure doesn't abort the transaction on SQLite anyway)
+SAVEPOINT = frozenset(['postgresql'])
+
+MAX_SHAPES = 1000       # statement shapes remembered as already explained
+
+_placeholder = r'(\?|%s|%\(\w+\)s)'     # qmark, format and pyformat
+_placeholders = re.compile(r'\(\s*{p}(\s*,\s*{p})*\s*\)'.format(
+    p=_placeholder))
+_spaces = re.compile(r'\s+')
+
+_explained = set()
+_explained_lock = threading.Lock()
+
+
+def shape(statement):
+    """The statement, ignoring spacing and the size of IN lists."""
+    statement = _placeholders.sub('(?)', statement)
+    return _spaces.sub(' ', statement).strip()
+
+
+def _first_time(statement):
+    """Check if the shape of the statement wasn't explained before."""
+    key = shape(statement)
+    with _explained_lock:
+        if key in _explained or len(_explained) >= MAX_SHAPES:
+            return False
+        _explained.add(key)
+    return True
+
+
+def explain(conn, statement, parameters):
+    """Return the query plan for the statement, as a list of lines, or None
+    if the database has no way to explain it."""
+    prefix = EXPLAIN.get(conn.dialect.name)
+    if not prefix or not statement.lstrip().upper().startswith(EXPLAINABLE):
+        return None
+
+    # the DBAPI cursor doesn't go through the events, so explaining doesn't
+    # trigger another log
+    savepoint = conn.dialect.name in SAVEPOINT
+    cursor = conn.connection.cursor()
+    try:
+        if savepoint:
+            cursor.execute('SAVEPOINT luncho_explain')
+        try:
+            cursor.execute(prefix + statement, parameters)
+            plan = [' | '.join(str(column) for column in row)
+                    for row in cursor.fetchall()]
+        except Exception:
+            if savepoint:
+                cursor.execute('ROLLBACK TO SAVEPOINT luncho_explain')
+            raise
+        if savepoint:
+            cursor.execute('RELEASE SAVEPOINT luncho_explain')
+        return plan
+    finally:
+        cursor.close()
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    if context is not None:
+        context.luncho_slow_start = time.time()
+    return
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    start = getattr(context, 'luncho_slow_start', None)
+    if start is None or not has_app_context():
+        return
+
+    threshold = current_app.config['SLOW_QUERY_THRESHOLD']
+    elapsed = time.time() - start
+    if threshold is None or elapsed < threshold:
+        return
+
+    endpoint = None
+    if has_request_context():
+        endpoint = request.endpoint
+    LOG.warning('Slow query ({elapsed:.3f}s, {endpoint}): {statement} '
+                '{parameters}'.format(elapsed=elapsed,
+                                      endpoint=endpoint or 'no request',
+                                      statement=statement,
+                                      parameters=parameters))
+
+    if executemany or not _first_time(statement):
+        return
+
+    try:
+        plan = explain(conn, statement, parameters)
+    except Exception:
+        LOG.exception('Could not explain {statement}'.format(
+            statement=statement))
+        return
+
+    if plan is not None:
+        LOG.warning('Plan for {statement}:\n\t{plan}'.format(
+            statement=shape(statement),
+            plan='\n\t'.join(plan)))
+    return
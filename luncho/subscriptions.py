@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+"""Clients waiting for new votes.
+
+Long-polling clients subscribe to a group and wait; casting a vote wakes
+every client waiting on that group. Subscribers of a group share a single
+event, so an idle subscriber costs very little -- and, in the gevent
+server (:py:mod:`luncho.asyncserve`), waiting takes a greenlet instead of
+a thread.
+
+The subscriptions are per process: clients waiting in a process only
+learn about votes cast in other processes when their wait times out."""
+
+import threading
+
+
+class _Waiters(object):
+    """The event and the number of subscribers of a group."""
+    def __init__(self):
+        self.event = threading.Event()
+        self.count = 0
+
+
+class Subscriptions(object):
+    """Subscribers of each group."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.groups = {}
+
+    def subscribe(self, group_id):
+        """Start listening for votes in the group; this must be done
+        *before* checking for votes, so none is missed. Return the value to
+        be passed to :py:meth:`wait` and :py:meth:`unsubscribe`, which must
+        always be called (in a `finally`) once done."""
+        with self.lock:
+            waiters = self.groups.get(group_id)
+            if waiters is None:
+                waiters = self.groups[group_id] = _Waiters()
+            waiters.count += 1
+        return waiters
+
+    def wait(self, group_id, waiters, timeout):
+        """Wait for a vote in the group, for at most `timeout` seconds.
+        Return True if there was a vote."""
+        return bool(waiters.event.wait(timeout))
+
+    def unsubscribe(self, group_id, waiters):
+        """Stop listening."""
+        with self.lock:
+            waiters.count -= 1
+            if waiters.count == 0 and self.groups.get(group_id) is waiters:
+                del self.groups[group_id]
+        return
+
+    def notify(self, group_id):
+        """Wake the subscribers of the group."""
+        with self.lock:
+            waiters = self.groups.pop(group_id, None)
+        if waiters is not None:
+            waiters.event.set()
+        return
+
+    def subscribers(self):
+        """Number of clients waiting, in all groups."""
+        with self.lock:
+            return sum(waiters.count for waiters in self.groups.values())
+
+
+subscriptions = Subscriptions()
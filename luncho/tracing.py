@@ -0,0 +1,293 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+"""Request tracing.
+
+A sample of the requests (TRACE_SAMPLE_RATE, or whatever the caller decided
+in the W3C `traceparent` header) is traced: the request, the auth, JSON
+parsing, each SQL query, commits and anything inside a :py:func:`span`
+get their own spans. Once the request finishes, its spans are written as a
+single line in TRACE_FILE, in the OpenTelemetry (OTLP) JSON format, and the
+file is rotated when it reaches TRACE_FILE_SIZE bytes.
+
+Requests that are not sampled only pay for a couple of attribute
+lookups."""
+
+import json
+import logging
+import logging.handlers
+import os
+import random
+import re
+import threading
+import time
+
+from contextlib import contextmanager
+
+from flask import current_app
+from flask import g
+from flask import request
+from flask import has_request_context
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+LOG = logging.getLogger('luncho.tracing')
+
+TRACEPARENT = re.compile(r'^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$')
+
+SPAN_INTERNAL = 1   # span kinds, as defined by OpenTelemetry
+SPAN_SERVER = 2
+SPAN_CLIENT = 3
+
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+
+# ----------------------------------------------------------------------
+#  Spans
+# ----------------------------------------------------------------------
+
+class Trace(object):
+    """The spans of a request."""
+    def __init__(self, trace_id, parent_id=None):
+        self.trace_id = trace_id
+        self.parent_id = parent_id
+        self.spans = []
+        self.open = []      # spans still running, innermost last
+
+
+def _random_id(size):
+    """Random identifier with `size` bytes, in hex."""
+    return '%0*x' % (size * 2, random.getrandbits(size * 8))
+
+
+def _now():
+    return int(time.time() * 1e9)
+
+
+def _current_trace():
+    """The trace of the current request, if it is being traced."""
+    if not has_request_context():
+        return None
+    return getattr(g, 'trace', None)
+
+
+def start_span(name, kind=SPAN_INTERNAL, **attributes):
+    """Start a span in the current trace; returns None if the request isn't
+    being traced."""
+    trace = _current_trace()
+    if trace is None:
+        return None
+
+    if trace.open:
+        parent = trace.open[-1]['spanId']
+    else:
+        parent = trace.parent_id
+
+    span = {'traceId': trace.trace_id,
+            'spanId': _random_id(8),
+            'name': name,
+            'kind': kind,
+            'startTimeUnixNano': _now(),
+            'attributes': attributes}
+    if parent:
+        span['parentSpanId'] = parent
+    trace.open.append(span)
+    trace.spans.append(span)
+    return span
+
+
+def end_span(span, error=None):
+    """Finish the span (which may be None, for requests not traced)."""
+    if span is None:
+        return
+
+    span['endTimeUnixNano'] = _now()
+    if error:
+        span['status'] = {'code': STATUS_ERROR, 'message': str(error)}
+    else:
+        span['status'] = {'code': STATUS_OK}
+
+    trace = _current_trace()
+    if trace is not None and span in trace.open:
+        trace.open.remove(span)
+    return
+
+
+@contextmanager
+def span(name, **attributes):
+    """Trace the code inside the `with` block."""
+    current = start_span(name, **attributes)
+    try:
+        yield current
+    except Exception as exc:
+        end_span(current, exc)
+        raise
+    end_span(current)
+    return
+
+
+# ----------------------------------------------------------------------
+#  Output
+# ----------------------------------------------------------------------
+
+_writers = {}
+_writers_lock = threading.Lock()
+
+
+def _writer(app):
+    """Logger that writes to the trace file of the app."""
+    path = os.path.abspath(app.config['TRACE_FILE'])
+    with _writers_lock:
+        writer = _writers.get(path)
+        if writer is None:
+            handler = logging.handlers.RotatingFileHandler(
+                path,
+                maxBytes=app.config['TRACE_FILE_SIZE'],
+                backupCount=app.config['TRACE_FILE_COUNT'],
+                delay=True)
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            writer = logging.getLogger('luncho.tracing.' + path)
+            writer.propagate = False
+            writer.setLevel(logging.INFO)
+            writer.addHandler(handler)
+            _writers[path] = writer
+    return writer
+
+
+def _attribute(key, value):
+    """Encode an attribute as OTLP JSON."""
+    if isinstance(value, bool):
+        encoded = {'boolValue': value}
+    elif isinstance(value, (int, long)):
+        encoded = {'intValue': str(value)}
+    elif isinstance(value, float):
+        encoded = {'doubleValue': value}
+    else:
+        encoded = {'stringValue': unicode(value)}
+    return {'key': key, 'value': encoded}
+
+
+def _export(trace):
+    """Encode the spans of the trace as an OTLP JSON request."""
+    spans = []
+    for span in trace.spans:
+        span = dict(span)
+        span['startTimeUnixNano'] = str(span['startTimeUnixNano'])
+        span['endTimeUnixNano'] = str(span.get('endTimeUnixNano',
+                                               _now()))
+        span['attributes'] = [_attribute(key, value) for (key, value)
+                              in sorted(span['attributes'].items())]
+        spans.append(span)
+
+    service = [_attribute('service.name', 'luncho')]
+    return {'resourceSpans': [{
+        'resource': {'attributes': service},
+        'scopeSpans': [{'scope': {'name': 'luncho'},
+                        'spans': spans}]}]}
+
+
+# ----------------------------------------------------------------------
+#  Requests
+# ----------------------------------------------------------------------
+
+def _start_trace():
+    parent = TRACEPARENT.match(request.headers.get('traceparent', ''))
+    if parent:
+        (trace_id, parent_id, flags) = parent.groups()
+        sampled = int(flags, 16) & 1
+    else:
+        (trace_id, parent_id) = (_random_id(16), None)
+        rate = current_app.config['TRACE_SAMPLE_RATE']
+        sampled = rate > 0 and random.random() < rate
+
+    if not sampled:
+        return
+
+    g.trace = Trace(trace_id, parent_id)
+    attributes = {'http.method': request.method,
+                  'http.target': request.path}
+    if request.url_rule:
+        attributes['http.route'] = request.url_rule.rule
+    g.trace_root = start_span(request.endpoint or 'unknown',
+                              kind=SPAN_SERVER,
+                              **attributes)
+    return
+
+
+def _tag_response(response):
+    trace = _current_trace()
+    if trace is None:
+        return response
+
+    g.trace_root['attributes']['http.status_code'] = response.status_code
+    response.headers['traceparent'] = '00-{trace}-{span}-01'.format(
+        trace=trace.trace_id,
+        span=g.trace_root['spanId'])
+    return response
+
+
+def _finish_trace(error=None):
+    trace = _current_trace()
+    if trace is None:
+        return
+
+    end_span(g.trace_root, error)
+    g.trace = None
+    try:
+        _writer(current_app).info(json.dumps(_export(trace)))
+    except Exception:
+        LOG.exception('Could not write the trace')
+    return
+
+
+# ----------------------------------------------------------------------
+#  Database
+# ----------------------------------------------------------------------
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    if context is None or _current_trace() is None:
+        return
+    context.luncho_span = start_span('db.query',
+                                     kind=SPAN_CLIENT,
+                                     **{'db.statement': statement})
+    return
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    end_span(getattr(context, 'luncho_span', None))
+    return
+
+
+@event.listens_for(Session, 'before_commit')
+def _before_commit(session):
+    if _current_trace() is None:
+        return
+    session.info['luncho_commit_span'] = start_span('db.commit')
+    return
+
+
+@event.listens_for(Session, 'after_commit')
+def _after_commit(session):
+    end_span(session.info.pop('luncho_commit_span', None))
+    return
+
+
+@event.listens_for(Session, 'after_rollback')
+def _after_rollback(session):
+    end_span(session.info.pop('luncho_commit_span', None), 'rollback')
+    return
+
+
+def init_app(app):
+    """Trace the requests of the app."""
+    app.before_request(_start_trace)
+    app.after_request(_tag_response)
+    app.teardown_request(_finish_trace)
+    return
@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+"""Version counters, for conditional requests.
+
+Everything a read endpoint returns depends on a few keys:
+
+* `group:<id>`: the group (name, administrator, office), its members and
+  its places, including their names;
+* `tally:<id>`: the votes cast in the group;
+* `user:<username>`: the groups the user belongs to and the places the
+  user maintains.
+
+The handlers that change any of those bump the counters of the keys in the
+same transaction as the change. The ETag of a response is the hash of the
+counters it depends on (plus the URL and the representation), so it can be
+checked -- and a `304 Not Modified` returned -- without running the
+queries of the view.
+
+The counters are created (at 0) with the groups and users, so bumping them
+is a single UPDATE; keys without a counter (data loaded in bulk, or from
+before the counters) get one on their first bump."""
+
+import datetime
+import hashlib
+
+from flask import request
+
+from sqlalchemy import String
+from sqlalchemy import cast
+from sqlalchemy import literal
+from sqlalchemy import or_
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
+
+from luncho import serializer
+
+from luncho.server import db
+from luncho.server import User
+from luncho.server import Group
+from luncho.server import Version
+from luncho.server import Vote
+from luncho.server import CastedVote
+from luncho.server import user_groups
+from luncho.server import group_places
+
+versions = Version.__table__
+
+
+# ----------------------------------------------------------------------
+#  Keys
+# ----------------------------------------------------------------------
+
+def group(group_id):
+    return 'group:{0}'.format(group_id)
+
+
+def tally(group_id):
+    return 'tally:{0}'.format(group_id)
+
+
+def user(username):
+    return 'user:{0}'.format(username)
+
+
+def showing_place(place_id):
+    """Keys of the groups that show the place: the ones that have it and
+    the ones that have votes for it today."""
+    listed = db.session.query(group_places.c.group).filter(
+        group_places.c.place == place_id)
+    voted = (db.session.query(Vote.group)
+             .join(CastedVote, CastedVote.vote == Vote.cast)
+             .filter(CastedVote.place == place_id)
+             .filter(Vote.created_at == datetime.date.today()))
+    return [group(group_id) for (group_id,) in listed.union(voted)]
+
+
+# ----------------------------------------------------------------------
+#  Counters
+# ----------------------------------------------------------------------
+
+def bump(keys):
+    """Increment the counters of the keys (in the current transaction)."""
+    keys = set(keys)
+    if not keys:
+        return
+
+    result = db.session.execute(versions.update()
+                                .where(versions.c.key.in_(keys))
+                                .values(version=versions.c.version + 1))
+    if result.rowcount == len(keys):
+        return
+
+    # first change of some of the keys
+    existing = set(key for (key,) in db.session.execute(
+        versions.select().with_only_columns([versions.c.key])
+        .where(versions.c.key.in_(keys))))
+    for key in keys - existing:
+        _create(key)
+    return
+
+
+def _create(key):
+    """Insert the counter of the key at 1 or, if another transaction
+    inserted it in the meantime, bump it."""
+    insert = versions.insert().values(key=key, version=1)
+    if db.session.connection().dialect.name == 'sqlite':
+        # the UPDATE in bump() locked the whole database for writing, so
+        # nobody else can insert the key (and pysqlite breaks savepoints)
+        db.session.execute(insert)
+        return
+
+    db.session.flush()      # so only the insert can fail in the savepoint
+    try:
+        with db.session.begin_nested():
+            db.session.execute(insert)
+    except IntegrityError:
+        db.session.execute(versions.update()
+                           .where(versions.c.key == key)
+                           .values(version=versions.c.version + 1))
+    return
+
+
+def _born(connection, keys):
+    """Create the counters of a new group or user. A user can be created
+    again with the name of a deleted one (and a group can get the id of a
+    deleted one), so existing counters go up instead: an ETag of the old
+    one must not match the new one."""
+    for key in keys:
+        result = connection.execute(versions.update()
+                                    .where(versions.c.key == key)
+                                    .values(version=versions.c.version + 1))
+        if result.rowcount == 0:
+            connection.execute(versions.insert(), {'key': key, 'version': 0})
+    return
+
+
+@event.listens_for(User, 'after_insert')
+def _user_created(mapper, connection, target):
+    _born(connection, [user(target.username)])
+    return
+
+
+@event.listens_for(Group, 'after_insert')
+def _group_created(mapper, connection, target):
+    _born(connection, [group(target.id), tally(target.id)])
+    return
+
+
+def current(keys, member=None):
+    """The counters of the keys and, if `member` is set, of all the groups
+    of that user; keys that were never bumped are left out."""
+    condition = versions.c.key.in_(keys)
+    if member is not None:
+        member_groups = (db.session.query(
+            literal('group:') + cast(user_groups.c.group_id, String))
+            .filter(user_groups.c.username == member))
+        condition = or_(condition, versions.c.key.in_(member_groups))
+    query = db.session.query(versions.c.key, versions.c.version).filter(
+        condition)
+    return dict(query)
+
+
+def digest(counters):
+    """A short, stable representation of the counters, for cache keys."""
+    return hashlib.sha1(repr(sorted(counters.items()))).hexdigest()
+
+
+def etag(counters, daily=False):
+    """The ETag of the current request, for a response that depends on the
+    counters (from :py:func:`current`). `daily` responses change every day,
+    even if nothing was bumped."""
+    parts = sorted(counters.items())
+    parts.append(request.full_path)
+    parts.append(serializer.wants_msgpack())
+    if daily:
+        parts.append(datetime.date.today().isoformat())
+    return hashlib.sha1(repr(parts)).hexdigest()
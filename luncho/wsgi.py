@@ -0,0 +1,15 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+"""WSGI entry point, for servers like gunicorn or uWSGI::
+
+    gunicorn luncho.wsgi:app
+
+The app is warmed up when the module is imported, so the first request of
+a worker is as fast as the others."""
+
+from luncho.server import create_app
+from luncho.server import warm_up
+
+app = create_app()
+warm_up(app)
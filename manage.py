@@ -1,19 +1,127 @@
 #!/usr/bin/env python
 # -*- encoding: utf-8 -*-
 
+import argparse
+import base64
+import json
 import logging
+import sys
+import time
 
 from flask.ext.script import Manager
 
 from luncho.server import app
+from luncho.server import default_app
+from luncho.server import User
+from luncho.search import rebuild_index
+from luncho import seed as dataset
+from luncho import profiler
 
-manager = Manager(app)
+manager = Manager(default_app)
+
+
+def positive(value):
+    """Argument type for counts: integers, at least 1."""
+    count = int(value)
+    if count < 1:
+        raise argparse.ArgumentTypeError('must be at least 1')
+    return count
 
 
 @manager.command
 def create_db():
     """Create the database."""
 
+
+@manager.command
+def index_places():
+    """Rebuild the place search index."""
+    rebuild_index()
+
+
+@manager.option('--scale', choices=sorted(dataset.SCALES), default='small',
+                help='base size of the dataset')
+@manager.option('--users', type=int, help='number of users')
+@manager.option('--groups', type=int, help='number of groups')
+@manager.option('--places', type=int, help='number of places')
+@manager.option('--days', type=int, help='days of votes')
+@manager.option('--seed', type=int, default=42, help='random seed')
+def seed(scale, users, groups, places, days, seed):
+    """Replace the database with a generated dataset."""
+    sizes = dict(dataset.SCALES[scale])
+    for (name, value) in [('users', users), ('groups', groups),
+                          ('places', places), ('days', days)]:
+        if value is not None:
+            sizes[name] = value
+
+    start = time.time()
+    counts = dataset.generate(seed=seed, **sizes)
+    for table in sorted(counts):
+        print('{table}: {count}'.format(table=table, count=counts[table]))
+    print('Done in {elapsed:.1f}s'.format(elapsed=time.time() - start))
+
+
+@manager.option('--output', help='save the collapsed stacks in this file')
+@manager.option('--sort', choices=['tottime', 'cumulative'],
+                default='tottime', help='order of the functions')
+@manager.option('--top', type=int, default=30,
+                help='number of functions shown')
+@manager.option('--user', help='authenticate as this user')
+@manager.option('--data', help='JSON sent in the requests')
+@manager.option('-n', '--count', type=positive, default=100,
+                help='number of requests')
+@manager.option('path', help='path of the endpoint')
+@manager.option('method', help='HTTP method')
+def profile(method, path, count, data, user, top, sort, output):
+    """Profile requests to an endpoint and show the hottest functions."""
+    headers = {}
+    if user:
+        account = User.query.get(user)
+        if account is None:
+            sys.exit('User {user} not found'.format(user=user))
+        token = account.get_token()
+        headers['Authorization'] = 'Basic {code}'.format(
+            code=base64.b64encode(token + ':x'))
+    if data:
+        data = json.dumps(json.loads(data))     # fail early on bad JSON
+
+    client = app.test_client()
+
+    def requests():
+        for _ in xrange(count):
+            response = client.open(path,
+                                   method=method.upper(),
+                                   data=data,
+                                   content_type='application/json',
+                                   headers=headers)
+        return response
+
+    start = time.time()
+    (response, stats) = profiler.run(requests)
+    elapsed = time.time() - start
+    print('{count} requests in {elapsed:.2f}s (last: {status}), '
+          '{per:.2f}ms each, under the profiler'.format(
+              count=count,
+              elapsed=elapsed,
+              status=response.status_code,
+              per=elapsed / count * 1000))
+
+    print('')
+    print('{0:>10} {1:>10} {2:>10}  {3}'.format('calls', 'own (ms)',
+                                                'total (ms)', 'function'))
+    for (name, calls, own, total) in profiler.hottest(stats, top, sort):
+        print('{0:>10} {1:>10.1f} {2:>10.1f}  {3}'.format(
+            calls, own * 1000, total * 1000, name))
+
+    print('')
+    packages = profiler.by_package(stats)
+    for package in sorted(packages, key=packages.get, reverse=True)[:top]:
+        print('{0:>10.1f}ms  {1}'.format(packages[package] * 1000, package))
+
+    if output:
+        profiler.write_collapsed(profiler.collapse(stats), output)
+        print('Collapsed stacks saved in {0}'.format(output))
+
 if __name__ == '__main__':
     logging.basicConfig(level=logging.DEBUG)
     app.config.DEBUG = True
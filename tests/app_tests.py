@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+import unittest
+import json
+
+from luncho import server
+
+from luncho.server import User
+
+from base import LunchoTests
+
+
+class TestCreateApp(LunchoTests):
+    """Tests for the application factory."""
+
+    def setUp(self):
+        super(TestCreateApp, self).setUp()
+        self.other = server.create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite://',
+                                        'TESTING': True,
+                                        'PLACES_IN_VOTE': 5})
+        with self.other.app_context():
+            server.db.create_all()
+        return
+
+    def tearDown(self):
+        with self.other.app_context():
+            server.db.drop_all()
+        super(TestCreateApp, self).tearDown()
+        return
+
+    def test_config(self):
+        """Settings passed to the factory replace the defaults."""
+        self.assertEqual(self.other.config['PLACES_IN_VOTE'], 5)
+        self.assertEqual(server.app.config['PLACES_IN_VOTE'], 3)
+        return
+
+    def test_routes(self):
+        """The new app has all the endpoints."""
+        default = json.loads(self.get('/').data)['api']
+        other = json.loads(self.other.test_client().get('/').data)['api']
+        self.assertEqual(other, default)
+        return
+
+    def test_separate_databases(self):
+        """Each app uses its own database."""
+        self.default_user()
+        client = self.other.test_client()
+        rv = client.post('/token/',
+                         data=json.dumps({'username': 'test',
+                                          'password': 'hash'}),
+                         content_type='application/json')
+        self.assertJsonError(rv, 404, 'User does not exist')
+
+        with self.other.app_context():
+            self.assertEqual(User.query.count(), 0)
+        self.assertEqual(User.query.count(), 1)
+        return
+
+    def test_warm_up(self):
+        """Warming up doesn't leave anything behind."""
+        server.warm_up(self.other)
+        with self.other.app_context():
+            self.assertEqual(User.query.count(), 0)
+        return
+
+
+if __name__ == '__main__':
+    unittest.main()
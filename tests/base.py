@@ -5,6 +5,11 @@ import unittest
 import json
 import base64
 
+from contextlib import contextmanager
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
 from luncho import server
 
 from luncho.server import User
@@ -34,6 +39,7 @@ class LunchoTests(unittest.TestCase):
 
         self.app = server.app.test_client()
         server.db.create_all()
+        server.app.extensions['luncho.cache'].clear()
         return
 
     def tearDown(self):
@@ -124,6 +130,36 @@ class LunchoTests(unittest.TestCase):
         self.assertJson(response, expected)
         return
 
+    @contextmanager
+    def recordQueries(self):
+        """Record the SQL statements run inside the `with` block in the
+        returned list."""
+        statements = []
+
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(Engine, 'after_cursor_execute', record)
+        try:
+            yield statements
+        finally:
+            event.remove(Engine, 'after_cursor_execute', record)
+        return
+
+    @contextmanager
+    def assertMaxQueries(self, budget):
+        """Assert that the `with` block runs at most `budget` SQL
+        statements."""
+        with self.recordQueries() as statements:
+            yield statements
+
+        if len(statements) > budget:
+            self.fail('{count} queries, expected at most {budget}:\n'
+                      '{statements}'.format(count=len(statements),
+                                            budget=budget,
+                                            statements='\n'.join(statements)))
+        return
+
     # ------------------------------------------------------------
     #  Easy way to convert the data to JSON and do requests
     # ------------------------------------------------------------
@@ -0,0 +1,276 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+import unittest
+import json
+import os
+import shutil
+import tempfile
+
+from luncho import server
+from luncho import cache
+from luncho import helpers
+
+from base import LunchoTests
+
+
+class BackendTests(object):
+    """Tests every backend must pass."""
+
+    def test_get_set(self):
+        """Values come back as they went."""
+        self.assertEqual(self.cache.get('key'), None)
+        self.cache.set('key', {'places': [1, 2], 'closed': False})
+        self.assertEqual(self.cache.get('key'),
+                         {'places': [1, 2], 'closed': False})
+        self.cache.set('key', False)
+        self.assertEqual(self.cache.get('key'), False)
+        return
+
+    def test_unicode(self):
+        """Keys can have any character."""
+        self.cache.set(u'member:1:jos\xe9', True)
+        self.assertEqual(self.cache.get(u'member:1:jos\xe9'), True)
+        return
+
+    def test_delete(self):
+        """Deleted keys are gone, the others stay."""
+        self.cache.set('one', 1)
+        self.cache.set('two', 2)
+        self.cache.delete('one', 'three')
+        self.assertEqual(self.cache.get('one'), None)
+        self.assertEqual(self.cache.get('two'), 2)
+
+        self.cache.clear()
+        self.assertEqual(self.cache.get('two'), None)
+        return
+
+    def test_expired(self):
+        """Entries expire."""
+        self.cache.ttl = -1
+        self.cache.set('key', 1)
+        self.assertEqual(self.cache.get('key'), None)
+        return
+
+
+class TestLocalCache(BackendTests, unittest.TestCase):
+    def setUp(self):
+        self.cache = cache.LocalCache(3, 60)
+        return
+
+    def test_size(self):
+        """Only the most recently used entries are kept."""
+        for key in ['one', 'two', 'three']:
+            self.cache.set(key, key)
+        self.cache.get('one')
+        self.cache.set('four', 'four')
+        self.assertEqual(self.cache.get('two'), None)
+        self.assertEqual(self.cache.get('one'), 'one')
+        return
+
+    def test_not_deleted_keys(self):
+        """Keys deleted on change aren't kept in the cache of a process."""
+        previous = server.app.extensions[cache.EXTENSION]
+        server.app.extensions[cache.EXTENSION] = self.cache
+        try:
+            with server.app.app_context():
+                cache.put(cache.auth_key('token'), {'username': 'test'})
+                cache.put(cache.member_key(1, 'test'), False)
+                cache.put('places:test:1', [])
+                self.assertEqual(cache.get(cache.auth_key('token')), None)
+                self.assertEqual(cache.get(cache.member_key(1, 'test')),
+                                 None)
+                self.assertEqual(cache.get('places:test:1'), [])
+        finally:
+            server.app.extensions[cache.EXTENSION] = previous
+        return
+
+
+class TestFileCache(BackendTests, unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = cache.FileCache(os.path.join(self.directory, 'cache'),
+                                     3, 60)
+        return
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        return
+
+    def test_shared(self):
+        """Caches with the same file see the same entries."""
+        self.cache.set('key', 1)
+        other = cache.FileCache(self.cache.path, 3, 60)
+        self.assertEqual(other.get('key'), 1)
+        return
+
+    def _keys(self):
+        with self.cache._open(False) as db:
+            return sorted(db.keys())
+
+    def test_expired_removed(self):
+        """Expired entries are removed from the file when read."""
+        self.cache.ttl = -1
+        self.cache.set('key', 1)
+        self.cache.get('key')
+        self.assertEqual(self._keys(), [])
+        return
+
+    def test_size(self):
+        """Sweeps keep the file with `size` entries, dropping the expired
+        ones and then the ones closer to expire."""
+        self.cache.ttl = -1
+        self.cache.set('expired', 1)
+        for (ttl, key) in [(60, 'one'), (30, 'two'), (90, 'three'),
+                           (120, 'four')]:
+            self.cache.ttl = ttl
+            self.cache.set(key, key)
+        self.assertEqual(self._keys(), [b'four', b'one', b'three'])
+        return
+
+
+class TestRedisCache(BackendTests, unittest.TestCase):
+    def setUp(self):
+        self.client = cache.MemoryRedis()
+        self.cache = cache.RedisCache(self.client, 'luncho:', 60)
+        return
+
+    def test_prefix(self):
+        """Clearing the cache leaves the other keys in the server."""
+        self.client.set('other', 'value')
+        self.cache.set('key', 1)
+        self.assertEqual(self.client.get('luncho:key') is None, False)
+        self.cache.clear()
+        self.assertEqual(self.client.get('other'), 'value')
+        return
+
+    def test_backend(self):
+        """`memory://` uses the stand-in."""
+        config = dict(server.app.config)
+        config.update(CACHE_BACKEND='redis', CACHE_REDIS_URL='memory://')
+        backend = cache.backend(config)
+        self.assertTrue(isinstance(backend, cache.RedisCache))
+        self.assertTrue(isinstance(backend.client, cache.MemoryRedis))
+        return
+
+
+class TestCachedRequests(LunchoTests):
+    """Tests for the cached paths of the API."""
+
+    def setUp(self):
+        super(TestCachedRequests, self).setUp()
+        self.previous = server.app.extensions[cache.EXTENSION]
+        server.app.extensions[cache.EXTENSION] = cache.RedisCache(
+            cache.MemoryRedis(), 'luncho:', 60)
+        self.default_user()
+        self.token = self.user.token
+
+        rv = self.post('/group/', {'name': 'Group'}, token=self.token)
+        self.group_id = json.loads(rv.data)['id']
+        return
+
+    def tearDown(self):
+        server.app.extensions[cache.EXTENSION] = self.previous
+        super(TestCachedRequests, self).tearDown()
+        return
+
+    def queries(self, url, token=None):
+        with self.recordQueries() as statements:
+            rv = self.get(url, token=token or self.token)
+        self.assertJsonOk(rv)
+        return statements
+
+    def test_auth(self):
+        """Known tokens don't go to the database."""
+        with self.recordQueries() as statements:
+            rv = self.get('/group/', token=self.token)
+        self.assertJsonOk(rv)
+        for statement in statements:
+            self.assertFalse('user.token' in statement)
+        return
+
+    def test_auth_columns(self):
+        """Only what the authentication needs is cached."""
+        with server.app.test_request_context():
+            cached = cache.get(cache.auth_key(self.token))
+            self.assertEqual(sorted(cached), sorted(helpers.AUTH_COLUMNS))
+
+            server.db.session.expunge_all()
+            user = helpers._user_by_token(self.token)
+            self.assertTrue(user.valid_token(self.token))
+            self.assertEqual(user.fullname, 'Test User')     # loaded
+        return
+
+    def test_user_changed(self):
+        """Changing the user drops the cached user."""
+        self.put('/user/', {'full_name': 'Other Name'}, token=self.token)
+        with server.app.app_context():
+            self.assertEqual(cache.get(cache.auth_key(self.token)), None)
+
+        rv = self.get('/group/{group}/users/'.format(group=self.group_id),
+                      token=self.token)
+        self.assertEqual(json.loads(rv.data)['users'][0]['full_name'],
+                         'Other Name')
+        return
+
+    def test_user_deleted(self):
+        """Deleted users can't use their tokens."""
+        self.get('/group/', token=self.token)
+        self.delete('/user/', token=self.token)
+        rv = self.get('/group/', token=self.token)
+        self.assertJsonError(rv, 404, 'User not found (via token)')
+        del self.user
+        return
+
+    def test_membership(self):
+        """New members are members right away."""
+        other = self.create_user(name='other', create_token=True)
+        token = other.token
+        url = '/vote/{group}/'.format(group=self.group_id)
+        rv = self.get(url, token=token)
+        self.assertStatusCode(rv, 403)
+
+        self.post('/group/{group}/users/'.format(group=self.group_id),
+                  {'usernames': ['other']},
+                  token=self.token)
+        rv = self.get(url, token=token)
+        self.assertJsonOk(rv)
+        return
+
+    def test_reused_group_id(self):
+        """A group that gets the id of a deleted group is not mistaken for
+        the old one."""
+        other = self.create_user(name='other', create_token=True)
+        other_token = other.token
+        url = '/group/{group}/users/'.format(group=self.group_id)
+        rv = self.get(url, token=other_token)
+        self.assertStatusCode(rv, 403)
+
+        self.delete('/group/{group}/'.format(group=self.group_id),
+                    token=self.token)
+        rv = self.post('/group/', {'name': 'Other group'}, token=other_token)
+        self.assertEqual(json.loads(rv.data)['id'], self.group_id)
+
+        rv = self.get(url, token=other_token)
+        self.assertJsonOk(rv)
+        return
+
+    def test_results(self):
+        """Results are computed once per vote."""
+        self.queries('/vote/{group}/'.format(group=self.group_id))
+        statements = self.queries('/vote/{group}/'.format(
+            group=self.group_id))
+        self.assertEqual(len(statements), 2)     # the group, the versions
+        return
+
+    def test_places(self):
+        """The places of the user are read once per change."""
+        self.queries('/place/')
+        self.assertEqual(len(self.queries('/place/')), 1)
+
+        self.post('/place/', {'name': 'Place'}, token=self.token)
+        rv = self.get('/place/', token=self.token)
+        self.assertEqual([place['name']
+                          for place in json.loads(rv.data)['places']],
+                         ['Place'])
+        return
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+import unittest
+import json
+import zlib
+
+from luncho import server
+from luncho import compression
+
+from base import LunchoTests
+from base import _token_header
+
+
+def gunzip(data):
+    return zlib.decompress(data, compression.GZIP_HEADER)
+
+
+class TestCompression(LunchoTests):
+    """Tests for the response compression."""
+
+    def setUp(self):
+        super(TestCompression, self).setUp()
+        compression.cache.clear()
+        return
+
+    def tearDown(self):
+        server.app.config['COMPRESS_MIN_SIZE'] = \
+            server.Settings.COMPRESS_MIN_SIZE
+        super(TestCompression, self).tearDown()
+        return
+
+    def request(self, url, encoding, token=None):
+        headers = _token_header(token) or {}
+        headers['Accept-Encoding'] = encoding
+        return self.app.get(url, headers=headers)
+
+    def test_gzip(self):
+        """Clients accepting gzip get gzip."""
+        rv = self.request('/', 'gzip')
+        self.assertEqual(rv.headers['Content-Encoding'], 'gzip')
+        self.assertTrue('Accept-Encoding' in rv.headers['Vary'])
+        self.assertEqual(json.loads(gunzip(rv.data)),
+                         json.loads(self.get('/').data))
+        return
+
+    def test_not_accepted(self):
+        """Clients not accepting any encoding get the plain response."""
+        rv = self.get('/')
+        self.assertFalse('Content-Encoding' in rv.headers)
+        self.assertJsonOk(rv)
+
+        rv = self.request('/', 'gzip;q=0, identity')
+        self.assertFalse('Content-Encoding' in rv.headers)
+        self.assertJsonOk(rv)
+        return
+
+    def test_small(self):
+        """Responses smaller than COMPRESS_MIN_SIZE aren't compressed."""
+        server.app.config['COMPRESS_MIN_SIZE'] = 1024 * 1024
+        rv = self.request('/', 'gzip')
+        self.assertFalse('Content-Encoding' in rv.headers)
+        self.assertJsonOk(rv)
+        return
+
+    def test_stream(self):
+        """Streamed responses are compressed as they go."""
+        self.default_user()
+        token = self.user.token
+        rv = self.post('/group/', {'name': 'Group'}, token=token)
+        group_id = json.loads(rv.data)['id']
+
+        url = '/group/{group}/users/?stream=true'.format(group=group_id)
+        rv = self.request(url, 'gzip', token=token)
+        self.assertEqual(rv.headers['Content-Encoding'], 'gzip')
+        data = json.loads(gunzip(rv.data))
+        self.assertEqual([user['username'] for user in data['users']],
+                         ['test'])
+        return
+
+    def test_shared(self):
+        """Shared responses are compressed only once."""
+        server.app.config['COMPRESS_MIN_SIZE'] = 0
+        self.default_user()
+        token = self.user.token
+        rv = self.post('/group/', {'name': 'Group'}, token=token)
+        group_id = json.loads(rv.data)['id']
+
+        url = '/vote/{group}/'.format(group=group_id)
+        first = self.request(url, 'gzip', token=token)
+        second = self.request(url, 'gzip', token=token)
+        self.assertEqual(first.data, second.data)
+        self.assertEqual(json.loads(gunzip(second.data))['status'], 'OK')
+        self.assertEqual(compression.cache.misses, 1)
+        self.assertEqual(compression.cache.hits, 1)
+        return
+
+    def test_cache_size(self):
+        """Only the most recent bodies are kept."""
+        with server.app.test_request_context():
+            for body in ['one', 'two', 'three']:
+                compression.cache.get(body, 'gzip', 2)
+            compression.cache.get('one', 'gzip', 2)
+        self.assertEqual(len(compression.cache.entries), 2)
+        self.assertEqual(compression.cache.hits, 0)
+        return
+
+    @unittest.skipIf(compression.brotli is None, 'brotli is not installed')
+    def test_brotli(self):
+        """Brotli is preferred, if the client accepts it."""
+        rv = self.request('/', 'gzip, br')
+        self.assertEqual(rv.headers['Content-Encoding'], 'br')
+        self.assertEqual(json.loads(compression.brotli.decompress(rv.data)),
+                         json.loads(self.get('/').data))
+
+        rv = self.request('/', 'gzip, br;q=0.5')
+        self.assertEqual(rv.headers['Content-Encoding'], 'gzip')
+        return
@@ -3,6 +3,13 @@
 
 from base import LunchoTests
 
+from luncho import server
+
+from luncho.server import User
+
+from luncho.helpers import QueryBudget
+from luncho.helpers import QueryBudgetExceeded
+
 
 class TestLuncho(LunchoTests):
     """Test things that are in the base system, not the blueprints
@@ -20,3 +27,21 @@ class TestLuncho(LunchoTests):
         """Try to request an authenticated request without authentication."""
         rv = self.app.get('/place/')    # GET /place/ is authenticated
         self.assertJsonError(rv, 401, 'Request requires authentication')
+
+    def test_query_budget(self):
+        """Views over their query budget raise in tests."""
+        view = QueryBudget(1)(lambda: User.query.count() + User.query.count())
+        with server.app.test_request_context():
+            server.app.preprocess_request()
+            self.assertRaises(QueryBudgetExceeded, view)
+
+    def test_query_budget_production(self):
+        """Outside tests, views over their budget still return."""
+        view = QueryBudget(1)(lambda: User.query.count() + User.query.count())
+        server.app.testing = False
+        try:
+            with server.app.test_request_context():
+                server.app.preprocess_request()
+                self.assertEqual(view(), 0)
+        finally:
+            server.app.testing = True
@@ -10,6 +10,7 @@ from luncho import server
 from luncho.server import User
 from luncho.server import Group
 from luncho.server import Place
+from luncho.server import user_groups
 
 from base import LunchoTests
 
@@ -329,6 +330,27 @@ class TestUsersInGroup(LunchoTests):
         self.assertTrue('unknown' in json['not_found'])
         return
 
+    def test_add_many_users(self):
+        """Adding users runs the same queries, no matter how many."""
+        usernames = []
+        for pos in range(10):
+            user = self.create_user(name='user{pos}'.format(pos=pos))
+            usernames.append(user.username)
+        group_id = self.group.id
+        token = self.user.token
+
+        request = {'usernames': usernames + ['unknown', self.user.username]}
+        url = '/group/{group_id}/users/'.format(group_id=group_id)
+        # (+1 for the bump of the versions)
+        with self.assertMaxQueries(5):
+            rv = self.post(url, request, token=token)
+        self.assertJsonOk(rv, not_found=['unknown'])
+
+        members = server.db.session.query(user_groups).filter(
+            user_groups.c.group_id == group_id).count()
+        self.assertEqual(members, 11)   # the owner isn't added twice
+        return
+
     def test_add_unknown_group(self):
         """Try to add users to some unknown group."""
         # the usernames are worthless, group not found should kick first
@@ -390,6 +412,77 @@ class TestUsersInGroup(LunchoTests):
         self.assertJsonError(rv, 403, 'User is not member of this group')
         return
 
+    def _add_members(self, count):
+        """Add a number of members to the group."""
+        for pos in range(count):
+            member = User(username='member{pos:02d}'.format(pos=pos),
+                          fullname='Member {pos}'.format(pos=pos),
+                          passhash='hash')
+            server.db.session.add(member)
+            member.groups.append(self.group)
+        server.db.session.commit()
+        return
+
+    def test_get_members_paginated(self):
+        """Read the list of members in pages."""
+        self._add_members(5)
+        token = self.user.token
+        url = '/group/{group_id}/users/'.format(group_id=self.group.id)
+
+        rv = self.get(url + '?limit=4', token=token)
+        self.assertJsonOk(rv, next='member03')
+        json = loads(rv.data)
+        self.assertEqual([user['username'] for user in json['users']],
+                         ['member00', 'member01', 'member02', 'member03'])
+
+        rv = self.get(url + '?limit=4&after=member03', token=token)
+        self.assertJsonOk(rv, next=None)
+        json = loads(rv.data)
+        self.assertEqual([user['username'] for user in json['users']],
+                         ['member04', 'test'])
+        return
+
+    def test_get_members_invalid_limit(self):
+        """Request a page with an invalid size."""
+        url = '/group/{group_id}/users/?limit=0'.format(
+            group_id=self.group.id)
+        rv = self.get(url, token=self.user.token)
+        self.assertJsonError(rv, 400, 'Invalid pagination parameter',
+                             fields=['limit'])
+        return
+
+    def test_get_members_streamed(self):
+        """Request the list of members as a stream."""
+        self._add_members(3)
+        url = '/group/{group_id}/users/?stream=true'.format(
+            group_id=self.group.id)
+        rv = self.get(url, token=self.user.token)
+        self.assertJsonOk(rv)
+        json = loads(rv.data)
+        self.assertEqual(len(json['users']), 4)     # owner + 3 members
+        self.assertFalse('next' in json)
+        return
+
+    def test_get_members_streamed_pages(self):
+        """Streamed pages end with the key for the next page."""
+        self._add_members(3)
+        token = self.user.token
+        url = '/group/{group_id}/users/?stream=true&limit=3'.format(
+            group_id=self.group.id)
+        rv = self.get(url, token=token)
+        self.assertJsonOk(rv)
+        json = loads(rv.data)
+        self.assertEqual(len(json['users']), 3)
+        self.assertEqual(json['next'], json['users'][-1]['username'])
+
+        rv = self.get(url + '&after=' + json['next'], token=token)
+        self.assertJsonOk(rv)
+        json = loads(rv.data)
+        self.assertEqual([user['username'] for user in json['users']],
+                         ['test'])
+        self.assertIsNone(json['next'])
+        return
+
     def test_unknown_group(self):
         """Test trying to get members of a group that doesn't exist."""
         group_id = self.group.id + 10
@@ -450,6 +543,24 @@ class TestPlacesInGroup(LunchoTests):
         self.assertFalse(json['not_found'])
         return
 
+    def test_add_many_places(self):
+        """Adding places runs the same queries, no matter how many."""
+        places = [self._place().id for _ in range(10)]
+        group_id = self._group().id
+        token = self.user.token
+
+        request = {'places': places + [places[0] + 100]}
+        url = '/group/{group_id}/places/'.format(group_id=group_id)
+        # (+1 for the bump of the version)
+        with self.assertMaxQueries(7):
+            rv = self.post(url, request, token=token)
+        self.assertJsonOk(rv, rejected=[], not_found=[places[0] + 100])
+
+        # adding again doesn't duplicate them
+        rv = self.post(url, {'places': places}, token=token)
+        self.assertEqual(len(Group.query.get(group_id).places), 10)
+        return
+
     def test_add_place_of_member(self):
         """Add a place that belongs to a member of the group."""
         new_user = self.create_user(name='newuser',
@@ -539,13 +650,133 @@ class TestPlacesInGroup(LunchoTests):
         place = self._place()
         group.places.append(place)
         server.db.session.commit()
+        place_id = place.id
 
         rv = self.get('/group/{group_id}/places/'.format(group_id=group.id),
                       token=self.user.token)
         self.assertJsonOk(rv)
         json = loads(rv.data)
         self.assertTrue('places' in json)
-        self.assertEquals(place.id, json['places'][0]['id'])
+        self.assertEquals(place_id, json['places'][0]['id'])
+        return
+
+    def test_get_group_places_paginated(self):
+        """Read the list of group places in pages."""
+        group = self._group()
+        places = [self._place() for _ in range(3)]
+        group.places.extend(places)
+        server.db.session.commit()
+        ids = [place.id for place in places]
+
+        url = '/group/{group_id}/places/'.format(group_id=group.id)
+        rv = self.get(url + '?limit=2', token=self.user.token)
+        self.assertJsonOk(rv, next=ids[1])
+        json = loads(rv.data)
+        self.assertEqual([place['id'] for place in json['places']], ids[:2])
+
+        rv = self.get(url + '?after={after}'.format(after=ids[1]),
+                      token=self.user.token)
+        self.assertJsonOk(rv, next=None)
+        json = loads(rv.data)
+        self.assertEqual([place['id'] for place in json['places']], ids[2:])
+        return
+
+    def test_get_group_places_invalid_cursor(self):
+        """The cursor for places must be a place id."""
+        group = self._group()
+        url = '/group/{group_id}/places/?after=abc'.format(group_id=group.id)
+        rv = self.get(url, token=self.user.token)
+        self.assertJsonError(rv, 400, 'Invalid pagination parameter',
+                             fields=['after'])
+        return
+
+    def test_get_group_places_streamed(self):
+        """Request the list of group places as a stream."""
+        group = self._group()
+        place = self._place()
+        group.places.append(place)
+        server.db.session.commit()
+        place_id = place.id
+
+        url = '/group/{group_id}/places/?stream=1'.format(group_id=group.id)
+        rv = self.get(url, token=self.user.token)
+        self.assertJsonOk(rv, places=[{'id': place_id, 'name': 'Place'}])
+        return
+
+    def test_office_ballot(self):
+        """Places far from the office are left out of the ballot."""
+        group = self._group()
+        close = self._place()
+        close.set_location(-30.0300, -51.2300)
+        far = self._place()
+        far.set_location(-23.5505, -46.6333)
+        unknown = self._place()
+        group.places.extend([close, far, unknown])
+        server.db.session.commit()
+        expected = [close.id, unknown.id]
+        group_id = group.id
+        token = self.user.token
+
+        request = {'office': {'latitude': -30.0277,
+                              'longitude': -51.2287,
+                              'radius': 2000}}
+        rv = self.put('/group/{group_id}/'.format(group_id=group_id),
+                      request,
+                      token=token)
+        self.assertJsonOk(rv)
+
+        rv = self.get('/group/{group_id}/places/ballot/'.format(
+            group_id=group_id), token=token)
+        self.assertJsonOk(rv)
+        json = loads(rv.data)
+        self.assertEqual([place['id'] for place in json['places']],
+                         expected)
+        return
+
+    def test_invalid_office(self):
+        """The office needs a location and a radius."""
+        group = self._group()
+        request = {'office': {'latitude': -30.0277,
+                              'longitude': -51.2287}}
+        rv = self.put('/group/{group_id}/'.format(group_id=group.id),
+                      request,
+                      token=self.user.token)
+        self.assertJsonError(rv, 400, 'Invalid location')
+        return
+
+    def test_office_radius(self):
+        """The radius must be a finite number; it's kept in whole
+        meters."""
+        group = self._group()
+        group_id = group.id
+        token = self.user.token
+        url = '/group/{group_id}/'.format(group_id=group_id)
+        for radius in [float('nan'), float('inf')]:
+            request = {'office': {'latitude': -30.0277,
+                                  'longitude': -51.2287,
+                                  'radius': radius}}
+            rv = self.put(url, request, token=token)
+            self.assertJsonError(rv, 400, 'Invalid location')
+
+        request = {'office': {'latitude': -30.0277,
+                              'longitude': -51.2287,
+                              'radius': 1500.2}}
+        rv = self.put(url, request, token=token)
+        self.assertJsonOk(rv)
+        self.assertEqual(Group.query.get(group_id).radius, 1501)
+        return
+
+    def test_office_radius_too_large(self):
+        """The radius can't go over MAX_OFFICE_RADIUS (or the column)."""
+        group = self._group()
+        url = '/group/{group_id}/'.format(group_id=group.id)
+        token = self.user.token
+        for radius in [server.app.config['MAX_OFFICE_RADIUS'] + 1, 1e300]:
+            request = {'office': {'latitude': 0,
+                                  'longitude': 0,
+                                  'radius': radius}}
+            rv = self.put(url, request, token=token)
+            self.assertJsonError(rv, 400, 'Invalid location')
         return
 
     def test_get_places_unknown_group(self):
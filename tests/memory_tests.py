@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+import unittest
+import json
+import logging
+
+from luncho import server
+from luncho import memory
+
+from luncho.server import Group
+
+from base import LunchoTests
+
+
+class RecordHandler(logging.Handler):
+    """Keep the log messages."""
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+class TestMemory(LunchoTests):
+    """Tests for the memory reports."""
+
+    def setUp(self):
+        super(TestMemory, self).setUp()
+        self.default_user()
+        server.app.config['ADMINS'] = [self.user.username]
+        return
+
+    def tearDown(self):
+        server.app.config['ADMINS'] = []
+        super(TestMemory, self).tearDown()
+        return
+
+    def test_not_admin(self):
+        """Only the administrators get memory reports."""
+        server.app.config['ADMINS'] = []
+        rv = self.get('/admin/memory/', token=self.user.token)
+        self.assertJsonError(rv, 403, 'Administrators only')
+        return
+
+    def test_no_auth(self):
+        """The memory report requires a token."""
+        rv = self.get('/admin/memory/')
+        self.assertJsonError(rv, 401, 'Request requires authentication')
+        return
+
+    def test_report(self):
+        """The report counts the live ORM instances."""
+        groups = [Group(name='Group {0}'.format(pos), owner=self.user)
+                  for pos in range(5)]
+        rv = self.get('/admin/memory/?top=5', token=self.user.token)
+        self.assertJsonOk(rv)
+        report = json.loads(rv.data)['memory']
+        self.assertTrue(report['models']['Group'] >= 5)
+        self.assertTrue(report['models']['User'] >= 1)
+        self.assertTrue(report['objects'] > 0)
+        self.assertEqual(len(report['types']), 5)
+        self.assertTrue(len(groups) > 0)    # keep them alive till here
+        return
+
+    def test_growth(self):
+        """Types are compared with the previous report."""
+        memory.report()
+
+        class Leak(object):
+            pass
+
+        leak = [Leak() for _ in range(5000)]
+        rows = memory.report(top=50)['types']
+        growth = dict((row['type'], row['diff']) for row in rows)
+        name = __name__ + '.Leak'
+        self.assertEqual(growth.get(name), 5000)
+        self.assertEqual(rows[0]['type'], name)
+        self.assertTrue(len(leak) > 0)
+        return
+
+    def test_signal(self):
+        """The signal handler logs the report."""
+        handler = RecordHandler()
+        memory.LOG.addHandler(handler)
+        try:
+            memory._handle_signal(None, None)
+        finally:
+            memory.LOG.removeHandler(handler)
+
+        self.assertEqual(len(handler.messages), 1)
+        report = json.loads(handler.messages[0].split('\n', 1)[1])
+        self.assertTrue('models' in report)
+        return
+
+    def test_signal_busy(self):
+        """The signal handler doesn't wait for a report in progress."""
+        handler = RecordHandler()
+        memory.LOG.addHandler(handler)
+        memory._lock.acquire()
+        try:
+            memory._handle_signal(None, None)
+        finally:
+            memory._lock.release()
+            memory.LOG.removeHandler(handler)
+
+        self.assertEqual(len(handler.messages), 1)
+        self.assertTrue(handler.messages[0].startswith(
+            'Memory report skipped'))
+        return
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+import unittest
+
+from flask import g
+
+from luncho import server
+from luncho import metrics
+
+from base import LunchoTests
+
+from luncho.metrics import Histogram
+
+
+class TestMetrics(LunchoTests):
+    """Tests for the metrics."""
+
+    def setUp(self):
+        super(TestMetrics, self).setUp()
+        self.default_user()
+        return
+
+    def tearDown(self):
+        super(TestMetrics, self).tearDown()
+        return
+
+    def _sample(self, text, prefix):
+        """Return the value of the sample starting with prefix."""
+        for line in text.split('\n'):
+            if line.startswith(prefix):
+                return float(line.split()[-1])
+        return 0
+
+    def test_metrics(self):
+        """Requests are measured, with their SQL queries."""
+        token = self.user.token
+        before = self.get('/metrics').data
+        self.get('/place/', token=token)
+        after = self.get('/metrics').data
+
+        self.assertTrue('text/plain' in self.get('/metrics').content_type)
+        prefix = ('luncho_request_duration_seconds_count'
+                  '{endpoint="places.get_places",method="GET"}')
+        self.assertEqual(self._sample(after, prefix),
+                         self._sample(before, prefix) + 1)
+
+        prefix = ('luncho_request_sql_queries_sum'
+                  '{endpoint="places.get_places",method="GET"}')
+        self.assertTrue(self._sample(after, prefix) >
+                        self._sample(before, prefix))
+
+        prefix = ('luncho_responses_total'
+                  '{endpoint="places.get_places",method="GET",status="200"}')
+        self.assertEqual(self._sample(after, prefix),
+                         self._sample(before, prefix) + 1)
+        return
+
+    def test_errors(self):
+        """Errors are counted by their code."""
+        prefix = ('luncho_errors_total{endpoint="places.get_places",'
+                  'code="AuthorizationRequired",status="401"}')
+        before = self._sample(self.get('/metrics').data, prefix)
+        self.get('/place/')
+        after = self._sample(self.get('/metrics').data, prefix)
+        self.assertEqual(after, before + 1)
+        return
+
+    def test_histogram(self):
+        """Histogram buckets are cumulative."""
+        histogram = Histogram('test', 'Test', (1, 5), ('label',))
+        for value in [0.5, 3, 3, 10]:
+            histogram.observe(value, ('a',))
+
+        samples = histogram.samples()
+        self.assertEqual(samples, [
+            ('_bucket', '{label="a",le="1.0"}', 1),
+            ('_bucket', '{label="a",le="5.0"}', 3),
+            ('_bucket', '{label="a",le="+Inf"}', 4),
+            ('_sum', '{label="a"}', 16.5),
+            ('_count', '{label="a"}', 4)])
+        return
+
+    def test_failed_query(self):
+        """A failed statement doesn't change the time of the next ones."""
+        with server.app.test_request_context():
+            metrics._start_request()
+            connection = server.db.session.connection()
+            with self.assertRaises(Exception):
+                connection.execute('SELECT * FROM no_such_table')
+            server.db.session.rollback()
+
+            connection = server.db.session.connection()
+            connection.execute('SELECT 1')
+            self.assertEqual(g.sql_queries, 1)
+            self.assertFalse('luncho_query_start' in connection.info)
+        return
+
+if __name__ == '__main__':
+    unittest.main()
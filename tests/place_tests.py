@@ -63,6 +63,243 @@ class TestPlaces(LunchoTests):
         return
 
 
+class TestSearchPlaces(LunchoTests):
+    """Test searching places by name."""
+
+    def setUp(self):
+        super(TestSearchPlaces, self).setUp()
+        self.default_user()
+        self.token = self.user.token
+        return
+
+    def tearDown(self):
+        super(TestSearchPlaces, self).tearDown()
+        return
+
+    def _create(self, name, token=None):
+        """Create a place through the API, so it gets indexed."""
+        rv = self.post('/place/',
+                       {'name': name},
+                       token=token or self.token)
+        self.assertJsonOk(rv)
+        return loads(rv.data)['id']
+
+    def _search(self, text):
+        """Search and return the names of the places found."""
+        rv = self.get('/place/search?q={text}'.format(text=text),
+                      token=self.token)
+        self.assertJsonOk(rv)
+        return [place['name'] for place in loads(rv.data)['places']]
+
+    def test_search_prefix(self):
+        """Partial words match the start of words in the names."""
+        self._create('Pizza Place')
+        self._create('Burger Joint')
+        self.assertEqual(self._search('pi'), ['Pizza Place'])
+        self.assertEqual(self._search('Pizza P'), ['Pizza Place'])
+        return
+
+    def test_search_prefix_not_middle(self):
+        """Partial words don't match the middle of words, even when the
+        search starts from the places the user can see."""
+        other = self.create_user(name='other',
+                                 fullname='Other user',
+                                 create_token=True)
+        self._create('Urban Cafe', token=other.token)
+        self._create('Burger Joint')
+        self.assertEqual(self._search('ur'), [])
+        self.assertEqual(self._search('jo'), ['Burger Joint'])
+        return
+
+    def test_search_substring(self):
+        """Words with three or more letters match anywhere in the names."""
+        self._create('Pizza Place')
+        self._create('Burger Joint')
+        self.assertEqual(self._search('urge'), ['Burger Joint'])
+        self.assertEqual(self._search('sushi'), [])
+        return
+
+    def test_search_shortest_first(self):
+        """Closer (shorter) names come first."""
+        self._create('Pizza Place Downtown')
+        self._create('Pizza Place')
+        self.assertEqual(self._search('pizza'),
+                         ['Pizza Place', 'Pizza Place Downtown'])
+        return
+
+    def test_search_after_rename(self):
+        """The index follows changes in the place name."""
+        token = self.token
+        place_id = self._create('Pizza Place')
+        rv = self.put('/place/{place_id}/'.format(place_id=place_id),
+                      {'name': 'Sushi Bar'},
+                      token=token)
+        self.assertJsonOk(rv)
+        self.assertEqual(self._search('pizza'), [])
+        self.assertEqual(self._search('sushi'), ['Sushi Bar'])
+        return
+
+    def test_search_after_delete(self):
+        """Deleted places are removed from the index."""
+        token = self.token
+        place_id = self._create('Pizza Place')
+        rv = self.delete('/place/{place_id}/'.format(place_id=place_id),
+                         token=token)
+        self.assertJsonOk(rv)
+        self.assertEqual(self._search('pizza'), [])
+        return
+
+    def test_search_only_visible(self):
+        """Places of other users are not found."""
+        other = self.create_user(name='other',
+                                 fullname='Other user',
+                                 create_token=True)
+        self._create('Pizza Place', token=other.token)
+        self.assertEqual(self._search('pizza'), [])
+        return
+
+    def test_create_duplicate(self):
+        """Names that differ only in case and punctuation are duplicates."""
+        place_id = self._create('Pizza Place')
+        rv = self.post('/place/',
+                       {'name': 'pizza place!'},
+                       token=self.token)
+        self.assertJsonError(rv, 409, 'Similar places already exist',
+                             places=[{'id': place_id, 'name': 'Pizza Place'}])
+        return
+
+    def test_create_similar(self):
+        """Small differences in the name are caught too."""
+        self._create('Pizza Place Downtown')
+        rv = self.post('/place/',
+                       {'name': 'Pizza Place Dowtown'},
+                       token=self.token)
+        self.assertJsonError(rv, 409, 'Similar places already exist')
+        return
+
+    def test_create_different(self):
+        """Places sharing just a word are not duplicates."""
+        self._create('Pizza Place')
+        self._create('Sushi Place')
+        return
+
+    def test_create_duplicate_forced(self):
+        """The user can create the duplicate anyway."""
+        self._create('Pizza Place')
+        rv = self.post('/place/',
+                       {'name': 'pizza place', 'force': True},
+                       token=self.token)
+        self.assertJsonOk(rv)
+        return
+
+    def test_create_duplicate_not_visible(self):
+        """Places the user can't see are not suggested."""
+        other = self.create_user(name='other',
+                                 fullname='Other user',
+                                 create_token=True)
+        self._create('Pizza Place', token=other.token)
+        self._create('Pizza Place')
+        return
+
+    def test_search_without_text(self):
+        """The search text is required."""
+        rv = self.get('/place/search', token=self.token)
+        self.assertJsonError(rv, 400, 'Missing fields', fields=['q'])
+        return
+
+
+class TestNearPlaces(LunchoTests):
+    """Test places with locations."""
+
+    # a few places in Porto Alegre, and one in Sao Paulo
+    OFFICE = (-30.0277, -51.2287)
+    CLOSE = (-30.0300, -51.2300)        # about 300 meters from the office
+    FAR = (-30.0600, -51.1700)          # about 6 km from the office
+    OTHER_CITY = (-23.5505, -46.6333)
+
+    def setUp(self):
+        super(TestNearPlaces, self).setUp()
+        self.default_user()
+        self.token = self.user.token
+        return
+
+    def tearDown(self):
+        super(TestNearPlaces, self).tearDown()
+        return
+
+    def _create(self, name, location):
+        """Create a place in the location."""
+        request = {'name': name,
+                   'latitude': location[0],
+                   'longitude': location[1]}
+        rv = self.post('/place/', request, token=self.token)
+        self.assertJsonOk(rv)
+        return loads(rv.data)['id']
+
+    def _near(self, location, radius=None):
+        """Return the names of the places near the location."""
+        url = '/place/near?lat={lat}&lon={lon}'.format(lat=location[0],
+                                                       lon=location[1])
+        if radius:
+            url += '&radius={radius}'.format(radius=radius)
+        rv = self.get(url, token=self.token)
+        self.assertJsonOk(rv)
+        return [place['name'] for place in loads(rv.data)['places']]
+
+    def test_create_with_location(self):
+        """The location is stored with the place."""
+        place_id = self._create('Close', self.CLOSE)
+        place = Place.query.get(place_id)
+        self.assertEqual((place.latitude, place.longitude), self.CLOSE)
+        self.assertTrue(place.geohash)
+        return
+
+    def test_create_invalid_location(self):
+        """Latitude and longitude must be valid and sent together."""
+        for request in [{'name': 'Place', 'latitude': 10},
+                        {'name': 'Place', 'latitude': 91, 'longitude': 0},
+                        {'name': 'Place', 'latitude': 'a', 'longitude': 0}]:
+            rv = self.post('/place/', request, token=self.token)
+            self.assertJsonError(rv, 400, 'Invalid location')
+        return
+
+    def test_near(self):
+        """Only places inside the radius are returned, closest first."""
+        self._create('Far', self.FAR)
+        self._create('Close', self.CLOSE)
+        self._create('Other city', self.OTHER_CITY)
+        self.assertEqual(self._near(self.OFFICE), ['Close'])
+        self.assertEqual(self._near(self.OFFICE, radius=10000),
+                         ['Close', 'Far'])
+        return
+
+    def test_near_after_move(self):
+        """Moving a place changes the places near a location."""
+        place_id = self._create('Moving', self.CLOSE)
+        rv = self.put('/place/{place_id}/'.format(place_id=place_id),
+                      {'latitude': self.OTHER_CITY[0],
+                       'longitude': self.OTHER_CITY[1]},
+                      token=self.token)
+        self.assertJsonOk(rv)
+        self.assertEqual(self._near(self.OFFICE), [])
+        self.assertEqual(self._near(self.OTHER_CITY), ['Moving'])
+        return
+
+    def test_near_without_location(self):
+        """The location is required."""
+        rv = self.get('/place/near?lat=10', token=self.token)
+        self.assertJsonError(rv, 400, 'Missing fields', fields=['lon'])
+        return
+
+    def test_near_invalid_radius(self):
+        """The radius must be a positive number."""
+        for radius in ['-1', 'nan', 'inf']:
+            rv = self.get('/place/near?lat=10&lon=10&radius=' + radius,
+                          token=self.token)
+            self.assertJsonError(rv, 400, 'Invalid location')
+        return
+
+
 class TestExistingPlaces(LunchoTests):
     """Tests for existing places."""
     def setUp(self):
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+import unittest
+import os
+import shutil
+import tempfile
+
+from luncho import server
+from luncho import profiler
+
+from base import LunchoTests
+from base import _token_header
+
+
+class TestProfiler(LunchoTests):
+    """Tests for the request profiler."""
+
+    def setUp(self):
+        super(TestProfiler, self).setUp()
+        self.directory = tempfile.mkdtemp()
+        server.app.config['PROFILE_DIR'] = self.directory
+        server.app.config['PROFILE'] = True
+        self.default_user()
+        return
+
+    def tearDown(self):
+        server.app.config['PROFILE'] = False
+        server.app.config['PROFILE_SAMPLE_RATE'] = 0.0
+        shutil.rmtree(self.directory)
+        super(TestProfiler, self).tearDown()
+        return
+
+    def _profiled(self, url):
+        """Do a profiled request; return the response and the stacks."""
+        headers = _token_header(self.user.token)
+        headers['X-Luncho-Profile'] = '1'
+        rv = self.app.get(url, headers=headers)
+
+        stacks = {}
+        filename = rv.headers['X-Luncho-Profile']
+        with open(os.path.join(self.directory, filename)) as content:
+            for line in content:
+                (stack, micro) = line.rsplit(' ', 1)
+                stacks[stack] = int(micro)
+        return (rv, stacks)
+
+    def test_not_profiled(self):
+        """Without the header, requests are not profiled."""
+        rv = self.get('/place/', token=self.user.token)
+        self.assertJsonOk(rv)
+        self.assertFalse('X-Luncho-Profile' in rv.headers)
+        self.assertEqual(os.listdir(self.directory), [])
+        return
+
+    def test_disabled(self):
+        """With profiling off, the header is ignored."""
+        server.app.config['PROFILE'] = False
+        rv = self.app.get('/', headers={'X-Luncho-Profile': '1'})
+        self.assertFalse('X-Luncho-Profile' in rv.headers)
+        self.assertEqual(os.listdir(self.directory), [])
+        return
+
+    def test_profiled(self):
+        """The collapsed stacks go down to the ORM and the driver."""
+        (rv, stacks) = self._profiled('/place/')
+        self.assertJsonOk(rv)
+        self.assertTrue(stacks)
+        self.assertTrue(any('luncho/blueprints/places.py' in stack
+                            for stack in stacks))
+        self.assertTrue(any('sqlalchemy/orm/' in stack
+                            for stack in stacks))
+        self.assertTrue(any('sqlite3.Cursor' in stack for stack in stacks))
+        return
+
+    def test_sampled(self):
+        """Requests are profiled by the sample rate."""
+        server.app.config['PROFILE_SAMPLE_RATE'] = 1.0
+        rv = self.app.get('/')
+        self.assertTrue('X-Luncho-Profile' in rv.headers)
+        self.assertEqual(len(os.listdir(self.directory)), 1)
+        return
+
+
+class TestCollapse(unittest.TestCase):
+    """Tests for rebuilding the stacks."""
+
+    def test_split(self):
+        """The time of a function is split among its callers."""
+        def leaf():
+            sum(xrange(20000))
+
+        def first():
+            for _ in xrange(3):
+                leaf()
+
+        def second():
+            leaf()
+
+        def both():
+            first()
+            second()
+
+        (_, stats) = profiler.run(both)
+        stacks = profiler.collapse(stats)
+        first_leaf = sum(micro for (stack, micro) in stacks.items()
+                         if 'first' in stack and 'leaf' in stack)
+        second_leaf = sum(micro for (stack, micro) in stacks.items()
+                          if 'second' in stack and 'leaf' in stack)
+        self.assertTrue(first_leaf > second_leaf)
+
+        total = sum(stacks.values())
+        profiled = sum(data[2] for data in stats.stats.values()) * 1e6
+        self.assertTrue(total <= profiled * 1.01)
+        self.assertTrue(total >= profiled * 0.9)
+        return
+
+    def test_hottest(self):
+        """The hottest functions come first."""
+        def slow():
+            sum(xrange(100000))
+
+        (_, stats) = profiler.run(slow)
+        rows = profiler.hottest(stats, 2, 'cumulative')
+        self.assertEqual(len(rows), 2)
+        self.assertTrue(rows[0][3] >= rows[1][3])
+        return
+
+
+if __name__ == '__main__':
+    unittest.main()
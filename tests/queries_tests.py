@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+import unittest
+
+from luncho import server
+from luncho import queries
+
+from luncho.server import Group
+from luncho.server import Vote
+
+from base import LunchoTests
+
+
+class TestQueries(LunchoTests):
+    """Tests for the prepared lookups."""
+
+    def setUp(self):
+        super(TestQueries, self).setUp()
+        self.default_user()
+        self.token = self.user.token
+        group = Group(name='Group', owner=self.user)
+        server.db.session.add(group)
+        server.db.session.commit()
+        self.group_id = group.id
+        return
+
+    def test_user_by_token(self):
+        """Users are found by their tokens."""
+        with server.app.test_request_context():
+            self.assertEqual(queries.user_by_token(self.token).username,
+                             'test')
+            self.assertEqual(queries.user_by_token('unknown'), None)
+        return
+
+    def test_get(self):
+        """Lookups by id return the object, or None."""
+        with server.app.test_request_context():
+            server.db.session.expunge_all()
+            with self.recordQueries() as statements:
+                group = queries.group(self.group_id)
+                self.assertEqual(group.name, 'Group')
+                self.assertEqual(queries.group(self.group_id), group)
+            self.assertEqual(len(statements), 1)    # then the identity map
+            self.assertEqual(queries.group(self.group_id + 1), None)
+            self.assertEqual(queries.place(1), None)
+        return
+
+    def test_votes_today(self):
+        """Votes of the group are counted."""
+        with server.app.test_request_context():
+            self.assertEqual(queries.votes_today(self.group_id), 0)
+            server.db.session.add(Vote(self.user, self.group_id))
+            server.db.session.commit()
+            self.assertEqual(queries.votes_today(self.group_id), 1)
+            self.assertEqual(queries.votes_today(self.group_id + 1), 0)
+        return
+
+    @unittest.skipIf(queries.baked is not None, 'baked queries')
+    def test_compiled_once(self):
+        """The statements are compiled once."""
+        with server.app.test_request_context():
+            for _ in range(3):
+                server.db.session.expunge_all()
+                queries.group(self.group_id)
+                queries.user_by_token(self.token)
+                queries.votes_today(self.group_id)
+        for lookup in [queries.GROUP, queries.USER_BY_TOKEN,
+                       queries.VOTES_TODAY]:
+            self.assertEqual(len(lookup.compiled), 1)
+        return
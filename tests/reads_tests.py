@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+from luncho import server
+from luncho import reads
+
+from luncho.server import Group
+from luncho.server import Place
+from luncho.server import User
+
+from base import LunchoTests
+
+
+class TestReads(LunchoTests):
+    """Tests for the read-only data access."""
+
+    def setUp(self):
+        super(TestReads, self).setUp()
+        self.default_user()
+        self.username = self.user.username
+
+        group = Group(name='Group', owner=self.user)
+        self.user.groups.append(group)
+        for name in ['One', 'Two', 'Three']:
+            place = Place(name=name, owner=self.user)
+            group.places.append(place)
+        server.db.session.add(Place(name='Other', owner=self.user))
+        server.db.session.commit()
+        self.group_id = group.id
+        return
+
+    def test_rows(self):
+        """Rows are tuples, with the columns as attributes."""
+        with server.app.test_request_context():
+            group = reads.group(self.group_id)
+            self.assertEqual(group, (self.group_id, 'Group', 'test'))
+            self.assertEqual(group.name, 'Group')
+            self.assertEqual(reads.group(self.group_id + 1), None)
+
+            self.assertEqual(reads.user_groups(self.username).all(),
+                             [reads.GroupRow(self.group_id, 'Group', 'test')])
+            self.assertEqual(list(reads.members(self.group_id)),
+                             [reads.MemberRow('test', 'Test User')])
+            self.assertEqual(
+                sorted(place.name
+                       for place in reads.group_places(self.group_id)),
+                ['One', 'Three', 'Two'])
+            self.assertEqual(
+                len(reads.visible_places(self.username).all()), 4)
+        return
+
+    def test_no_objects(self):
+        """Nothing is loaded into the session."""
+        with server.app.test_request_context():
+            server.db.session.expunge_all()
+            reads.group(self.group_id)
+            reads.members(self.group_id).all()
+            list(reads.group_places(self.group_id).yield_per(2))
+            self.assertEqual(len(server.db.session.identity_map), 0)
+        return
+
+    def test_query_interface(self):
+        """Rows can be filtered, ordered, limited and read in batches."""
+        with server.app.test_request_context():
+            places = (reads.group_places(self.group_id)
+                      .filter(Place.name != 'Two')
+                      .order_by(Place.name))
+            self.assertEqual([place.name for place in places],
+                             ['One', 'Three'])
+            self.assertEqual([place.name
+                              for place in places.limit(1).yield_per(1)],
+                             ['One'])
+            self.assertEqual(reads.members(self.group_id)
+                             .filter(User.username == 'nobody').first(),
+                             None)
+        return
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+import json
+import unittest
+
+from luncho import server
+
+from luncho.schemas import Field
+from luncho.schemas import Schema
+
+from luncho.exceptions import RequestMustBeJSONException
+from luncho.exceptions import MissingFieldsException
+from luncho.exceptions import InvalidFieldsException
+
+from base import LunchoTests
+
+
+class TestSchema(unittest.TestCase):
+    """Tests for the validation of request bodies."""
+
+    def setUp(self):
+        self.schema = Schema(Field('name', str, required=True, max_length=5),
+                             Field('ids', list, required=True, items=int,
+                                   max_items='MAX_IDS'),
+                             Field('admin', str, nullable=True),
+                             Field('force', bool),
+                             Field('location'))
+        self.config = {'MAX_IDS': 2}
+        return
+
+    def invalid(self, body):
+        """The fields reported as invalid in the body."""
+        try:
+            self.schema.validate(body, self.config)
+        except InvalidFieldsException as error:
+            return error.extra_fields['fields']
+        self.fail('{body} is valid'.format(body=body))
+
+    def test_valid(self):
+        """Only the fields in the schema are returned."""
+        body = {'name': u'Name', 'ids': [1, 2], 'admin': None,
+                'location': 'anything', 'other': 1}
+        self.assertEqual(self.schema.validate(body, self.config),
+                         {'name': u'Name', 'ids': [1, 2], 'admin': None,
+                          'location': 'anything'})
+        return
+
+    def test_missing(self):
+        """Missing fields are reported in the order of the schema."""
+        with self.assertRaises(MissingFieldsException) as context:
+            self.schema.validate({'force': True}, self.config)
+        self.assertEqual(context.exception.extra_fields['fields'],
+                         ['name', 'ids'])
+        return
+
+    def test_not_object(self):
+        """The body must be an object."""
+        with self.assertRaises(RequestMustBeJSONException):
+            self.schema.validate([1, 2], self.config)
+        return
+
+    def test_types(self):
+        """Fields with the wrong types are reported together."""
+        self.assertEqual(self.invalid({'name': 1, 'ids': [1],
+                                       'force': 'yes'}),
+                         ['name', 'force'])
+        self.assertEqual(self.invalid({'name': 'Name', 'ids': 1}), ['ids'])
+        self.assertEqual(self.invalid({'name': None, 'ids': [1]}), ['name'])
+        return
+
+    def test_items(self):
+        """Elements of lists are checked; booleans aren't numbers."""
+        self.assertEqual(self.invalid({'name': 'Name', 'ids': ['1']}),
+                         ['ids'])
+        self.assertEqual(self.invalid({'name': 'Name', 'ids': [True]}),
+                         ['ids'])
+        return
+
+    def test_limits(self):
+        """Limits can be numbers or settings."""
+        self.assertEqual(self.invalid({'name': 'Long name', 'ids': [1]}),
+                         ['name'])
+        self.assertEqual(self.invalid({'name': 'Name', 'ids': [1, 2, 3]}),
+                         ['ids'])
+        self.config['MAX_IDS'] = 3
+        self.schema.validate({'name': 'Name', 'ids': [1, 2, 3]},
+                             self.config)
+        return
+
+
+class TestRequests(LunchoTests):
+    """Tests for the validation of the API requests."""
+
+    def setUp(self):
+        super(TestRequests, self).setUp()
+        self.default_user()
+        self.token = self.user.token
+        rv = self.post('/group/', {'name': 'Group'}, token=self.token)
+        self.group_id = json.loads(rv.data)['id']
+        return
+
+    def test_choices(self):
+        """Choices must be a short list of place ids."""
+        url = '/vote/{group}/'.format(group=self.group_id)
+        for choices in [1, ['1'], [1, 2, 3, 4]]:
+            rv = self.post(url, {'choices': choices}, token=self.token)
+            self.assertJsonError(rv, 400, 'Invalid fields',
+                                 fields=['choices'])
+        return
+
+    def test_usernames(self):
+        """Usernames are strings, and only so many at once."""
+        url = '/group/{group}/users/'.format(group=self.group_id)
+        rv = self.post(url, {'usernames': [1]}, token=self.token)
+        self.assertJsonError(rv, 400, 'Invalid fields', fields=['usernames'])
+
+        usernames = ['user{0}'.format(pos)
+                     for pos in range(server.app.config['MAX_ADDED'] + 1)]
+        rv = self.post(url, {'usernames': usernames}, token=self.token)
+        self.assertJsonError(rv, 400, 'Invalid fields', fields=['usernames'])
+        return
+
+    def test_name_length(self):
+        """Names can't be too long."""
+        name = 'x' * (server.app.config['MAX_NAME_LENGTH'] + 1)
+        rv = self.post('/group/', {'name': name}, token=self.token)
+        self.assertJsonError(rv, 400, 'Invalid fields', fields=['name'])
+        return
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+import unittest
+
+from sqlalchemy import func
+
+from luncho import server
+from luncho import seed
+
+from luncho.server import User
+from luncho.server import Group
+from luncho.server import Place
+from luncho.server import Vote
+from luncho.server import CastedVote
+
+from base import LunchoTests
+
+
+class TestSeed(LunchoTests):
+    """Tests for the synthetic dataset."""
+
+    def generate(self, seed_value=42):
+        return seed.generate(users=30, groups=5, places=40, days=3,
+                             seed=seed_value)
+
+    def test_counts(self):
+        """The counts returned match what was inserted."""
+        counts = self.generate()
+        self.assertEqual(counts['users'], 30)
+        self.assertEqual(counts['groups'], 5)
+        self.assertEqual(counts['places'], 40)
+        self.assertEqual(User.query.count(), counts['users'])
+        self.assertEqual(Group.query.count(), counts['groups'])
+        self.assertEqual(Place.query.count(), counts['places'])
+        self.assertEqual(Vote.query.count(), counts['votes'])
+        self.assertEqual(CastedVote.query.count(), counts['casted_votes'])
+        return
+
+    def test_deterministic(self):
+        """The same seed generates the same data."""
+        first = self.generate()
+        votes = [(vote.user, vote.group, vote.created_at)
+                 for vote in Vote.query.order_by(Vote.cast)]
+        self.assertEqual(self.generate(), first)
+        self.assertEqual([(vote.user, vote.group, vote.created_at)
+                          for vote in Vote.query.order_by(Vote.cast)],
+                         votes)
+        return
+
+    def test_one_vote_a_day(self):
+        """Users vote once a day."""
+        self.generate()
+        repeated = server.db.session.query(Vote.user, Vote.created_at) \
+            .group_by(Vote.user, Vote.created_at) \
+            .having(func.count(Vote.cast) > 1) \
+            .all()
+        self.assertEqual(repeated, [])
+        return
+
+    def test_login(self):
+        """Generated users can get a token."""
+        self.generate()
+        rv = self.post('/token/', {'username': 'user1',
+                                   'password': seed.PASSWORD})
+        self.assertJsonOk(rv)
+        return
+
+    def test_indexes(self):
+        """Indexes are back after the load."""
+        self.generate()
+        connection = server.db.session.connection()
+        indexes = [row[1] for row in connection.execute(
+            "SELECT type, name FROM sqlite_master WHERE type = 'index'")]
+        self.assertIn('ix_vote_group_created_at', indexes)
+        return
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+import unittest
+import datetime
+import json
+
+from luncho import server
+from luncho import serializer
+
+from luncho.blueprints.voting import PlacesVotedMoreThanOnceException
+
+from base import LunchoTests
+from base import _token_header
+
+
+class Point(object):
+    def __init__(self, x, y):
+        self.x = x
+        self.y = y
+
+    def __str__(self):
+        return '{0},{1}'.format(self.x, self.y)
+
+
+class TestEncoders(unittest.TestCase):
+    """Tests for the type encoders."""
+
+    def test_dates(self):
+        """Dates are encoded in ISO 8601."""
+        self.assertEqual(serializer.default(datetime.date(2015, 1, 2)),
+                         '2015-01-02')
+        self.assertEqual(
+            serializer.default(datetime.datetime(2015, 1, 2, 3, 4, 5)),
+            '2015-01-02T03:04:05')
+        return
+
+    def test_sets(self):
+        """Sets become lists."""
+        self.assertEqual(sorted(serializer.default(set([3, 1, 2]))),
+                         [1, 2, 3])
+        self.assertEqual(serializer.default(frozenset([1])), [1])
+        return
+
+    def test_dict_views(self):
+        """Dict views become lists."""
+        values = {'a': 1, 'b': 2}
+        view = getattr(values, 'viewvalues', values.values)()
+        self.assertEqual(sorted(serializer.default(view)), [1, 2])
+        return
+
+    def test_subclass(self):
+        """Subclasses use the encoder of their base."""
+        class Places(set):
+            pass
+
+        self.assertEqual(serializer.default(Places([1])), [1])
+        return
+
+    def test_fallback(self):
+        """Unknown objects become their str()."""
+        self.assertEqual(serializer.default(Point(1, 2)), '1,2')
+        return
+
+    def test_register(self):
+        """New types can be registered."""
+        serializer.register(Point, lambda point: [point.x, point.y])
+        try:
+            self.assertEqual(serializer.default(Point(1, 2)), [1, 2])
+        finally:
+            del serializer.ENCODERS[Point]
+        return
+
+    def test_backends(self):
+        """All the installed backends encode the same thing."""
+        payload = {'date': datetime.date(2015, 1, 2),
+                   'places': set([1]),
+                   'name': u'Caf\xe9'}
+        for name in serializer.available():
+            encoded = serializer.backend(name)(payload, None)
+            self.assertEqual(json.loads(encoded),
+                             {'date': '2015-01-02',
+                              'places': [1],
+                              'name': u'Caf\xe9'})
+        return
+
+    def test_unknown_backend(self):
+        """Asking for a backend that isn't installed fails."""
+        self.assertRaises(ValueError, serializer.backend, 'nope')
+        return
+
+
+class TestResponses(LunchoTests):
+    """Tests for the JSON responses."""
+
+    def test_compact(self):
+        """Responses are compact by default."""
+        rv = self.get('/')
+        self.assertJsonOk(rv)
+        self.assertFalse('\n' in rv.data)
+        self.assertFalse('": ' in rv.data)
+        return
+
+    def test_pretty(self):
+        """Responses can be indented."""
+        server.app.config['JSONIFY_PRETTYPRINT_REGULAR'] = True
+        try:
+            rv = self.get('/')
+        finally:
+            server.app.config['JSONIFY_PRETTYPRINT_REGULAR'] = False
+        self.assertJsonOk(rv)
+        self.assertTrue('\n  "' in rv.data)
+        return
+
+    def test_errors(self):
+        """Errors with sets are encoded."""
+        error = PlacesVotedMoreThanOnceException(set([1, 2]))
+        with server.app.test_request_context():
+            rv = error.response()
+        self.assertJsonError(rv, 409, 'Places voted more than once')
+        self.assertEqual(sorted(json.loads(rv.data)['places']), [1, 2])
+        return
+
+
+@unittest.skipIf(serializer.msgpack is None, 'msgpack is not installed')
+class TestMessagePack(LunchoTests):
+    """Tests for MessagePack requests and responses."""
+
+    def setUp(self):
+        super(TestMessagePack, self).setUp()
+        self.default_user()
+        return
+
+    def request(self, method, url, data=None, token=None):
+        headers = _token_header(token) or {}
+        headers['Accept'] = serializer.MSGPACK
+        body = None
+        if data is not None:
+            body = serializer.packb(data)
+        rv = self.app.open(url,
+                           method=method,
+                           data=body,
+                           content_type=serializer.MSGPACK,
+                           headers=headers)
+        return (rv, serializer.unpackb(rv.data))
+
+    def test_response(self):
+        """Clients asking for MessagePack get MessagePack."""
+        (rv, data) = self.request('GET', '/')
+        self.assertEqual(rv.mimetype, serializer.MSGPACK)
+        self.assertEqual(data, json.loads(self.get('/').data))
+        self.assertTrue('Accept' in rv.headers['Vary'])
+        return
+
+    def test_error(self):
+        """Errors are in MessagePack too."""
+        (rv, data) = self.request('GET', '/vote/1/')
+        self.assertStatusCode(rv, 401)
+        self.assertEqual(data['message'], 'Request requires authentication')
+        return
+
+    def test_request_body(self):
+        """Request bodies can be in MessagePack."""
+        (rv, data) = self.request('POST', '/token/',
+                                  {'username': 'test', 'password': 'hash'})
+        self.assertStatusCode(rv, 200)
+        self.assertEqual(data['status'], 'OK')
+        self.assertTrue(data['token'])
+        return
+
+    def test_invalid_body(self):
+        """Bodies that aren't a MessagePack map are refused."""
+        rv = self.app.post('/token/',
+                           data='\xc1',      # never used in MessagePack
+                           content_type=serializer.MSGPACK)
+        self.assertJsonError(rv, 400, 'Request MUST be in JSON format')
+
+        rv = self.app.post('/token/',
+                           data=serializer.packb([1, 2]),
+                           content_type=serializer.MSGPACK)
+        self.assertJsonError(rv, 400, 'Request MUST be in JSON format')
+        return
+
+    def test_streamed_list(self):
+        """Streamed lists are sent whole."""
+        token = self.user.token
+        (rv, data) = self.request('POST', '/group/', {'name': 'Group'},
+                                  token=token)
+        group_id = data['id']
+
+        url = '/group/{group}/users/?stream=true'.format(group=group_id)
+        (rv, data) = self.request('GET', url, token=token)
+        self.assertEqual(rv.mimetype, serializer.MSGPACK)
+        self.assertEqual(data['status'], 'OK')
+        self.assertEqual([user['username'] for user in data['users']],
+                         ['test'])
+        self.assertFalse('next' in data)
+
+        (rv, data) = self.request('GET', url + '&limit=1', token=token)
+        self.assertEqual(len(data['users']), 1)
+        self.assertIsNone(data['next'])
+        return
+
+
+@unittest.skipIf(serializer.msgpack is not None, 'msgpack is installed')
+class TestWithoutMessagePack(LunchoTests):
+    """Tests for servers without msgpack."""
+
+    def test_json(self):
+        """Clients asking for MessagePack get JSON."""
+        rv = self.app.get('/', headers={'Accept': serializer.MSGPACK})
+        self.assertJsonOk(rv)
+        self.assertEqual(rv.mimetype, serializer.JSON)
+        return
+
+
+if __name__ == '__main__':
+    unittest.main()
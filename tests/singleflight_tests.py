@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+import unittest
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from luncho import server
+from luncho import metrics
+from luncho import singleflight
+
+from luncho.singleflight import SingleFlight
+
+
+class TestSingleFlight(unittest.TestCase):
+    """Tests for the coalescing of computations in a process."""
+
+    def setUp(self):
+        self.flights = SingleFlight()
+        self.calls = []
+        self.release = threading.Event()
+        return
+
+    def compute(self, value):
+        self.calls.append(value)
+        self.release.wait(5)
+        return value
+
+    def run_all(self, keys):
+        """Ask for the keys, each in a thread, while the first computation
+        is blocked; return the results."""
+        results = [None] * len(keys)
+
+        def ask(pos, key):
+            with server.app.app_context():
+                try:
+                    results[pos] = self.flights.do(
+                        'test', key, lambda: self.compute(key))
+                except Exception as error:
+                    results[pos] = error
+
+        threads = [threading.Thread(target=ask, args=(pos, key))
+                   for (pos, key) in enumerate(keys)]
+        for thread in threads:
+            thread.start()
+
+        # wait till everybody is in (waiting or computing)
+        deadline = time.time() + 5
+        while self.flights.in_flight() < len(set(keys)) and \
+                time.time() < deadline:
+            time.sleep(0.01)
+        time.sleep(0.05)
+        self.release.set()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_coalesced(self):
+        """Concurrent computations of a key run once."""
+        before = metrics.SINGLE_FLIGHT.values.get(('test', 'thread'), 0)
+        results = self.run_all(['key'] * 10)
+        self.assertEqual(results, ['key'] * 10)
+        self.assertEqual(self.calls, ['key'])
+        self.assertEqual(
+            metrics.SINGLE_FLIGHT.values[('test', 'thread')] - before, 9)
+        self.assertEqual(self.flights.in_flight(), 0)
+        return
+
+    def test_keys(self):
+        """Different keys run separately."""
+        results = self.run_all(['one', 'two', 'one'])
+        self.assertEqual(results, ['one', 'two', 'one'])
+        self.assertEqual(sorted(self.calls), ['one', 'two'])
+        return
+
+    def test_error(self):
+        """The waiting threads get the error of the computation."""
+        def fail(key):
+            self.calls.append(key)
+            self.release.wait(5)
+            raise ValueError(key)
+        self.compute = fail
+
+        results = self.run_all(['key'] * 3)
+        self.assertEqual(len(self.calls), 1)
+        for result in results:
+            self.assertTrue(isinstance(result, ValueError))
+        return
+
+    def test_sequential(self):
+        """Nothing is kept after the computation."""
+        self.release.set()
+        with server.app.app_context():
+            self.flights.do('test', 'key', lambda: self.compute(1))
+            self.flights.do('test', 'key', lambda: self.compute(2))
+        self.assertEqual(self.calls, [1, 2])
+        return
+
+
+@unittest.skipIf(singleflight.fcntl is None, 'no file locks here')
+class TestProcesses(unittest.TestCase):
+    """Tests for the coalescing across processes."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        server.app.config['SINGLE_FLIGHT_DIR'] = self.directory
+        self.calls = []
+        return
+
+    def tearDown(self):
+        server.app.config['SINGLE_FLIGHT_DIR'] = None
+        server.app.config['SINGLE_FLIGHT_TTL'] = \
+            server.Settings.SINGLE_FLIGHT_TTL
+        shutil.rmtree(self.directory)
+        return
+
+    def compute(self, value):
+        self.calls.append(value)
+        return {'value': value}
+
+    def test_shared(self):
+        """The result of a process is used by the others."""
+        # (each SingleFlight stands for the one of a process)
+        with server.app.app_context():
+            first = SingleFlight().do('test', 'key',
+                                      lambda: self.compute(1))
+            second = SingleFlight().do('test', 'key',
+                                       lambda: self.compute(2))
+            other = SingleFlight().do('test', 'other',
+                                      lambda: self.compute(3))
+        self.assertEqual(first, {'value': 1})
+        self.assertEqual(second, {'value': 1})
+        self.assertEqual(other, {'value': 3})
+        self.assertEqual(self.calls, [1, 3])
+        return
+
+    def test_expired(self):
+        """Old results are computed again."""
+        server.app.config['SINGLE_FLIGHT_TTL'] = -1
+        with server.app.app_context():
+            SingleFlight().do('test', 'key', lambda: self.compute(1))
+            result = SingleFlight().do('test', 'key',
+                                       lambda: self.compute(2))
+        self.assertEqual(result, {'value': 2})
+        self.assertEqual(self.calls, [1, 2])
+        return
+
+    def test_cleanup(self):
+        """Old files are removed."""
+        with server.app.app_context():
+            SingleFlight().do('test', 'key', lambda: self.compute(1))
+        self.assertEqual(len(os.listdir(self.directory)), 2)
+
+        singleflight.cleanup(self.directory, 60)
+        self.assertEqual(len(os.listdir(self.directory)), 2)
+        singleflight.cleanup(self.directory, -1)
+        self.assertEqual(os.listdir(self.directory), [])
+        return
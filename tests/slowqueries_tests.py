@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+import unittest
+import logging
+
+from luncho import server
+from luncho import slowqueries
+
+from base import LunchoTests
+
+
+class RecordHandler(logging.Handler):
+    """Keep the log messages."""
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+class TestSlowQueries(LunchoTests):
+    """Tests for the slow query log."""
+
+    def setUp(self):
+        super(TestSlowQueries, self).setUp()
+        self.default_user()
+        self.handler = RecordHandler()
+        slowqueries.LOG.addHandler(self.handler)
+        slowqueries._explained.clear()
+        self.threshold = server.app.config['SLOW_QUERY_THRESHOLD']
+        server.app.config['SLOW_QUERY_THRESHOLD'] = 0.0   # everything
+        return
+
+    def tearDown(self):
+        server.app.config['SLOW_QUERY_THRESHOLD'] = self.threshold
+        slowqueries.LOG.removeHandler(self.handler)
+        super(TestSlowQueries, self).tearDown()
+        return
+
+    def _plans(self):
+        return [message for message in self.handler.messages
+                if message.startswith('Plan for')]
+
+    def test_slow_query(self):
+        """Slow queries are logged with the endpoint and the plan."""
+        token = self.user.token
+        self.get('/place/', token=token)
+
+        queries = [message for message in self.handler.messages
+                   if message.startswith('Slow query')]
+        self.assertTrue(queries)
+        self.assertTrue(all('places.get_places' in message
+                            for message in queries))
+
+        # the token search uses the index
+        plans = [plan for plan in self._plans() if 'user.token' in plan]
+        self.assertEqual(len(plans), 1)
+        self.assertTrue('USING INDEX ix_user_token' in plans[0])
+        return
+
+    def test_explained_once(self):
+        """The same statement is explained only once."""
+        token = self.user.token
+        self.get('/place/', token=token)
+        plans = len(self._plans())
+        self.get('/place/', token=token)
+        self.assertEqual(len(self._plans()), plans)
+        return
+
+    def test_disabled(self):
+        """Nothing is logged without a threshold."""
+        server.app.config['SLOW_QUERY_THRESHOLD'] = None
+        self.get('/place/', token=self.user.token)
+        self.assertEqual(self.handler.messages, [])
+        return
+
+    def test_shape(self):
+        """IN lists of different sizes have the same shape."""
+        self.assertEqual(slowqueries.shape('SELECT 1 WHERE a IN (?, ?, ?)'),
+                         slowqueries.shape('SELECT 1\n WHERE a IN (?)'))
+        return
+
+
+class FakeCursor(object):
+    """DBAPI cursor that keeps the statements and fails EXPLAINs."""
+    def __init__(self, statements):
+        self.statements = statements
+
+    def execute(self, statement, parameters=None):
+        self.statements.append(statement)
+        if statement.startswith('EXPLAIN'):
+            raise ValueError('failed')
+
+    def close(self):
+        pass
+
+
+class FakeConnection(object):
+    """Just enough of a PostgreSQL connection for explain."""
+    def __init__(self):
+        self.statements = []
+        self.dialect = type('Dialect', (object,), {'name': 'postgresql'})
+        self.connection = self
+
+    def cursor(self):
+        return FakeCursor(self.statements)
+
+
+class TestExplainSavepoint(unittest.TestCase):
+    """Tests for explaining in a savepoint."""
+
+    def test_failed(self):
+        """A failed EXPLAIN is rolled back to the savepoint."""
+        conn = FakeConnection()
+        with self.assertRaises(ValueError):
+            slowqueries.explain(conn, 'SELECT 1', ())
+        self.assertEqual(conn.statements,
+                         ['SAVEPOINT luncho_explain',
+                          'EXPLAIN SELECT 1',
+                          'ROLLBACK TO SAVEPOINT luncho_explain'])
+        return
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+import unittest
+import json
+import os
+import shutil
+import tempfile
+
+from luncho import server
+
+from base import LunchoTests
+
+
+class TestTracing(LunchoTests):
+    """Tests for the request tracing."""
+
+    def setUp(self):
+        super(TestTracing, self).setUp()
+        self.directory = tempfile.mkdtemp()
+        self.trace_file = os.path.join(self.directory, 'traces.json')
+        server.app.config['TRACE_FILE'] = self.trace_file
+        server.app.config['TRACE_SAMPLE_RATE'] = 1.0
+        self.default_user()
+        return
+
+    def tearDown(self):
+        server.app.config['TRACE_SAMPLE_RATE'] = 0.0
+        shutil.rmtree(self.directory)
+        super(TestTracing, self).tearDown()
+        return
+
+    def _traces(self):
+        """Return the spans of each trace written."""
+        traces = []
+        with open(self.trace_file) as content:
+            for line in content:
+                request = json.loads(line)
+                scope = request['resourceSpans'][0]['scopeSpans'][0]
+                traces.append(scope['spans'])
+        return traces
+
+    def test_spans(self):
+        """A traced request has spans for the request, auth and queries."""
+        rv = self.post('/place/', {'name': 'Place'}, token=self.user.token)
+        self.assertJsonOk(rv)
+
+        spans = self._traces()[-1]
+        names = [span['name'] for span in spans]
+        self.assertEqual(names[0], 'places.create_place')
+        self.assertTrue('parse_json' in names)
+        self.assertTrue('auth' in names)
+        self.assertTrue('db.query' in names)
+        self.assertTrue('db.commit' in names)
+
+        # every span is inside the request span
+        root = spans[0]
+        self.assertFalse('parentSpanId' in root)
+        for span in spans[1:]:
+            self.assertEqual(span['traceId'], root['traceId'])
+            self.assertTrue(int(span['startTimeUnixNano']) >=
+                            int(root['startTimeUnixNano']))
+            self.assertTrue(int(span['endTimeUnixNano']) <=
+                            int(root['endTimeUnixNano']))
+
+        # queries in the auth are children of the auth span
+        auth = [span for span in spans if span['name'] == 'auth'][0]
+        self.assertTrue(any(span.get('parentSpanId') == auth['spanId']
+                            for span in spans if span['name'] == 'db.query'))
+        self.assertEqual(rv.headers['traceparent'].split('-')[1],
+                         root['traceId'])
+        return
+
+    def test_propagated_trace(self):
+        """The trace id comes from the traceparent header."""
+        server.app.config['TRACE_SAMPLE_RATE'] = 0.0
+        trace_id = '0af7651916cd43dd8448eb211c80319c'
+        parent = 'b7ad6b7169203331'
+        rv = self.app.get('/', headers={
+            'traceparent': '00-{trace}-{parent}-01'.format(trace=trace_id,
+                                                           parent=parent)})
+        self.assertJsonOk(rv)
+
+        root = self._traces()[-1][0]
+        self.assertEqual(root['traceId'], trace_id)
+        self.assertEqual(root['parentSpanId'], parent)
+        return
+
+    def test_not_sampled(self):
+        """Requests are not traced when the caller says so."""
+        rv = self.app.get('/', headers={
+            'traceparent': '00-0af7651916cd43dd8448eb211c80319c-'
+                           'b7ad6b7169203331-00'})
+        self.assertJsonOk(rv)
+        self.assertFalse('traceparent' in rv.headers)
+        self.assertFalse(os.path.exists(self.trace_file))
+        return
+
+if __name__ == '__main__':
+    unittest.main()
@@ -112,7 +112,9 @@ class TestExistingUsers(LunchoTests):
 
     def test_delete_user(self):
         """Delete a user."""
-        rv = self.delete('/user/', token=self.user.token)
+        token = self.user.token
+        del self.user       # the user won't exist for tearDown
+        rv = self.delete('/user/', token=token)
         self.assertJsonOk(rv)
 
         # check the database
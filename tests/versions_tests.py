@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+import json
+
+from luncho import server
+from luncho import versions
+
+from luncho.server import Group
+from luncho.server import User
+from luncho.server import Version
+
+from base import LunchoTests
+from base import _token_header
+
+
+class TestVersions(LunchoTests):
+    """Tests for the version counters."""
+
+    def test_bump(self):
+        """Keys start at 1 and go up with each bump."""
+        with server.app.test_request_context():
+            versions.bump(['group:1', 'user:test'])
+            versions.bump(['group:1'])
+            server.db.session.commit()
+            self.assertEqual(versions.current(['group:1', 'user:test',
+                                               'tally:1']),
+                             {'group:1': 2, 'user:test': 1})
+        self.assertEqual(Version.query.count(), 2)
+        return
+
+    def test_born(self):
+        """Groups and users get their counters when created; created again,
+        the counters go on."""
+        self.default_user()
+        group = Group(name='Group', owner=self.user)
+        server.db.session.add(group)
+        server.db.session.commit()
+        group_id = group.id
+        with server.app.test_request_context():
+            self.assertEqual(versions.current(['user:test',
+                                               versions.group(group_id),
+                                               versions.tally(group_id)]),
+                             {'user:test': 0,
+                              versions.group(group_id): 0,
+                              versions.tally(group_id): 0})
+
+            with self.recordQueries() as statements:
+                versions.bump([versions.group(group_id), 'user:test'])
+            self.assertEqual(len(statements), 1)
+            server.db.session.commit()
+
+        server.db.session.delete(Group.query.get(group_id))
+        server.db.session.commit()
+        other = Group(name='Other', owner=User.query.get('test'))
+        other.id = group_id
+        server.db.session.add(other)
+        server.db.session.commit()
+        with server.app.test_request_context():
+            self.assertEqual(
+                versions.current([versions.group(group_id)]),
+                {versions.group(group_id): 2})
+        return
+
+
+class TestConditional(LunchoTests):
+    """Tests for the conditional requests."""
+
+    def setUp(self):
+        super(TestConditional, self).setUp()
+        self.default_user()
+        self.token = self.user.token
+
+        rv = self.post('/group/', {'name': 'Group'}, token=self.token)
+        self.group_id = json.loads(rv.data)['id']
+        rv = self.post('/place/', {'name': 'Place'}, token=self.token)
+        self.place_id = json.loads(rv.data)['id']
+        self.post('/group/{group}/places/'.format(group=self.group_id),
+                  {'places': [self.place_id]},
+                  token=self.token)
+        return
+
+    def conditional(self, url, etag, token=None, **headers):
+        headers.update(_token_header(token or self.token))
+        headers['If-None-Match'] = etag
+        return self.app.get(url, headers=headers)
+
+    def assertNotModified(self, url, token=None):
+        """Assert that the second request for the URL is a 304, without
+        running the view; return the ETag."""
+        rv = self.get(url, token=token or self.token)
+        self.assertJsonOk(rv)
+        etag = rv.headers['ETag']
+
+        with self.recordQueries() as statements:
+            rv = self.conditional(url, etag, token)
+        self.assertStatusCode(rv, 304)
+        self.assertEqual(rv.headers['ETag'], etag)
+        self.assertEqual(rv.data, '')
+        self.assertTrue(len(statements) <= 3)
+        return etag
+
+    def assertModified(self, url, etag, token=None):
+        rv = self.conditional(url, etag, token)
+        self.assertJsonOk(rv)
+        self.assertNotEqual(rv.headers['ETag'], etag)
+        return
+
+    def test_vote(self):
+        """Votes change the results."""
+        url = '/vote/{group}/'.format(group=self.group_id)
+        etag = self.assertNotModified(url)
+
+        self.post(url, {'choices': [self.place_id]}, token=self.token)
+        self.assertModified(url, etag)
+        return
+
+    def test_group_places(self):
+        """Adding and removing places change the lists of places."""
+        url = '/group/{group}/places/'.format(group=self.group_id)
+        etag = self.assertNotModified(url)
+
+        self.delete('/group/{group}/places/{place}/'.format(
+            group=self.group_id, place=self.place_id), token=self.token)
+        self.assertModified(url, etag)
+        return
+
+    def test_pages(self):
+        """Each page has its own ETag."""
+        url = '/group/{group}/places/'.format(group=self.group_id)
+        etag = self.assertNotModified(url)
+        self.assertModified(url + '?limit=1', etag)
+        return
+
+    def test_place_rename(self):
+        """Renaming a place changes the lists where it appears."""
+        group_url = '/group/{group}/places/'.format(group=self.group_id)
+        group_etag = self.assertNotModified(group_url)
+        places_etag = self.assertNotModified('/place/')
+
+        self.put('/place/{place}/'.format(place=self.place_id),
+                 {'name': 'Other place'},
+                 token=self.token)
+        self.assertModified(group_url, group_etag)
+        self.assertModified('/place/', places_etag)
+        return
+
+    def test_user_groups(self):
+        """Renaming a group changes the groups of its members."""
+        etag = self.assertNotModified('/group/')
+
+        self.put('/group/{group}/'.format(group=self.group_id),
+                 {'name': 'Other group'},
+                 token=self.token)
+        self.assertModified('/group/', etag)
+        return
+
+    def test_new_member(self):
+        """New members see the new group, and its places."""
+        other = self.create_user(name='other', create_token=True)
+        token = other.token
+        groups_etag = self.assertNotModified('/group/', token)
+        places_etag = self.assertNotModified('/place/', token)
+
+        self.post('/group/{group}/users/'.format(group=self.group_id),
+                  {'usernames': ['other']},
+                  token=self.token)
+        self.assertModified('/group/', groups_etag, token)
+        self.assertModified('/place/', places_etag, token)
+        return
+
+    def test_member_name(self):
+        """Changing the name of a user changes the members lists."""
+        url = '/group/{group}/users/'.format(group=self.group_id)
+        etag = self.assertNotModified(url)
+
+        self.put('/user/', {'full_name': 'Other Name'}, token=self.token)
+        self.assertModified(url, etag)
+        return
+
+    def test_delete_group(self):
+        """Deleted groups disappear from the groups of the members."""
+        etag = self.assertNotModified('/group/')
+
+        self.delete('/group/{group}/'.format(group=self.group_id),
+                    token=self.token)
+        self.assertModified('/group/', etag)
+        return
+
+    def test_not_member(self):
+        """Users outside the group can't use the ETag of the group."""
+        url = '/vote/{group}/'.format(group=self.group_id)
+        etag = self.get(url, token=self.token).headers['ETag']
+
+        other = self.create_user(name='other', create_token=True)
+        rv = self.conditional(url, etag, other.token)
+        self.assertJsonError(rv, 403, 'User is not member of this group')
+        return
+
+    def test_compressed(self):
+        """Compressed responses have their own ETags."""
+        server.app.config['COMPRESS_MIN_SIZE'] = 0
+        try:
+            url = '/vote/{group}/'.format(group=self.group_id)
+            headers = _token_header(self.token)
+            headers['Accept-Encoding'] = 'gzip'
+            rv = self.app.get(url, headers=headers)
+            etag = rv.headers['ETag']
+            self.assertTrue(etag.endswith('-gzip"'))
+
+            rv = self.conditional(url, etag, **{'Accept-Encoding': 'gzip'})
+            self.assertStatusCode(rv, 304)
+            self.assertEqual(rv.headers['ETag'], etag)
+        finally:
+            server.app.config['COMPRESS_MIN_SIZE'] = \
+                server.Settings.COMPRESS_MIN_SIZE
+        return
+
+    def test_ballot(self):
+        """Places moving away change the ballot."""
+        url = '/group/{group}/places/ballot/'.format(group=self.group_id)
+        self.put('/group/{group}/'.format(group=self.group_id),
+                 {'office': {'latitude': 0, 'longitude': 0, 'radius': 1000}},
+                 token=self.token)
+        etag = self.assertNotModified(url)
+
+        self.put('/place/{place}/'.format(place=self.place_id),
+                 {'latitude': 10, 'longitude': 10},
+                 token=self.token)
+        self.assertModified(url, etag)
+        self.assertEqual(json.loads(self.get(url, self.token).data)['places'],
+                         [])
+        return
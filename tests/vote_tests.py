@@ -2,13 +2,29 @@
 # -*- encoding: utf-8 -*-
 
 import unittest
+import datetime
 import json
+import os
+import tempfile
+import threading
+import time
 
 from luncho import server
+from luncho import queries
 
 from base import LunchoTests
+from luncho.server import User
 from luncho.server import Group
 from luncho.server import Place
+from luncho.server import Vote
+from luncho.server import CastedVote
+from luncho.server import user_groups
+from luncho.server import group_places
+
+from luncho import purge
+from luncho.purge import purger
+from luncho.subscriptions import subscriptions
+from luncho.subscriptions import Subscriptions
 
 
 class TestVote(LunchoTests):
@@ -275,6 +291,35 @@ class TestVote(LunchoTests):
         self.assertFalse(data['closed'])    # voting shouldn't be closed yet
         return
 
+    def test_get_results_many_votes(self):
+        """The results take the same queries, no matter how many votes."""
+        group = self._group()
+        places = [self._place(), self._place()]
+        for place in places:
+            group.places.append(place)
+        for pos in range(5):
+            user = self.create_user(name='voter{pos}'.format(pos=pos))
+            user.groups.append(group)
+            vote = Vote(user, group.id)
+            server.db.session.add(vote)
+            server.db.session.flush()
+            for (order, place) in enumerate(places):
+                server.db.session.add(CastedVote(vote, order, place.id))
+        server.db.session.commit()
+        group_id = group.id
+        token = self.user.token
+
+        # (+1 for the versions)
+        with self.assertMaxQueries(9):
+            rv = self.get('/vote/{group_id}/'.format(group_id=group_id),
+                          token=token)
+        self.assertJsonOk(rv, closed=False)
+
+        data = json.loads(rv.data)
+        self.assertEqual([result['points'] for result in data['results']],
+                         [2.5, 5.0])
+        return
+
     def test_get_results_unknown_group(self):
         """Try to get the results of a group that doesn't exist."""
         rv = self.get('/vote/{group_id}/'.format(group_id=100),
@@ -311,5 +356,351 @@ class TestVote(LunchoTests):
         return
 
 
+class TestWaitVote(LunchoTests):
+    """Tests for long polling the results."""
+
+    def setUp(self):
+        super(TestWaitVote, self).setUp()
+        self.default_user()
+        group = Group(name='Test group', owner=self.user)
+        place = Place(name='Place', owner=self.user)
+        server.db.session.add(group)
+        server.db.session.add(place)
+        group.places.append(place)
+        self.user.groups.append(group)
+        server.db.session.commit()
+
+        self.group_id = group.id
+        self.place_id = place.id
+        self.token = self.user.token
+        return
+
+    def _wait(self, votes, timeout):
+        url = '/vote/{group}/wait/?votes={votes}&timeout={timeout}'.format(
+            group=self.group_id, votes=votes, timeout=timeout)
+        start = time.time()
+        rv = self.get(url, token=self.token)
+        return (rv, time.time() - start)
+
+    def test_new_votes(self):
+        """With votes the client doesn't know about, there is no wait."""
+        self.post('/vote/{group}/'.format(group=self.group_id),
+                  {'choices': [self.place_id]},
+                  token=self.token)
+        with self.assertMaxQueries(11):
+            (rv, elapsed) = self._wait(0, 5)
+        self.assertJsonOk(rv, votes=1, closed=True)
+        self.assertTrue(elapsed < 1)
+        return
+
+    def test_timeout(self):
+        """Without votes, the status comes after the timeout."""
+        (rv, elapsed) = self._wait(0, 0.2)
+        self.assertJsonOk(rv, votes=0, closed=False, results=[])
+        self.assertTrue(elapsed >= 0.2)
+        return
+
+    def test_timeout_limit(self):
+        """The timeout can't be longer than LONG_POLL_TIMEOUT."""
+        server.app.config['LONG_POLL_TIMEOUT'] = 0.1
+        try:
+            (rv, elapsed) = self._wait(0, 30)
+        finally:
+            server.app.config['LONG_POLL_TIMEOUT'] = 25
+        self.assertJsonOk(rv)
+        self.assertTrue(elapsed < 5)
+        return
+
+    def test_invalid_timeout(self):
+        """The timeout must be a finite number."""
+        for timeout in ['nan', 'inf', '-inf']:
+            (rv, elapsed) = self._wait(0, timeout)
+            self.assertJsonError(rv, 400, 'Invalid timeout')
+        self.assertEqual(subscriptions.subscribers(), 0)
+        return
+
+    def test_failed_check(self):
+        """The subscription is dropped even if the first check fails."""
+        votes_today = queries.votes_today
+
+        def failing(group_id):
+            raise RuntimeError('failed')
+
+        queries.votes_today = failing
+        try:
+            (rv, elapsed) = self._wait(0, 10)
+        except RuntimeError:
+            pass
+        finally:
+            queries.votes_today = votes_today
+        self.assertEqual(subscriptions.subscribers(), 0)
+        return
+
+    def test_notified(self):
+        """A vote wakes the clients waiting on the group."""
+        timer = threading.Timer(0.1, subscriptions.notify, [self.group_id])
+        timer.start()
+        (rv, elapsed) = self._wait(0, 10)
+        timer.join()
+        self.assertJsonOk(rv)
+        self.assertTrue(elapsed < 5)
+        self.assertEqual(subscriptions.subscribers(), 0)
+        return
+
+    def test_not_member(self):
+        """Only members can wait for votes."""
+        user = self.create_user(name='newUser', create_token=True)
+        rv = self.get('/vote/{group}/wait/'.format(group=self.group_id),
+                      token=user.token)
+        self.assertJsonError(rv, 403, 'User is not member of this group')
+        return
+
+
+class TestSubscriptions(unittest.TestCase):
+    """Tests for the subscriptions to votes."""
+
+    def test_notify(self):
+        """Notifying wakes only the subscribers of the group."""
+        subs = Subscriptions()
+        woken = []
+
+        def waiter(group_id):
+            waiters = subs.subscribe(group_id)
+            try:
+                woken.append((group_id, subs.wait(group_id, waiters, 2)))
+            finally:
+                subs.unsubscribe(group_id, waiters)
+
+        threads = [threading.Thread(target=waiter, args=(group_id,))
+                   for group_id in [1, 1, 2]]
+        for thread in threads:
+            thread.start()
+        while subs.subscribers() < 3:
+            time.sleep(0.01)
+
+        subs.notify(1)
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sorted(woken), [(1, True), (1, True), (2, False)])
+        self.assertEqual(subs.groups, {})
+        return
+
+    def test_unsubscribe(self):
+        """Subscriptions are dropped when nobody is waiting."""
+        subs = Subscriptions()
+        waiters = subs.subscribe(1)
+        subs.unsubscribe(1, waiters)
+        self.assertEqual(subs.groups, {})
+        subs.notify(1)      # nobody to wake up
+        return
+
+
+class TestDeleteVoted(LunchoTests):
+    """Deleting groups, places and users with votes."""
+    def setUp(self):
+        super(TestDeleteVoted, self).setUp()
+        self._populate()
+        return
+
+    def _populate(self):
+        """Add a group with two places and a few days of votes."""
+        self.default_user()
+        self.token = self.user.token
+
+        group = Group(name='Test group', owner=self.user)
+        server.db.session.add(group)
+        self.user.groups.append(group)
+        self.places = []
+        for name in ['First', 'Second']:
+            place = Place(name=name, owner=self.user)
+            server.db.session.add(place)
+            group.places.append(place)
+            self.places.append(place)
+        server.db.session.commit()
+        self.group = group.id
+
+        # there is one vote per day, so add the votes directly
+        for day in range(3):
+            vote = Vote(self.user, self.group)
+            server.db.session.add(vote)
+            server.db.session.flush()
+            for (order, place) in enumerate(self.places):
+                server.db.session.add(CastedVote(vote, order, place.id))
+        server.db.session.commit()
+        self.places = [place.id for place in self.places]
+        return
+
+    def _count(self, table, condition):
+        """Number of rows in the table that match the condition."""
+        return server.db.session.query(table).filter(condition).count()
+
+    def _assert_group_deleted(self):
+        """Check that nothing from the group was left behind."""
+        self.assertIsNone(Group.query.get(self.group))
+        self.assertEqual(self._count(Vote, Vote.group == self.group), 0)
+        self.assertEqual(CastedVote.query.count(), 0)
+        self.assertEqual(self._count(user_groups,
+                                     user_groups.c.group_id == self.group),
+                         0)
+        self.assertEqual(self._count(group_places,
+                                     group_places.c.group == self.group),
+                         0)
+        self.assertEqual(Place.query.count(), 2)   # places stay
+        return
+
+    def test_delete_group(self):
+        """Deleting a group removes the memberships, places and votes."""
+        rv = self.delete('/group/{group}/'.format(group=self.group),
+                         token=self.token)
+        self.assertJsonOk(rv)
+        self._assert_group_deleted()
+        return
+
+    def test_delete_place(self):
+        """Deleting a place removes it from groups and votes."""
+        place = self.places[0]
+        rv = self.delete('/place/{place}/'.format(place=place),
+                         token=self.token)
+        self.assertJsonOk(rv)
+
+        self.assertIsNone(Place.query.get(place))
+        self.assertEqual(self._count(CastedVote, CastedVote.place == place),
+                         0)
+        self.assertEqual(self._count(group_places,
+                                     group_places.c.place == place),
+                         0)
+        self.assertEqual(CastedVote.query.count(), 3)  # the other place
+        self.assertEqual(Vote.query.count(), 3)
+        return
+
+    def test_delete_user(self):
+        """Deleting a user removes the memberships, votes and groups, but
+        keeps the places."""
+        del self.user       # the user won't exist for tearDown
+        rv = self.delete('/user/', token=self.token)
+        self.assertJsonOk(rv)
+        purger.join()       # big groups are removed in background
+
+        self.assertIsNone(User.query.get('test'))
+        self.assertIsNone(Group.query.get(self.group))
+        self.assertEqual(Vote.query.count(), 0)
+        self.assertEqual(CastedVote.query.count(), 0)
+        self.assertEqual(self._count(user_groups,
+                                     user_groups.c.username == 'test'),
+                         0)
+
+        places = Place.query.all()
+        self.assertEqual(len(places), 2)
+        self.assertEqual([place.owner for place in places], [None, None])
+        return
+
+    def test_delete_user_atomic(self):
+        """A failure while deleting the user keeps everything, even the
+        groups already removed."""
+        delete_group_rows = purge._delete_group_rows
+
+        def failing(group_id):
+            delete_group_rows(group_id)
+            raise RuntimeError('failed')
+
+        purge._delete_group_rows = failing
+        try:
+            with server.app.test_request_context():
+                with self.assertRaises(RuntimeError):
+                    purge.delete_user('test')
+                server.db.session.rollback()
+        finally:
+            purge._delete_group_rows = delete_group_rows
+
+        self.assertIsNotNone(User.query.get('test'))
+        self.assertIsNotNone(Group.query.get(self.group))
+        self.assertEqual(Vote.query.count(), 3)
+        self.assertEqual(CastedVote.query.count(), 6)
+        return
+
+
+class TestBackgroundPurge(TestDeleteVoted):
+    """Deleting groups and places with more votes than the threshold."""
+    def setUp(self):
+        # the purge runs in another thread, which can't see an in-memory
+        # database
+        (handle, self.database) = tempfile.mkstemp(suffix='.db3')
+        os.close(handle)
+        self.threshold = server.app.config['PURGE_ASYNC_THRESHOLD']
+        self.batch = server.app.config['PURGE_BATCH_SIZE']
+
+        LunchoTests.setUp(self)
+        server.db.session.remove()      # drop connections to old databases
+        server.db.drop_all()
+        server.app.config['SQLALCHEMY_DATABASE_URI'] = \
+            'sqlite:///' + self.database
+        server.app.config['PURGE_ASYNC_THRESHOLD'] = 2
+        server.app.config['PURGE_BATCH_SIZE'] = 2
+        server.db.create_all()
+        self._populate()
+        return
+
+    def tearDown(self):
+        super(TestBackgroundPurge, self).tearDown()
+        server.db.session.remove()
+        server.app.config['PURGE_ASYNC_THRESHOLD'] = self.threshold
+        server.app.config['PURGE_BATCH_SIZE'] = self.batch
+        os.remove(self.database)
+        return
+
+    def test_delete_group(self):
+        """The group is detached right away and purged in background."""
+        rv = self.delete('/group/{group}/'.format(group=self.group),
+                         token=self.token)
+        self.assertJsonOk(rv)
+
+        # nobody can reach the group anymore
+        rv = self.get('/group/', token=self.token)
+        self.assertEqual(json.loads(rv.data)['groups'], [])
+
+        purger.join()
+        self._assert_group_deleted()
+        return
+
+    def test_delete_place(self):
+        """The place is detached right away and purged in background."""
+        place = self.places[0]
+        rv = self.delete('/place/{place}/'.format(place=place),
+                         token=self.token)
+        self.assertJsonOk(rv)
+
+        rv = self.get('/place/', token=self.token)
+        self.assertEqual(len(json.loads(rv.data)['places']), 1)
+
+        purger.join()
+        self.assertIsNone(Place.query.get(place))
+        self.assertEqual(self._count(CastedVote, CastedVote.place == place),
+                         0)
+        self.assertEqual(CastedVote.query.count(), 3)
+        return
+
+    def test_delete_user_old_votes(self):
+        """Old votes of the user are detached and purged in background."""
+        # the group stays, so only the user purge removes the votes
+        other = User(username='other', fullname='Other', passhash='hash')
+        server.db.session.add(other)
+        Group.query.get(self.group).owner = 'other'
+        yesterday = datetime.date.today() - datetime.timedelta(days=1)
+        for vote in Vote.query.all()[:2]:
+            vote.created_at = yesterday
+        server.db.session.commit()
+
+        del self.user
+        rv = self.delete('/user/', token=self.token)
+        self.assertJsonOk(rv)
+        purger.join()
+
+        self.assertIsNone(User.query.get('test'))
+        self.assertIsNotNone(Group.query.get(self.group))
+        self.assertEqual(Vote.query.count(), 0)
+        self.assertEqual(CastedVote.query.count(), 0)
+        return
+
+
 if __name__ == '__main__':
     unittest.main()